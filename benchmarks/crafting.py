@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+from time import time
+
+from bravo.blocks import blocks, items
+from bravo.ibravo import IRecipe
+from bravo.inventory import Slot, Workbench
+from bravo.plugin import retrieve_plugins
+
+def per_second(f, count, repetitions=10):
+    """
+    Time a function, returning a list of calls per second for each
+    repetition.
+    """
+
+    times = []
+    for i in range(repetitions):
+        before = time()
+        f(count)
+        after = time()
+        times.append(count / (after - before))
+    return times
+
+def pad_to_stride(recipe, rstride, cstride):
+    pad = (None,) * (cstride - rstride)
+    rows = [recipe[i:i + rstride] for i in range(0, len(recipe), rstride)]
+    padded = list(rows[0])
+    for row in rows[1:]:
+        padded.extend(pad)
+        padded.extend(row)
+    return padded
+
+def linear_check(inventory, recipes):
+    """
+    Match a crafting table by trying every recipe at every offset, as crafting
+    used to.
+    """
+
+    for name, recipe in sorted(recipes.iteritems()):
+        dims = recipe.dimensions
+
+        if (dims[0] > inventory.crafting_stride or
+            dims[1] > len(inventory.crafting) // inventory.crafting_stride):
+            continue
+
+        padded = pad_to_stride(recipe.recipe, dims[0],
+            inventory.crafting_stride)
+
+        for offset in range(len(inventory.crafting) - len(padded) + 1):
+            nones = inventory.crafting[:offset]
+            nones += inventory.crafting[len(padded) + offset:]
+            if not all(i is None for i in nones):
+                continue
+
+            matches_needed = len(padded)
+
+            for i, j in zip(padded,
+                inventory.crafting[offset:len(padded) + offset]):
+                if i is None and j is None:
+                    matches_needed -= 1
+                elif i is not None and j is not None:
+                    skey, scount = i
+                    if j.holds(skey) and j.quantity >= scount:
+                        matches_needed -= 1
+
+                if matches_needed == 0:
+                    return recipe, offset
+
+    return None
+
+def workbench(layout):
+    inventory = Workbench()
+    for i, item in enumerate(layout):
+        if item is not None:
+            inventory.crafting[i] = Slot(item.slot, 0, 1)
+    return inventory
+
+cobblestone = blocks["cobblestone"]
+stick = items["stick"]
+wood = blocks["wood"]
+
+# A furnace, a pickaxe, some sticks, and a layout which matches nothing.
+tables = [
+    workbench([cobblestone, cobblestone, cobblestone, cobblestone, None,
+        cobblestone, cobblestone, cobblestone, cobblestone]),
+    workbench([cobblestone, cobblestone, cobblestone, None, stick, None,
+        None, stick, None]),
+    workbench([None, None, None, None, wood, None, None, wood, None]),
+    workbench([stick, None, stick, None, wood, None, None, None, None]),
+]
+
+def before_bench():
+    recipes = retrieve_plugins(IRecipe)
+
+    def check(count):
+        for i in xrange(count):
+            linear_check(tables[i % len(tables)], recipes)
+
+    return "crafting_linear", per_second(check, 100)
+
+def discovery_bench():
+    """
+    Discover recipes on every click, as crafting used to.
+    """
+
+    def check(count):
+        for i in xrange(count):
+            linear_check(tables[i % len(tables)], retrieve_plugins(IRecipe))
+
+    return "crafting_linear_discovery", per_second(check, 10, repetitions=3)
+
+def after_bench():
+    def check(count):
+        for i in xrange(count):
+            tables[i % len(tables)].check_recipes()
+
+    return "crafting_indexed", per_second(check, 10000)
+
+benchmarks = [discovery_bench, before_bench, after_bench]
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+from random import Random
+from time import time
+
+from bravo.chunk import Chunk
+from bravo.packets.beta import (packets, packets_by_name, make_packet,
+    PacketDecoder)
+
+random = Random(0)
+
+# Sample payloads, for building, and sample packets, for parsing. Most
+# packets parse happily out of a string of zeroes; the rest need to be made
+# by hand.
+
+samples = {}
+for header, packet in packets.iteritems():
+    if packet.name not in packets_by_name:
+        continue
+    try:
+        samples[packet.name] = packet.parse("\x00" * 4096)
+    except Exception:
+        pass
+
+def sample_chunk(seed):
+    chunk = Chunk(seed, seed)
+    r = Random(seed)
+    for x in range(16):
+        for z in range(16):
+            height = r.randint(60, 70)
+            chunk.blocks[x, z, :height] = 1
+            chunk.blocks[x, z, height - 4:height] = 3
+            chunk.blocks[x, z, height] = 2
+            chunk.skylight[x, z, height:] = 15
+    return chunk
+
+chunks = [sample_chunk(i) for i in range(4)]
+
+raw = {
+    "action": make_packet("action", eid=1, action="crouch"),
+    "vehicle": make_packet("vehicle", eid=1, type="boat", x=0, y=0, z=0,
+        unknown1=0),
+    "mob": make_packet("mob", eid=1, type="pig", x=0, y=0, z=0, yaw=0,
+        pitch=0, metadata={0: ("byte", 0)}),
+    "metadata": make_packet("metadata", eid=1, metadata={0: ("byte", 0)}),
+    "chunk": chunks[0].save_to_packet(),
+}
+
+for name, packet in raw.iteritems():
+    header = packets_by_name[name]
+    samples[name] = packets[header].parse(packet[1:])
+
+for name, payload in samples.iteritems():
+    if name not in raw:
+        raw[name] = make_packet(name, payload)
+
+def per_second(f, count, repetitions=10):
+    """
+    Time a function, returning a list of calls per second for each
+    repetition.
+    """
+
+    times = []
+    for i in range(repetitions):
+        before = time()
+        f(count)
+        after = time()
+        times.append(count / (after - before))
+    return times
+
+def count_for(name):
+    # Chunks are compressed and decompressed, and are much slower.
+    return 10 if name == "chunk" else 1000
+
+def parse_bench(name):
+    packet = raw[name]
+
+    def parse(count):
+        decoder = PacketDecoder()
+        decoder.feed(packet * count)
+        for header, payload in decoder:
+            pass
+
+    return "packets_parse_%s" % name, per_second(parse, count_for(name))
+
+def build_bench(name):
+    payload = samples[name]
+
+    def build(count):
+        for i in xrange(count):
+            make_packet(name, payload)
+
+    return "packets_build_%s" % name, per_second(build, count_for(name))
+
+def movement_stream(count):
+    """
+    Make a stream of packets like those sent by a client walking around.
+    """
+
+    mix = [
+        (0.40, "position"),
+        (0.25, "location"),
+        (0.20, "orientation"),
+        (0.10, "grounded"),
+        (0.03, "animate"),
+        (0.02, "digging"),
+    ]
+
+    stream = []
+    for i in xrange(count):
+        r = random.random()
+        for weight, name in mix:
+            if r < weight:
+                break
+            r -= weight
+        stream.append(raw[name])
+    return "".join(stream)
+
+def movement_bench():
+    """
+    Parse a typical movement-heavy client stream, arriving in TCP segments.
+    """
+
+    stream = movement_stream(1000)
+    segments = [stream[i:i + 1460] for i in xrange(0, len(stream), 1460)]
+
+    def parse(count):
+        for i in xrange(count // 1000):
+            decoder = PacketDecoder()
+            for segment in segments:
+                decoder.feed(segment)
+                for header, payload in decoder:
+                    pass
+
+    return "packets_movement_mix", per_second(parse, 10000)
+
+def burst_bench():
+    """
+    Build the chunks sent to a client as it logs in.
+    """
+
+    def build(count):
+        for i in xrange(count):
+            chunk = chunks[i % len(chunks)]
+            make_packet("prechunk", x=chunk.x, z=chunk.z, enabled=1)
+            chunk.save_to_packet()
+
+    return "packets_login_burst", per_second(build, 300, repetitions=5)
+
+benchmarks = [movement_bench, burst_bench]
+for name in sorted(samples):
+    benchmarks.append(lambda name=name: parse_bench(name))
+    benchmarks.append(lambda name=name: build_bench(name))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+import shutil
+import tempfile
+from time import time
+
+from numpy import uint8
+from numpy.random import randint
+
+from bravo.chunk import Chunk
+from bravo.plugins.serializers import Beta
+
+def per_second(f, count, repetitions=5):
+    """
+    Time a function which handles ``count`` chunks, returning a list of
+    chunks per second for each repetition.
+    """
+
+    times = []
+    for i in range(repetitions):
+        before = time()
+        f(count)
+        after = time()
+        times.append(count / (after - before))
+    return times
+
+def make_chunks(count):
+    """
+    Make chunks which compress about as well as real terrain: solid stone,
+    with some ore scattered through it, and air above.
+    """
+
+    chunks = []
+    for i in range(count):
+        chunk = Chunk(i % 32, i // 32)
+        chunk.blocks[:, :, :64] = 1
+        ore = randint(0, 40, (16, 16, 64)) == 0
+        chunk.blocks[:, :, :64][ore] = 16
+        chunk.heightmap[:] = 64
+        chunk.skylight[:, :, 64:] = 15
+        chunk.metadata[:] = randint(0, 2, chunk.metadata.shape).astype(uint8)
+        chunks.append(chunk)
+    return chunks
+
+chunks = make_chunks(64)
+
+def save_bench(level, threaded):
+    def bench():
+        d = tempfile.mkdtemp()
+        serializer = Beta("file://" + d)
+        serializer.compressor.level = level
+        if threaded:
+            serializer.compressor.start()
+
+        def save(count):
+            for i in xrange(0, count, len(chunks)):
+                serializer.save_chunks(chunks)
+
+        try:
+            name = "region_save_level%d_%s" % (level,
+                "threaded" if threaded else "inline")
+            return name, per_second(save, len(chunks) * 5)
+        finally:
+            serializer.compressor.stop()
+            serializer.pool.close()
+            shutil.rmtree(d)
+
+    return bench
+
+def load_bench(level, readahead=0):
+    def bench():
+        d = tempfile.mkdtemp()
+        serializer = Beta("file://" + d)
+        serializer.compressor.level = level
+        serializer.readahead = readahead
+        serializer.save_chunks(chunks)
+
+        def load(count):
+            for i in xrange(count):
+                chunk = chunks[i % len(chunks)]
+                serializer.load_chunk(Chunk(chunk.x, chunk.z))
+
+        try:
+            name = "region_load_level%d" % level
+            if readahead:
+                name += "_readahead%d" % readahead
+            return name, per_second(load, 256)
+        finally:
+            serializer.pool.close()
+            shutil.rmtree(d)
+
+    return bench
+
+def encode_bench():
+    """
+    Encode chunk tags into NBT, without compressing them.
+    """
+
+    def bench():
+        serializer = Beta("file:///nonexistent")
+        tags = [serializer._save_chunk_to_tag(chunk) for chunk in chunks]
+
+        def encode(count):
+            for i in xrange(count):
+                tags[i % len(tags)].encode()
+
+        return "region_encode", per_second(encode, 256)
+
+    return bench
+
+def decompress_bench(threaded):
+    """
+    Decompress a region's worth of chunks at once.
+    """
+
+    def bench():
+        serializer = Beta("file:///nonexistent")
+        payloads = [serializer._save_chunk_to_tag(chunk).encode()
+            for chunk in chunks]
+        payloads = serializer.compressor.compress_all(payloads)
+
+        if threaded:
+            serializer.compressor.start()
+
+        def decompress(count):
+            for i in xrange(0, count, len(payloads)):
+                serializer.compressor.decompress_all(payloads)
+
+        try:
+            name = "region_decompress_%s" % ("threaded" if threaded else
+                "inline")
+            return name, per_second(decompress, len(payloads) * 20)
+        finally:
+            serializer.compressor.stop()
+
+    return bench
+
+benchmarks = [save_bench(level, threaded)
+    for level in (1, 6, 9) for threaded in (False, True)]
+benchmarks += [load_bench(level) for level in (1, 6, 9)]
+benchmarks += [load_bench(6, 1)]
+benchmarks += [encode_bench()]
+benchmarks += [decompress_bench(False), decompress_bench(True)]
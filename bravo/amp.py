@@ -3,8 +3,6 @@ from twisted.protocols.amp import AMP, Command, Unicode, ListOf
 
 from bravo import version as bravo_version
 from bravo.factories.beta import BravoFactory
-from bravo.ibravo import IChatCommand, IConsoleCommand
-from bravo.plugin import retrieve_plugins
 
 class Version(Command):
     arguments = tuple()
@@ -46,17 +44,6 @@ class ConsoleRPCProtocol(AMP):
     def __init__(self, factories):
         self.factories = factories
 
-        # XXX hax
-        self.commands = retrieve_plugins(IConsoleCommand)
-        # And chat commands, too.
-        chat = retrieve_plugins(IChatCommand)
-        for name, plugin in chat.iteritems():
-            self.commands[name] = IConsoleCommand(plugin)
-        # Register aliases.
-        for plugin in self.commands.values():
-            for alias in plugin.aliases:
-                self.commands[alias] = plugin
-
     def version(self):
         return {"version": bravo_version}
     Version.responder(version)
@@ -66,7 +53,10 @@ class ConsoleRPCProtocol(AMP):
     Worlds.responder(worlds)
 
     def commands(self):
-        return {"commands": self.commands.keys()}
+        commands = set()
+        for factory in self.factories.itervalues():
+            commands.update(factory.console_commands.commands)
+        return {"commands": sorted(commands)}
     Commands.responder(commands)
 
     def run_command(self, world, command, parameters):
@@ -76,11 +66,9 @@ class ConsoleRPCProtocol(AMP):
 
         factory = self.factories[world]
 
-        lines = [i
-            for i in self.commands[command].console_command(factory,
-                parameters)]
-
-        return {"output": lines}
+        d = factory.console_commands.dispatch(command, parameters)
+        d.addCallback(lambda lines: {"output": lines})
+        return d
     RunCommand.responder(run_command)
 
 class ConsoleRPCFactory(Factory):
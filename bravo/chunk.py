@@ -7,6 +7,7 @@ from numpy import vectorize
 
 from bravo.blocks import blocks, glowing_blocks
 from bravo.packets.beta import make_packet
+from bravo.packets.codec import pack_chunk
 from bravo.utilities.bits import pack_nibbles
 
 class ChunkWarning(Warning):
@@ -81,10 +82,21 @@ class Chunk(object):
     :cvar bool dirty: Whether this chunk needs to be flushed to disk.
     :cvar bool populated: Whether this chunk has had its initial block data
         filled out.
+    :cvar set damaged_chunks: A set which this chunk adds itself to whenever
+        it has damage pending, and removes itself from when its damage is
+        cleared. Worlds share a single set between all of their chunks, so
+        that damage can be found without looking at every chunk.
     """
 
     dirty = True
     populated = False
+    damaged_chunks = None
+
+    modified = 0
+    """
+    A counter which goes up whenever blocks are damaged, so that copies of
+    the chunk's data can be checked for staleness.
+    """
 
     def __init__(self, x, z):
         """
@@ -263,6 +275,8 @@ class Chunk(object):
 
         x, y, z = coords
 
+        self.modified += 1
+
         if self.all_damaged:
             return
 
@@ -271,6 +285,16 @@ class Chunk(object):
         if self.damaged.sum() > 176:
             self.all_damaged = True
 
+        self.register_damage()
+
+    def register_damage(self):
+        """
+        Add this chunk to its set of damaged chunks, if it has one.
+        """
+
+        if self.damaged_chunks is not None:
+            self.damaged_chunks.add(self)
+
     def is_damaged(self):
         """
         Determine whether any damage is pending on this chunk.
@@ -344,19 +368,39 @@ class Chunk(object):
         self.damaged.fill(False)
         self.all_damaged = False
 
-    def save_to_packet(self):
+        if self.damaged_chunks is not None:
+            self.damaged_chunks.discard(self)
+
+    def packet_data(self):
         """
-        Generate a chunk packet.
+        Get the data for a chunk packet, before it is compressed.
         """
 
         array = self.blocks.tostring()
         array += pack_nibbles(self.metadata)
         array += pack_nibbles(self.blocklight)
         array += pack_nibbles(self.skylight)
+        return array
+
+    def save_to_packet(self):
+        """
+        Generate a chunk packet.
+        """
+
         packet = make_packet("chunk", x=self.x * 16, y=0, z=self.z * 16,
-            x_size=15, y_size=127, z_size=15, data=array)
+            x_size=15, y_size=127, z_size=15, data=self.packet_data())
         return packet
 
+    def save_to_compressed_packet(self, data):
+        """
+        Generate a chunk packet from data which has already been compressed.
+
+        :param str data: compressed data from ``packet_data()``
+        """
+
+        return pack_chunk(dict(x=self.x * 16, y=0, z=self.z * 16, x_size=15,
+            y_size=127, z_size=15), data)
+
     def get_block(self, coords):
         """
         Look up a block value.
@@ -504,6 +548,8 @@ class Chunk(object):
         if (self.blocks == search).any():
             self.all_damaged = True
             self.dirty = True
+            self.modified += 1
+            self.register_damage()
 
             self.blocks = where(self.blocks == search, replace, self.blocks)
 
@@ -1,23 +1,27 @@
+from __future__ import division
+
 from collections import defaultdict
-from itertools import chain
 from time import time
 
-from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Factory
 from twisted.internet.task import LoopingCall
 from twisted.python import log
-from zope.interface import implements
 
 from bravo.config import configuration
 from bravo.entity import entities
+from bravo.governor import LoadGovernor
 from bravo.ibravo import (ISortedPlugin, IAutomaton, IAuthenticator, ISeason,
     ITerrainGenerator, IUseHook, ISignHook, IDigHook, IPreBuildHook,
-    IPostBuildHook)
+    IPostBuildHook, IChatCommand, IConsoleCommand)
+from bravo.inventory import Inventory
 from bravo.location import Location
 from bravo.packets.beta import make_packet
-from bravo.plugin import retrieve_named_plugins, retrieve_sorted_plugins
+from bravo.plugin import (retrieve_named_plugins, retrieve_sorted_plugins,
+    CommandRegistry)
 from bravo.protocols.beta import BannedProtocol, BravoProtocol
 from bravo.utilities.chat import chat_name, sanitize_chat
+from bravo.utilities.spatial import Block2DSpatialDict
+from bravo.utilities.temporal import TimerWheel
 from bravo.world import World
 
 (STATE_UNAUTHENTICATED, STATE_CHALLENGED, STATE_AUTHENTICATED,
@@ -28,8 +32,6 @@ class BravoFactory(Factory):
     A ``Factory`` that creates ``BravoProtocol`` objects when connected to.
     """
 
-    implements(IPushProducer)
-
     protocol = BravoProtocol
 
     timestamp = None
@@ -42,6 +44,21 @@ class BravoFactory(Factory):
 
     interface = ""
 
+    tick_interval = 1 / 20
+    """
+    The number of seconds between ticks.
+    """
+
+    keepalive_interval = 5
+    """
+    The number of seconds between keepalives.
+    """
+
+    time_interval = 10
+    """
+    The number of seconds between time updates.
+    """
+
     def __init__(self, name):
         """
         Create a factory and world.
@@ -64,6 +81,29 @@ class BravoFactory(Factory):
 
         self.protocols = dict()
 
+        # The timer wheel is shared by everything in this world which needs
+        # to do something later, so that thousands of timers don't end up in
+        # the reactor.
+        self.wheel = TimerWheel()
+
+        # The player grid tracks which players are in which chunks, keyed by
+        # chunk coordinates, for area-of-interest lookups.
+        self.player_grid = Block2DSpatialDict()
+        self.view_distance = configuration.getintdefault(self.config_name,
+            "view_distance", 10)
+
+        # The chunk watchers index tracks which players have which chunks
+        # loaded, keyed by chunk coordinates, so that chunk broadcasts don't
+        # have to ask every player.
+        self.chunk_watchers = dict()
+
+        # Players which have moved since the last tick. Damaged chunks are
+        # tracked by the world.
+        self.moved = set()
+
+        self.ticks = 0
+        self.tick_timings = dict.fromkeys(("movement", "damage", "send"), 0)
+
     def startFactory(self):
         log.msg("Initializing factory for world '%s'..." % self.name)
 
@@ -91,10 +131,21 @@ class BravoFactory(Factory):
         self.time_loop = LoopingCall(self.update_time)
         self.time_loop.start(2)
 
+        self.wheel.start()
+        self.wheel.repeat(self.keepalive_interval, self.broadcast_keepalive)
+        self.wheel.repeat(self.time_interval, self.broadcast_time)
+
         # Start automatons.
         for automaton in self.automatons:
             automaton.start()
 
+        log.msg("Starting load governor...")
+        self.governor = LoadGovernor(self)
+        self.governor.start()
+
+        self.tick_loop = LoopingCall(self.tick)
+        self.tick_loop.start(self.tick_interval)
+
         self.chat_consumers = set()
 
         log.msg("Factory successfully initialized for world '%s'!" % self.name)
@@ -115,6 +166,9 @@ class BravoFactory(Factory):
             automaton.stop()
 
         self.time_loop.stop()
+        self.wheel.stop()
+        self.governor.stop()
+        self.tick_loop.stop()
 
         # Write back current world time. This must be done before stopping the
         # world.
@@ -215,6 +269,16 @@ class BravoFactory(Factory):
             for target in plugin.targets:
                 self.use_hooks[target].append(plugin)
 
+        # Commands are looked up on every command typed, so they are found
+        # once, here, instead of each time.
+        self.chat_commands = CommandRegistry(IChatCommand, "chat_command",
+            parameters=pp)
+        self.console_commands = CommandRegistry(IConsoleCommand,
+            "console_command", parameters=pp, adapted=(IChatCommand,))
+
+        # Crafting is checked on every click, so recipes are indexed now.
+        Inventory.index_recipes()
+
     def create_entity(self, x, y, z, name, **kwargs):
         """
         Spawn an entirely new entity.
@@ -297,6 +361,15 @@ class BravoFactory(Factory):
         packet = make_packet("time", timestamp=int(self.time))
         self.broadcast(packet)
 
+    def broadcast_keepalive(self):
+        """
+        Send a keepalive to all connected players.
+        """
+
+        packet = make_packet("ping")
+        for player in self.protocols.itervalues():
+            player.write_now(packet)
+
     def update_season(self):
         """
         Update the world's season.
@@ -347,7 +420,7 @@ class BravoFactory(Factory):
         """
 
         for player in self.protocols.itervalues():
-            player.transport.write(packet)
+            player.write(packet)
 
     def broadcast_for_others(self, packet, protocol):
         """
@@ -359,7 +432,101 @@ class BravoFactory(Factory):
 
         for player in self.protocols.itervalues():
             if player is not protocol:
-                player.transport.write(packet)
+                player.write(packet)
+
+    def broadcast_for_observers(self, packet, protocol):
+        """
+        Broadcast a packet to all players which can see a certain player.
+
+        Players can see each other when the chunk one of them is standing in
+        is loaded by the other. Movement and other avatar-specific packets
+        should use this instead of ``broadcast_for_others()``.
+        """
+
+        for player in protocol.observers:
+            player.write(packet)
+
+    def players_in_chunk(self, x, z):
+        """
+        Get the set of players standing in a certain chunk.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        return self.player_grid.get((x, z), frozenset())
+
+    def move_player(self, protocol, coords):
+        """
+        Move a player to a chunk in the player grid.
+
+        If the player has changed chunks, avatars are spawned and destroyed in
+        the clients of other players as the player enters and leaves their
+        view.
+
+        :param tuple coords: chunk coordinates
+        """
+
+        if protocol.current_chunk == coords:
+            return
+
+        self._remove_from_grid(protocol)
+
+        protocol.current_chunk = coords
+        if coords in self.player_grid:
+            self.player_grid[coords].add(protocol)
+        else:
+            self.player_grid[coords] = set([protocol])
+
+        self.update_observers(protocol)
+
+    def update_observers(self, protocol):
+        """
+        Spawn or destroy a player's avatar in the clients of nearby players,
+        according to whether they have the player's chunk loaded.
+        """
+
+        coords = protocol.current_chunk
+
+        # Anybody who could have our chunk loaded is within their view
+        # distance of us; the grid is searched with taxicab distance, which
+        # needs a bit of slack to cover a circle.
+        candidates = set(protocol.observers)
+        for players in self.player_grid.itervaluesnear(coords,
+            self.view_distance * 2):
+            candidates.update(players)
+        candidates.discard(protocol)
+
+        for other in candidates:
+            if coords in other.chunks:
+                if protocol not in other.visible:
+                    other.spawn_player(protocol)
+            elif protocol in other.visible:
+                other.despawn_player(protocol)
+
+    def remove_player(self, protocol):
+        """
+        Remove a player from the player grid, and destroy its avatar in the
+        clients of all players which could see it.
+        """
+
+        self._remove_from_grid(protocol)
+        protocol.current_chunk = None
+        self.moved.discard(protocol)
+
+        for other in list(protocol.observers):
+            other.despawn_player(protocol)
+
+        for other in protocol.visible:
+            other.observers.discard(protocol)
+        protocol.visible.clear()
+
+    def _remove_from_grid(self, protocol):
+        coords = protocol.current_chunk
+        if coords is not None and coords in self.player_grid:
+            players = self.player_grid[coords]
+            players.discard(protocol)
+            if not players:
+                del self.player_grid[coords]
 
     def broadcast_for_chunk(self, packet, x, z):
         """
@@ -368,9 +535,44 @@ class BravoFactory(Factory):
         `x` and `z` are chunk coordinates, not block coordinates.
         """
 
-        for player in self.protocols.itervalues():
-            if (x, z) in player.chunks:
-                player.transport.write(packet)
+        for player in self.watchers(x, z):
+            player.write(packet)
+
+    def watchers(self, x, z):
+        """
+        Get the set of players that have a certain chunk loaded.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        return self.chunk_watchers.get((x, z), frozenset())
+
+    def watch_chunk(self, protocol, x, z):
+        """
+        Note that a player has loaded a chunk.
+
+        Protocols which have already lost their connection are ignored, so
+        that they can't be put back into the index once they have left.
+        """
+
+        if protocol.disconnected:
+            return
+
+        if (x, z) in self.chunk_watchers:
+            self.chunk_watchers[x, z].add(protocol)
+        else:
+            self.chunk_watchers[x, z] = set([protocol])
+
+    def unwatch_chunk(self, protocol, x, z):
+        """
+        Note that a player has unloaded a chunk.
+        """
+
+        watchers = self.chunk_watchers.get((x, z))
+        if watchers is not None:
+            watchers.discard(protocol)
+            if not watchers:
+                del self.chunk_watchers[x, z]
 
     def scan_chunk(self, chunk):
         """
@@ -383,29 +585,79 @@ class BravoFactory(Factory):
     def flush_chunk(self, chunk):
         """
         Flush a damaged chunk to all players that have it loaded.
+
+        The damage is sent on the next tick. Chunks loaded by the world
+        register their own damage, so this is only needed for other chunks.
         """
 
         if chunk.is_damaged():
-            packet = chunk.get_damage_packet()
-            for player in self.protocols.itervalues():
-                if (chunk.x, chunk.z) in player.chunks:
-                    player.transport.write(packet)
-            chunk.clear_damage()
+            self.world.damaged_chunks.add(chunk)
 
     def flush_all_chunks(self):
         """
         Flush any damage anywhere in this world to all players.
 
-        This is a sledgehammer which should be used sparingly at best, and is
-        only well-suited to plugins which touch multiple chunks at once.
+        Chunks register their damage with the world as it happens, and all of
+        it is sent on the next tick, so this does nothing; it only exists for
+        plugins which predate damage tracking.
+        """
+
+    def mark_moved(self, protocol):
+        """
+        Note that a player has moved or turned.
+
+        The movement is sent to everybody who can see the player on the next
+        tick, no matter how many times the player moves before then.
+        """
+
+        self.moved.add(protocol)
 
-        In other words, if I catch you using this in your plugin needlessly,
-        I'm gonna have a chat with you.
+    def tick(self):
         """
+        Send pending movement and damage to players.
 
-        for chunk in chain(self.world.chunk_cache.itervalues(),
-            self.world.dirty_chunk_cache.itervalues()):
-            self.flush_chunk(chunk)
+        Everything which has happened since the last tick is coalesced into
+        a single write per player. The time spent in each phase is recorded
+        in ``tick_timings``.
+        """
+
+        outbound = defaultdict(list)
+
+        before = time()
+
+        moved, self.moved = self.moved, set()
+        for protocol in moved:
+            eid = protocol.player.eid
+            location = protocol.wire_location()
+            for observer in protocol.observers:
+                packet = observer.movement.encode(eid, *location)
+                if packet:
+                    outbound[observer].append(packet)
+
+        after = time()
+        self.tick_timings["movement"] = after - before
+        before = after
+
+        # The set is shared with every chunk in the world, so it has to be
+        # emptied in place.
+        damaged = list(self.world.damaged_chunks)
+        self.world.damaged_chunks.clear()
+        for chunk in damaged:
+            if chunk.is_damaged():
+                packet = chunk.get_damage_packet()
+                for player in self.watchers(chunk.x, chunk.z):
+                    outbound[player].append(packet)
+                chunk.clear_damage()
+
+        after = time()
+        self.tick_timings["damage"] = after - before
+        before = after
+
+        for player, packets in outbound.iteritems():
+            player.write("".join(packets))
+
+        self.tick_timings["send"] = time() - before
+        self.ticks += 1
 
     def give(self, coords, block, quantity):
         """
@@ -443,12 +695,3 @@ class BravoFactory(Factory):
             if player.location.distance(p.location) <= radius and
             p.player != player):
             yield i.player
-
-    def pauseProducing(self):
-        pass
-
-    def resumeProducing(self):
-        pass
-
-    def stopProducing(self):
-        pass
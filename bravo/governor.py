@@ -0,0 +1,158 @@
+"""
+Load management for worlds.
+"""
+
+from __future__ import division
+
+from math import ceil
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+from bravo.config import configuration
+
+class LoadGovernor(object):
+    """
+    A governor which trades view distance for server responsiveness.
+
+    Every step, the governor measures how late the reactor was in calling it,
+    how many chunks are waiting to be generated, and how many bytes are
+    waiting to be sent to each client. When the server is overloaded, view
+    distances are shrunk, starting with the most recently connected clients
+    and the clients with the largest send backlogs. When the server is idle
+    again, view distances are grown back, in the opposite order.
+
+    Clients whose send backlog is too large are always shrunk, regardless of
+    the load on the rest of the server.
+    """
+
+    interval = 1
+    """
+    The number of seconds between steps.
+    """
+
+    max_lag = 0.1
+    """
+    Reactor lag, in seconds, above which the server is considered overloaded.
+    """
+
+    max_backlog = 20
+    """
+    Number of pending chunks above which the server is considered overloaded.
+    """
+
+    max_buffered = 256 * 1024
+    """
+    Number of unsent bytes above which a client is considered overloaded.
+    """
+
+    fraction = 0.25
+    """
+    The fraction of clients adjusted in each step.
+    """
+
+    lag = 0
+    backlog = 0
+
+    _last = None
+
+    def __init__(self, factory, clock=reactor):
+        """
+        :param factory: the ``BravoFactory`` to govern
+        :param clock: an ``IReactorTime`` provider, for testing
+        """
+
+        self.factory = factory
+        self.clock = clock
+
+        config_name = factory.config_name
+
+        self.maximum = configuration.getintdefault(config_name,
+            "view_distance", 10)
+        self.minimum = configuration.getintdefault(config_name,
+            "min_view_distance", 3)
+
+        if self.minimum > self.maximum:
+            log.msg("Minimum view distance %d exceeds maximum %d" %
+                (self.minimum, self.maximum))
+            self.minimum = self.maximum
+
+        self.loop = LoopingCall(self.step)
+        self.loop.clock = clock
+
+    def start(self):
+        if not self.loop.running:
+            self._last = self.clock.seconds()
+            self.loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def measure(self):
+        """
+        Update the load measurements.
+        """
+
+        now = self.clock.seconds()
+        if self._last is not None:
+            self.lag = max(0, now - self._last - self.interval)
+        self._last = now
+
+        self.backlog = self.factory.world.generation_backlog()
+
+    def overloaded(self):
+        return self.lag > self.max_lag or self.backlog > self.max_backlog
+
+    def relaxed(self):
+        return (self.lag <= self.max_lag / 2 and
+            self.backlog <= self.max_backlog / 2)
+
+    def priority(self, protocol):
+        """
+        Key for sorting protocols, most deserving of shrinkage first.
+        """
+
+        return protocol.buffered_bytes(), protocol.login_time
+
+    def step(self):
+        """
+        Measure load and adjust view distances.
+        """
+
+        self.measure()
+
+        protocols = sorted(self.factory.protocols.itervalues(),
+            key=self.priority, reverse=True)
+        if not protocols:
+            return
+
+        count = int(ceil(len(protocols) * self.fraction))
+
+        # Clients which cannot keep up are always shrunk.
+        shrunk = set()
+        for protocol in protocols:
+            if protocol.buffered_bytes() > self.max_buffered:
+                self.shrink(protocol)
+                shrunk.add(protocol)
+
+        if self.overloaded():
+            candidates = [p for p in protocols
+                if p.view_distance > self.minimum and p not in shrunk]
+            for protocol in candidates[:count]:
+                self.shrink(protocol)
+        elif self.relaxed():
+            candidates = [p for p in reversed(protocols)
+                if p.view_distance < self.maximum and
+                p.buffered_bytes() <= self.max_buffered // 2]
+            for protocol in candidates[:count]:
+                self.grow(protocol)
+
+    def shrink(self, protocol):
+        radius = max(self.minimum, protocol.view_distance - 1)
+        protocol.set_view_distance(radius)
+
+    def grow(self, protocol):
+        radius = min(self.maximum, protocol.view_distance + 1)
+        protocol.set_view_distance(radius)
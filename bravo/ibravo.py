@@ -226,6 +226,16 @@ class ISerializer(IBravoPlugin):
         May return a ``Deferred`` that will fire on completion.
         """
 
+    def save_chunks(chunks):
+        """
+        Save many chunks at once.
+
+        Serializers may be able to save chunks faster together than one at a
+        time.
+
+        May return a ``Deferred`` that will fire on completion.
+        """
+
     def load_chunk(chunk):
         """
         Load a chunk.
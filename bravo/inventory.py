@@ -8,31 +8,86 @@ from bravo.ibravo import IRecipe
 from bravo.packets.beta import make_packet
 from bravo.plugin import retrieve_plugins
 
-def grouper(n, iterable):
-    args = [iter(iterable)] * n
-    for i in zip(*args):
-        yield i
+def crop(cells, stride):
+    """
+    Crop a grid of cells down to the bounding box of its non-empty cells.
+
+    :param sequence cells: the grid, in row-major order
+    :param int stride: the width of the grid
+
+    :returns: a tuple of the index of the box's top-left cell, the width of
+              the box, and the cells in the box; or None if the grid is empty
+    """
+
+    filled = [i for i, cell in enumerate(cells) if cell is not None]
+    if not filled:
+        return None
 
-def pad_to_stride(recipe, rstride, cstride):
+    top = filled[0] // stride
+    bottom = filled[-1] // stride
+    left = min(i % stride for i in filled)
+    right = max(i % stride for i in filled)
+    width = right - left + 1
+
+    cropped = []
+    for row in range(top, bottom + 1):
+        start = row * stride + left
+        cropped.extend(cells[start:start + width])
+
+    return top * stride + left, width, cropped
+
+class RecipeIndex(object):
     """
-    Pad a recipe out to a given stride.
+    Recipes, indexed by shape.
 
-    :param tuple recipe: a recipe
-    :param int rstride: stride of the recipe
-    :param int cstride: stride of the crafting table
+    A recipe's shape is the layout of its ingredients, cropped down to their
+    bounding box, which doesn't change as the recipe moves around a crafting
+    table. Matching a crafting table is then a crop, a lookup, and a check
+    that each slot holds enough of its ingredient.
     """
 
-    if rstride > cstride:
-        raise ValueError("Recipe is wider than crafting!")
+    def __init__(self, recipes):
+        """
+        :param dict recipes: recipes, keyed by name
+        """
+
+        self.shapes = {}
+
+        # Recipes with the same shape are tried in order of name.
+        for name, recipe in sorted(recipes.iteritems()):
+            offset, width, cells = crop(recipe.recipe, recipe.dimensions[0])
+            key = width, tuple(cell and cell[0] for cell in cells)
+            counts = tuple(cell and cell[1] for cell in cells)
+            self.shapes.setdefault(key, []).append((recipe, counts))
+
+    def __len__(self):
+        return sum(len(l) for l in self.shapes.itervalues())
+
+    def match(self, crafting, stride):
+        """
+        Find the recipe laid out on a crafting table.
+
+        :param list crafting: the slots of the crafting table
+        :param int stride: the width of the crafting table
+
+        :returns: a tuple of the recipe and the index of its top-left
+                  ingredient, or None if no recipe matches
+        """
+
+        box = crop(crafting, stride)
+        if box is None:
+            return None
+
+        offset, width, cells = box
+        key = width, tuple(slot and (slot.primary, slot.secondary)
+            for slot in cells)
 
-    pad = (None,) * (cstride - rstride)
-    g = grouper(rstride, recipe)
-    padded = list(next(g))
-    for row in g:
-        padded.extend(pad)
-        padded.extend(row)
+        for recipe, counts in self.shapes.get(key, ()):
+            if all(slot is None or slot.quantity >= count
+                for slot, count in zip(cells, counts)):
+                return recipe, offset
 
-    return padded
+        return None
 
 class Slot(namedtuple("Slot", "primary, secondary, quantity")):
     """
@@ -114,6 +169,19 @@ class Inventory(object):
 
     slot_table = tuple()
 
+    recipes = None
+    """
+    The ``RecipeIndex`` shared by all inventories.
+    """
+
+    @classmethod
+    def index_recipes(cls):
+        """
+        Discover recipes and index them for every inventory.
+        """
+
+        Inventory.recipes = RecipeIndex(retrieve_plugins(IRecipe))
+
     def __init__(self):
         if self.crafting:
             self.crafting = [None] * self.crafting
@@ -450,46 +518,18 @@ class Inventory(object):
         """
         See if the crafting table matches any recipes.
 
-        :returns: the recipe and offset, or None if no matches could be made
+        The matched recipe and the index of its top-left ingredient are
+        stored in ``recipe`` and ``recipe_offset``.
         """
 
-        # This isn't perfect, unfortunately, but correctness trumps algorithmic
-        # perfection. (For now.)
-        for name, recipe in sorted(retrieve_plugins(IRecipe).iteritems()):
-            dims = recipe.dimensions
-
-            # Skip recipes that don't fit our crafting table.
-            if (dims[0] > self.crafting_stride or
-                dims[1] > len(self.crafting) // self.crafting_stride):
-                continue
-
-            padded = pad_to_stride(recipe.recipe, dims[0],
-                self.crafting_stride)
-
-            for offset in range(len(self.crafting) - len(padded) + 1):
-                nones = self.crafting[:offset]
-                nones += self.crafting[len(padded) + offset:]
-                if not all(i is None for i in nones):
-                    continue
-
-                matches_needed = len(padded)
-
-                for i, j in zip(padded,
-                    self.crafting[offset:len(padded) + offset]):
-                    if i is None and j is None:
-                        matches_needed -= 1
-                    elif i is not None and j is not None:
-                        skey, scount = i
-                        if j.holds(skey) and j.quantity >= scount:
-                            matches_needed -= 1
+        if Inventory.recipes is None:
+            Inventory.index_recipes()
 
-                    if matches_needed == 0:
-                        # Jackpot!
-                        self.recipe = recipe
-                        self.recipe_offset = offset
-                        return
-
-        self.recipe = None
+        match = Inventory.recipes.match(self.crafting, self.crafting_stride)
+        if match is None:
+            self.recipe = None
+        else:
+            self.recipe, self.recipe_offset = match
 
     def reduce_recipe(self):
         """
@@ -501,19 +541,17 @@ class Inventory(object):
         and will not do additional checks to verify this assumption.
         """
 
-        offset = self.recipe_offset
+        offset, width, cells = crop(self.recipe.recipe,
+            self.recipe.dimensions[0])
 
-        padded = pad_to_stride(self.recipe.recipe, self.recipe.dimensions[0],
-            self.crafting_stride)
-
-        for index, slot in enumerate(padded):
-            if slot is not None:
-                index += offset
-                rcount = slot[1]
+        for i, cell in enumerate(cells):
+            if cell is not None:
+                index = (self.recipe_offset +
+                    (i // width) * self.crafting_stride + i % width)
+                rcount = cell[1]
                 slot = self.crafting[index]
                 self.crafting[index] = slot.decrement(rcount)
 
-
 class Equipment(Inventory):
 
     crafting = 4
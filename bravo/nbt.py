@@ -1,5 +1,6 @@
-from struct import Struct, error as StructError
+from struct import Struct, error as StructError, pack_into, unpack_from
 from gzip import GzipFile
+from StringIO import StringIO
 from UserDict import DictMixin
 
 from bravo.errors import MalformedFileError
@@ -16,6 +17,22 @@ TAG_STRING = 8
 TAG_LIST = 9
 TAG_COMPOUND = 10
 
+_readonly = buffer
+"""
+The ``buffer`` builtin, which some methods hide with their arguments.
+"""
+
+def _render_string(value, buf, offset):
+    """
+    Render a string, with its length, into a preallocated ``bytearray``.
+    """
+
+    value = value.encode("utf-8")
+    pack_into(">h", buf, offset, len(value))
+    offset += 2
+    buf[offset:offset + len(value)] = value
+    return offset + len(value)
+
 class TAG(object):
     """Each Tag needs to take a file-like object for reading and writing.
     The file object will be initialised by the calling code."""
@@ -32,6 +49,22 @@ class TAG(object):
     def _render_buffer(self, buffer, offset=None):
         raise NotImplementedError(self.__class__.__name__)
 
+    def _payload_size(self):
+        """
+        Get the size of this tag's payload, once rendered.
+        """
+
+        raise NotImplementedError(self.__class__.__name__)
+
+    def _render_into(self, buf, offset):
+        """
+        Render this tag's payload into a preallocated ``bytearray``.
+
+        :returns: the offset just past the payload
+        """
+
+        raise NotImplementedError(self.__class__.__name__)
+
     #Printing and Formatting of tree
     def tag_info(self):
         return self.__class__.__name__ + \
@@ -55,6 +88,13 @@ class _TAG_Numeric(TAG):
     def _render_buffer(self, buffer, offset=None):
         buffer.write(self.fmt.pack(self.value))
 
+    def _payload_size(self):
+        return self.fmt.size
+
+    def _render_into(self, buf, offset):
+        self.fmt.pack_into(buf, offset, self.value)
+        return offset + self.fmt.size
+
     #Printing and Formatting of tree
     def __repr__(self):
         return str(self.value)
@@ -102,6 +142,16 @@ class TAG_Byte_Array(TAG):
         length._render_buffer(buffer, offset)
         buffer.write(self.value)
 
+    def _payload_size(self):
+        return 4 + len(self.value)
+
+    def _render_into(self, buf, offset):
+        length = len(self.value)
+        pack_into(">i", buf, offset, length)
+        offset += 4
+        buf[offset:offset + length] = self.value
+        return offset + length
+
     #Printing and Formatting of tree
     def __repr__(self):
         return "[%i bytes]" % len(self.value)
@@ -127,6 +177,12 @@ class TAG_String(TAG):
         length._render_buffer(buffer, offset)
         buffer.write(save_val)
 
+    def _payload_size(self):
+        return 2 + len(self.value.encode("utf-8"))
+
+    def _render_into(self, buf, offset):
+        return _render_string(self.value, buf, offset)
+
     #Printing and Formatting of tree
     def __repr__(self):
         return self.value
@@ -163,6 +219,22 @@ class TAG_List(TAG):
                          (i, tag, tag.id, self.tagID))
             tag._render_buffer(buffer, offset)
 
+    def _payload_size(self):
+        size = _sizes.get(self.tagID)
+        if size is not None:
+            return 5 + size * len(self.tags)
+        return 5 + sum(tag._payload_size() for tag in self.tags)
+
+    def _render_into(self, buf, offset):
+        pack_into(">bi", buf, offset, self.tagID, len(self.tags))
+        offset += 5
+        for i, tag in enumerate(self.tags):
+            if tag.id != self.tagID:
+                raise ValueError("List element %d(%s) has type %d != "
+                    "container type %d" % (i, tag, tag.id, self.tagID))
+            offset = tag._render_into(buf, offset)
+        return offset
+
     #Printing and Formatting of tree
     def __repr__(self):
         return "%i entries of type %s" % (len(self.tags), TAGLIST[self.tagID].__name__)
@@ -175,7 +247,62 @@ class TAG_List(TAG):
             output.append(("\t"*indent) + "}")
         return '\n'.join(output)
 
+class _LazyTag(object):
+    """
+    A tag which hasn't been decoded yet.
+
+    Only its type, its name, and where its payload starts are known. If it is
+    written out before being decoded, its payload is copied unchanged.
+    """
+
+    def __init__(self, id, name, data, offset):
+        self.id = id
+        self.name = name
+        self.data = data
+        self.offset = offset
+
+    def load(self):
+        """
+        Decode the tag.
+        """
+
+        if self.id == TAG_COMPOUND:
+            tag = TAG_Compound()
+            tag._parse_lazy(self.data, self.offset)
+        else:
+            tag = read_tag(self.data, self.offset, self.id)
+        tag.name = self.name
+        return tag
+
+    def _render_buffer(self, buffer, offset=None):
+        end = skip_tag(self.data, self.offset, self.id)
+        buffer.write(self.data[self.offset:end])
+
+    def _payload_size(self):
+        return skip_tag(self.data, self.offset, self.id) - self.offset
+
+    def _render_into(self, buf, offset):
+        end = skip_tag(self.data, self.offset, self.id)
+        buf[offset:offset + end - self.offset] = buffer(self.data,
+            self.offset, end - self.offset)
+        return offset + end - self.offset
+
 class TAG_Compound(TAG, DictMixin):
+    """
+    A compound of named tags.
+
+    Tags are kept in order in ``tags``, and indexed by name, so that looking
+    them up by name takes constant time. Tags should be added and removed by
+    assigning and deleting items, or by replacing ``tags`` entirely, so that
+    the index stays consistent.
+
+    If several tags share a name, the first of them is the one found by name.
+
+    Compounds which are parsed lazily only find their children at first, and
+    decode each child the first time it is used. Children which are never
+    used are written back out exactly as they were read.
+    """
+
     id = TAG_COMPOUND
     def __init__(self, buffer=None):
         super(TAG_Compound, self).__init__()
@@ -183,6 +310,47 @@ class TAG_Compound(TAG, DictMixin):
         if buffer:
             self._parse_buffer(buffer)
 
+    def _get_tags(self):
+        if self._lazy:
+            for i in range(len(self._tags)):
+                self._load(i)
+            self._lazy = False
+        return self._tags
+
+    def _set_tags(self, tags):
+        self._tags = tags
+        self._lazy = False
+        self._reindex()
+
+    tags = property(_get_tags, _set_tags)
+
+    def _reindex(self):
+        self._index = {}
+        for i, tag in enumerate(self._tags):
+            self._index.setdefault(tag.name, i)
+
+    def _load(self, i):
+        tag = self._tags[i]
+        if isinstance(tag, _LazyTag):
+            tag = self._tags[i] = tag.load()
+        return tag
+
+    def _parse_lazy(self, data, offset):
+        """
+        Find this compound's children in some data, without decoding them.
+
+        :param str data: NBT data, which must not change afterwards
+        :param int offset: where the compound's payload starts
+        :returns: the offset just past the compound
+        """
+
+        children, end = scan_compound(data, offset)
+        self._tags = [_LazyTag(tagid, name, data, start)
+            for name, tagid, start in children]
+        self._lazy = True
+        self._reindex()
+        return end
+
     #Parsers and Generators
     def _parse_buffer(self, buffer, offset=None):
         while True:
@@ -196,59 +364,82 @@ class TAG_Compound(TAG, DictMixin):
                     #DEBUG print type, name
                     tag = TAGLIST[type.value](buffer=buffer)
                     tag.name = name
-                    self.tags.append(tag)
+                    self._index.setdefault(name, len(self._tags))
+                    self._tags.append(tag)
                 except KeyError:
                     raise ValueError("Unrecognised tag type")
 
     def _render_buffer(self, buffer, offset=None):
-        for tag in self.tags:
+        for tag in self._tags:
             TAG_Byte(tag.id)._render_buffer(buffer, offset)
             TAG_String(tag.name)._render_buffer(buffer, offset)
             tag._render_buffer(buffer,offset)
         buffer.write('\x00') #write TAG_END
 
+    def _payload_size(self):
+        size = 1
+        for tag in self._tags:
+            size += 3 + len(tag.name.encode("utf-8")) + tag._payload_size()
+        return size
+
+    def _render_into(self, buf, offset):
+        for tag in self._tags:
+            buf[offset] = tag.id
+            offset = _render_string(tag.name, buf, offset + 1)
+            offset = tag._render_into(buf, offset)
+        buf[offset] = TAG_END
+        return offset + 1
+
     # Dict compatibility.
     # DictMixin requires at least __getitem__, and for more functionality,
     # __setitem__, __delitem__, and keys.
 
     def __getitem__(self, key):
         if isinstance(key,int):
-            return self.tags[key]
-        elif isinstance(key, str):
-            for tag in self.tags:
-                if tag.name == key:
-                    return tag
-            else:
+            return self._load(key)
+        elif isinstance(key, basestring):
+            if key not in self._index:
                 raise KeyError("A tag with this name does not exist")
+            return self._load(self._index[key])
         else:
             raise ValueError("key needs to be either name of tag, or index of tag")
 
     def __setitem__(self, key, value):
         if isinstance(key, int):
             # Just try it. The proper error will be raised if it doesn't work.
-            self.tags[key] = value
-        elif isinstance(key, str):
+            self._tags[key] = value
+            self._reindex()
+        elif isinstance(key, basestring):
             value.name = key
-            for i, tag in enumerate(self.tags):
-                if tag.name == key:
-                    self.tags[i] = value
-                    return
-            self.tags.append(value)
+            if key in self._index:
+                self._tags[self._index[key]] = value
+            else:
+                self._index[key] = len(self._tags)
+                self._tags.append(value)
 
     def __delitem__(self, key):
         if isinstance(key, int):
-            self.tags = self.tags[:key] + self.tags[key:]
-        elif isinstance(key, str):
-            for i, tag in enumerate(self.tags):
-                if tag.name == key:
-                    self.tags = self.tags[:i] + self.tags[i:]
-                    return
-            raise KeyError("A tag with this name does not exist")
+            del self._tags[key]
+        elif isinstance(key, basestring):
+            if key not in self._index:
+                raise KeyError("A tag with this name does not exist")
+            del self._tags[self._index[key]]
         else:
             raise ValueError("key needs to be either name of tag, or index of tag")
+        self._reindex()
+
+    def __contains__(self, key):
+        if isinstance(key, basestring):
+            return key in self._index
+        return DictMixin.__contains__(self, key)
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._tags)
 
     def keys(self):
-        return [tag.name for tag in self.tags]
+        return [tag.name for tag in self._tags]
 
 
     #Printing and Formatting of tree
@@ -267,9 +458,15 @@ class TAG_Compound(TAG, DictMixin):
 TAGLIST = {TAG_BYTE:TAG_Byte, TAG_SHORT:TAG_Short, TAG_INT:TAG_Int, TAG_LONG:TAG_Long, TAG_FLOAT:TAG_Float, TAG_DOUBLE:TAG_Double, TAG_BYTE_ARRAY:TAG_Byte_Array, TAG_STRING:TAG_String, TAG_LIST:TAG_List, TAG_COMPOUND:TAG_Compound}
 
 class NBTFile(TAG_Compound):
-    """Represents an NBT file object"""
+    """
+    Represents an NBT file object.
+
+    With ``lazy``, the file is read in one go, but its tags are only decoded
+    when they are first used; see ``TAG_Compound``.
+    """
 
-    def __init__(self, filename=None, mode=None, buffer=None, fileobj=None):
+    def __init__(self, filename=None, mode=None, buffer=None, fileobj=None,
+        lazy=False):
         super(NBTFile,self).__init__()
         self.__class__.__name__ = "TAG_Compound"
         self.filename = filename
@@ -285,12 +482,13 @@ class NBTFile(TAG_Compound):
             self.file = None
         #parse the file given intitially
         if self.file:
-            self.parse_file()
+            self.parse_file(lazy=lazy)
             if filename and 'close' in dir(self.file):
                 self.file.close()
             self.file = None
 
-    def parse_file(self, filename=None, buffer=None, fileobj=None):
+    def parse_file(self, filename=None, buffer=None, fileobj=None,
+        lazy=False):
         if filename:
             self.file = GzipFile(filename, 'rb')
         elif buffer:
@@ -298,6 +496,9 @@ class NBTFile(TAG_Compound):
         elif fileobj:
             self.file = GzipFile(fileobj=fileobj)
         if self.file:
+            if lazy:
+                self._parse_file_lazy()
+                return
             try:
                 type = TAG_Byte(buffer=self.file)
                 if type.value == self.id:
@@ -311,6 +512,35 @@ class NBTFile(TAG_Compound):
                 raise MalformedFileError("Partial File Parse: file possibly truncated.")
         else: ValueError("need a file!")
 
+    def _parse_file_lazy(self):
+        data = self.file.read()
+        self.file.close()
+        name, offset = scan_root(data)
+        try:
+            if self._parse_lazy(data, offset) > len(data):
+                raise StructError()
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+        self.name = name
+
+    def encode(self):
+        """
+        Render the entire file into a single buffer.
+
+        Sizes are worked out first, so that the buffer is only allocated
+        once, and then every tag is packed straight into it.
+
+        :returns: a ``bytearray`` of uncompressed NBT data
+        """
+
+        name = self.name or u""
+        buf = bytearray(3 + len(name.encode("utf-8")) + self._payload_size())
+        buf[0] = self.id
+        offset = _render_string(name, buf, 1)
+        self._render_into(buf, offset)
+        return buf
+
     def write_file(self, filename=None, buffer=None, fileobj=None):
         if buffer:
             self.file = buffer
@@ -323,9 +553,8 @@ class NBTFile(TAG_Compound):
         elif not self.file:
             raise ValueError("Need to specify either a filename or a file")
         #Render tree to file
-        TAG_Byte(self.id)._render_buffer(self.file)
-        TAG_String(self.name)._render_buffer(self.file)
-        self._render_buffer(self.file)
+        # GzipFile only takes strings and read-only buffers.
+        self.file.write(_readonly(self.encode()))
         #make sure the file is complete
         if 'flush' in dir(self.file):
             self.file.flush()
@@ -380,9 +609,7 @@ def pack_nbt(s):
     elif isinstance(s, dict):
         tag = TAG_Compound()
         for k, v in s:
-            v = pack_nbt(v)
-            v.name = str(k)
-            tag.tags.append(v)
+            tag[str(k)] = pack_nbt(v)
         return tag
     elif hasattr(s, "__iter__"):
         # We arrive at a slight quandry. NBT lists must be homogenous, unlike
@@ -403,3 +630,119 @@ def pack_nbt(s):
         return tag
     else:
         raise ValueError("Couldn't serialise type %s!" % type(s))
+
+# Scanning NBT data in place, without building tags for all of it.
+
+_sizes = {
+    TAG_BYTE: 1,
+    TAG_SHORT: 2,
+    TAG_INT: 4,
+    TAG_LONG: 8,
+    TAG_FLOAT: 4,
+    TAG_DOUBLE: 8,
+}
+"""
+The sizes of the payloads of fixed-size tags.
+"""
+
+def _slice(data, start, end):
+    """
+    Copy some bytes out of NBT data.
+    """
+
+    data = data[start:end]
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return str(data)
+
+def skip_tag(data, offset, tagid):
+    """
+    Find the end of a tag's payload, without decoding it.
+
+    :param data: a ``str``, ``buffer``, or ``memoryview`` of NBT data
+    :param int offset: where the tag's payload starts
+    :param int tagid: the type of the tag
+    :returns: the offset just past the payload
+    """
+
+    if tagid in _sizes:
+        return offset + _sizes[tagid]
+    elif tagid == TAG_BYTE_ARRAY:
+        return offset + 4 + unpack_from(">i", data, offset)[0]
+    elif tagid == TAG_STRING:
+        return offset + 2 + unpack_from(">h", data, offset)[0]
+    elif tagid == TAG_LIST:
+        itemid, length = unpack_from(">bi", data, offset)
+        offset += 5
+        if itemid in _sizes:
+            return offset + length * _sizes[itemid]
+        for i in xrange(length):
+            offset = skip_tag(data, offset, itemid)
+        return offset
+    elif tagid == TAG_COMPOUND:
+        children, offset = scan_compound(data, offset)
+        return offset
+
+    raise ValueError("Unrecognised tag type")
+
+def scan_compound(data, offset):
+    """
+    Find the children of a compound tag, without decoding them.
+
+    :param data: a ``str``, ``buffer``, or ``memoryview`` of NBT data
+    :param int offset: where the compound's payload starts
+    :returns: a list of (name, type, offset) tuples giving where each child's
+              payload starts, and the offset just past the compound
+    """
+
+    children = []
+
+    while True:
+        tagid = unpack_from(">b", data, offset)[0]
+        offset += 1
+        if tagid == TAG_END:
+            return children, offset
+
+        length = unpack_from(">h", data, offset)[0]
+        offset += 2
+        name = unicode(_slice(data, offset, offset + length), "utf-8")
+        offset += length
+
+        children.append((name, tagid, offset))
+        offset = skip_tag(data, offset, tagid)
+
+def scan_root(data):
+    """
+    Find the payload of the compound tag which starts a file.
+
+    :param data: a ``str``, ``buffer``, or ``memoryview`` of uncompressed
+                 NBT data
+    :returns: the name of the compound, and where its payload starts
+    """
+
+    try:
+        tagid, length = unpack_from(">bh", data)
+    except StructError:
+        raise MalformedFileError(
+            "Partial File Parse: file possibly truncated.")
+
+    if tagid != TAG_COMPOUND:
+        raise MalformedFileError("First record is not a Compound Tag")
+
+    name = unicode(_slice(data, 3, 3 + length), "utf-8")
+    return name, 3 + length
+
+def read_tag(data, offset, tagid):
+    """
+    Build a tag from its payload.
+
+    Only the payload itself is copied, so this is a cheap way to decode a
+    single tag out of a large file.
+
+    :param data: a ``str``, ``buffer``, or ``memoryview`` of NBT data
+    :param int offset: where the tag's payload starts
+    :param int tagid: the type of the tag
+    """
+
+    end = skip_tag(data, offset, tagid)
+    return TAGLIST[tagid](buffer=StringIO(_slice(data, offset, end)))
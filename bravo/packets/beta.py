@@ -1,9 +1,11 @@
 from collections import namedtuple
 import functools
+from struct import error as StructError
 
 from construct import Struct, Container, Embed, Enum, MetaField
 from construct import MetaArray, If, Switch, Const, Peek
-from construct import OptionalGreedyRange, RepeatUntil
+from construct import RepeatUntil
+from construct import ConstructError, SizeofError, SwitchError
 from construct import PascalString, Adapter
 from construct import UBInt8, UBInt16, UBInt32, UBInt64
 from construct import SBInt8, SBInt16, SBInt32, SBInt64
@@ -11,6 +13,8 @@ from construct import BFloat32, BFloat64
 from construct import BitStruct, BitField
 from construct import StringAdapter, LengthValueAdapter, Sequence
 
+from bravo.packets.codec import encoders, decoders
+
 DUMP_ALL_PACKETS = False
 
 # Strings.
@@ -508,17 +512,149 @@ packets = {
     ),
 }
 
-packet_stream = Struct("packet_stream",
-    OptionalGreedyRange(
-        Struct("full_packet",
-            UBInt8("header"),
-            Switch("payload", lambda context: context["header"], packets),
-        ),
-    ),
-    OptionalGreedyRange(
-        UBInt8("leftovers"),
-    ),
-)
+packet_sizes = {}
+"""
+Sizes of the packets which always have the same size, keyed by header.
+"""
+
+for header, packet in packets.iteritems():
+    try:
+        packet_sizes[header] = packet.sizeof()
+    except SizeofError:
+        pass
+
+class BufferReader(object):
+    """
+    A read-only file-like view of a ``bytearray``, for parsing with construct.
+
+    Reads which run off the end of the buffer are remembered, so that callers
+    can tell an incomplete packet apart from a malformed one.
+
+    :ivar int short: the offset which a read wanted to reach past the end of
+        the buffer, or None if every read was satisfied
+    """
+
+    def __init__(self, buf, offset):
+        self.buf = buf
+        self.offset = offset
+        self.short = None
+
+    def read(self, length):
+        start = self.offset
+        end = start + length
+        if end > len(self.buf):
+            self.short = max(end, self.short)
+            end = len(self.buf)
+        self.offset = end
+        return str(self.buf[start:end])
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset):
+        self.offset = offset
+
+class PacketDecoder(object):
+    """
+    A streaming packet decoder.
+
+    Received data is appended to a buffer, and a read offset marks the start
+    of the first packet which hasn't been decoded yet. Every packet is
+    decoded exactly once. Packets which haven't been completely received are
+    not parsed again until enough data has arrived to possibly complete them;
+    for packets with a fixed size, they are not parsed at all until they are
+    complete.
+    """
+
+    compact_threshold = 64 * 1024
+    """
+    The number of decoded bytes which may be kept at the start of the buffer
+    before they are thrown away.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.offset = 0
+        self.needed = 0
+
+    def __iter__(self):
+        packet = self.next_packet()
+        while packet is not None:
+            yield packet
+            packet = self.next_packet()
+
+    def feed(self, data):
+        """
+        Add received data to the buffer.
+        """
+
+        if self.offset == len(self.buf):
+            # Everything has been decoded, so start over.
+            del self.buf[:]
+            self.needed -= self.offset
+            self.offset = 0
+        elif self.offset > self.compact_threshold:
+            del self.buf[:self.offset]
+            self.needed -= self.offset
+            self.offset = 0
+
+        self.buf.extend(data)
+
+    def leftovers(self):
+        """
+        Get the bytes which haven't been decoded yet.
+        """
+
+        return str(self.buf[self.offset:])
+
+    def next_packet(self):
+        """
+        Decode the next packet.
+
+        :returns: a tuple of the packet header and payload, or None if the
+                  next packet hasn't been completely received yet
+        :raises: ``SwitchError`` for unknown packets, and ``ConstructError``
+                 for malformed packets
+        """
+
+        available = len(self.buf) - self.offset
+        if not available or len(self.buf) < self.needed:
+            return None
+
+        header = self.buf[self.offset]
+        if header not in packets:
+            raise SwitchError("Unknown packet %d" % header)
+
+        start = self.offset + 1
+
+        if header in packet_sizes:
+            end = start + packet_sizes[header]
+            if end > len(self.buf):
+                self.needed = end
+                return None
+
+        if header in decoders:
+            # Fixed-size packets are already known to be complete.
+            payload = decoders[header](self.buf, start)
+            self.offset = end
+        else:
+            reader = BufferReader(self.buf, start)
+            try:
+                payload = packets[header].parse_stream(reader)
+            except Exception:
+                if reader.short is None:
+                    raise
+                self.needed = reader.short
+                return None
+            self.offset = reader.offset
+
+        self.needed = 0
+
+        if DUMP_ALL_PACKETS:
+            print "Parsed packet %d" % header
+            print payload
+
+        return header, payload
 
 def parse_packets(bytestream):
     """
@@ -529,27 +665,16 @@ def parse_packets(bytestream):
     leftover unparseable bytes.
     """
 
-    container = packet_stream.parse(bytestream)
+    decoder = PacketDecoder()
+    decoder.feed(bytestream)
 
-    l = [(i.header, i.payload) for i in container.full_packet]
-    leftovers = "".join(chr(i) for i in container.leftovers)
+    l = []
+    try:
+        l.extend(decoder)
+    except ConstructError:
+        pass
 
-    if DUMP_ALL_PACKETS:
-        for packet in l:
-            print "Parsed packet %d" % packet[0]
-            print packet[1]
-
-    return l, leftovers
-
-incremental_packet_stream = Struct("incremental_packet_stream",
-    Struct("full_packet",
-        UBInt8("header"),
-        Switch("payload", lambda context: context["header"], packets),
-    ),
-    OptionalGreedyRange(
-        UBInt8("leftovers"),
-    ),
-)
+    return l, decoder.leftovers()
 
 def parse_packets_incrementally(bytestream):
     """
@@ -564,13 +689,14 @@ def parse_packets_incrementally(bytestream):
     :returns: a generator yielding tuples of headers and payloads
     """
 
-    while bytestream:
-        parsed = incremental_packet_stream.parse(bytestream)
-        header = parsed.full_packet.header
-        payload = parsed.full_packet.payload
-        bytestream = "".join(chr(i) for i in parsed.leftovers)
+    decoder = PacketDecoder()
+    decoder.feed(bytestream)
 
-        yield header, payload
+    try:
+        for packet in decoder:
+            yield packet
+    except ConstructError:
+        pass
 
 packets_by_name = {
     "ping"               : 0,
@@ -647,6 +773,14 @@ def make_packet(packet, *args, **kwargs):
     if DUMP_ALL_PACKETS:
         print "Making packet %s (%d)" % (packet, header)
         print container
+
+    if packet in encoders:
+        try:
+            return encoders[packet](container)
+        except (KeyError, TypeError, StructError):
+            # Let construct deal with it, and raise its own errors.
+            pass
+
     payload = packets[header].build(container)
     return chr(header) + payload
 
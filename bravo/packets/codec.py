@@ -0,0 +1,158 @@
+"""
+Precompiled codecs for the busiest packets.
+
+Building and parsing packets with construct is flexible but slow. The packets
+which are sent and received most often are instead packed and unpacked here
+with precompiled ``struct.Struct`` objects. The construct definitions in
+``bravo.packets.beta`` remain the reference, and are used for everything
+else; packets encoded here must be byte-for-byte identical to theirs.
+"""
+
+from struct import Struct, pack
+from zlib import compress
+
+from construct import Container
+
+encoders = {}
+"""
+Encoders, keyed by packet name.
+
+Each encoder takes a payload dictionary and returns the complete packet,
+including its header.
+"""
+
+decoders = {}
+"""
+Decoders, keyed by packet header.
+
+Each decoder takes a buffer and the offset of a payload within it, and
+returns the payload as a ``Container``. Only packets with a fixed size have
+decoders, so callers must check that the entire payload is in the buffer.
+"""
+
+def fixed(header, fmt, fields):
+    """
+    Make an encoder and decoder for a packet made of a flat list of
+    fixed-size fields.
+    """
+
+    packer = Struct(">B" + fmt)
+    unpacker = Struct(">" + fmt)
+
+    def encode(payload):
+        return packer.pack(header, *[payload[field] for field in fields])
+
+    def decode(buf, offset):
+        return Container(**dict(zip(fields, unpacker.unpack_from(buf,
+            offset))))
+
+    return encode, decode
+
+def register(name, header, encode, decode):
+    encoders[name] = encode
+    decoders[header] = decode
+
+# Movement, as sent by clients. These are nested, so they are written out by
+# hand.
+
+_grounded = Struct(">B")
+_grounded_packet = Struct(">BB")
+_position = Struct(">ddddB")
+_position_packet = Struct(">BddddB")
+_orientation = Struct(">ffB")
+_orientation_packet = Struct(">BffB")
+_location = Struct(">ddddffB")
+_location_packet = Struct(">BddddffB")
+
+def encode_grounded(payload):
+    return _grounded_packet.pack(10, payload["grounded"])
+
+def decode_grounded(buf, offset):
+    grounded, = _grounded.unpack_from(buf, offset)
+    return Container(grounded=grounded)
+
+def encode_position(payload):
+    position = payload["position"]
+    return _position_packet.pack(11, position["x"], position["y"],
+        position["stance"], position["z"], payload["grounded"]["grounded"])
+
+def decode_position(buf, offset):
+    x, y, stance, z, grounded = _position.unpack_from(buf, offset)
+    return Container(position=Container(x=x, y=y, stance=stance, z=z),
+        grounded=Container(grounded=grounded))
+
+def encode_orientation(payload):
+    orientation = payload["orientation"]
+    return _orientation_packet.pack(12, orientation["rotation"],
+        orientation["pitch"], payload["grounded"]["grounded"])
+
+def decode_orientation(buf, offset):
+    rotation, pitch, grounded = _orientation.unpack_from(buf, offset)
+    return Container(orientation=Container(rotation=rotation, pitch=pitch),
+        grounded=Container(grounded=grounded))
+
+def encode_location(payload):
+    position = payload["position"]
+    orientation = payload["orientation"]
+    return _location_packet.pack(13, position["x"], position["y"],
+        position["stance"], position["z"], orientation["rotation"],
+        orientation["pitch"], payload["grounded"]["grounded"])
+
+def decode_location(buf, offset):
+    (x, y, stance, z, rotation, pitch,
+        grounded) = _location.unpack_from(buf, offset)
+    return Container(position=Container(x=x, y=y, stance=stance, z=z),
+        orientation=Container(rotation=rotation, pitch=pitch),
+        grounded=Container(grounded=grounded))
+
+register("grounded", 10, encode_grounded, decode_grounded)
+register("position", 11, encode_position, decode_position)
+register("orientation", 12, encode_orientation, decode_orientation)
+register("location", 13, encode_location, decode_location)
+
+# Entities, as sent by servers.
+
+register("destroy", 29, *fixed(29, "I", ["eid"]))
+register("create", 30, *fixed(30, "I", ["eid"]))
+register("entity-position", 31, *fixed(31, "Ibbb", ["eid", "x", "y", "z"]))
+register("entity-orientation", 32,
+    *fixed(32, "IBB", ["eid", "yaw", "pitch"]))
+register("entity-location", 33,
+    *fixed(33, "IbbbBB", ["eid", "x", "y", "z", "yaw", "pitch"]))
+register("teleport", 34,
+    *fixed(34, "IiiiBB", ["eid", "x", "y", "z", "yaw", "pitch"]))
+
+# World updates.
+
+register("time", 4, *fixed(4, "Q", ["timestamp"]))
+register("prechunk", 50, *fixed(50, "iiB", ["x", "z", "enabled"]))
+register("block", 53,
+    *fixed(53, "iBiBB", ["x", "y", "z", "type", "meta"]))
+
+# Chunks and batches vary in size, and are only ever sent by servers, so
+# they are only encoded.
+
+_chunk = Struct(">BiHiBBBI")
+_batch = Struct(">BiiH")
+
+def pack_chunk(payload, data):
+    """
+    Encode a chunk whose data has already been compressed.
+    """
+
+    return _chunk.pack(51, payload["x"], payload["y"], payload["z"],
+        payload["x_size"], payload["y_size"], payload["z_size"],
+        len(data)) + data
+
+def encode_chunk(payload):
+    return pack_chunk(payload, compress(payload["data"]))
+
+def encode_batch(payload):
+    length = payload["length"]
+    return (_batch.pack(52, payload["x"], payload["z"], length) +
+        pack(">%dH%dB%dB" % (length, length, length),
+            *(list(payload["coords"]) + list(payload["types"]) +
+                list(payload["metadata"]))))
+
+encoders["chunk"] = encode_chunk
+encoders["batch"] = encode_batch
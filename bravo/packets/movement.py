@@ -0,0 +1,83 @@
+"""
+Movement encoding for entities.
+"""
+
+from bravo.packets.beta import make_packet
+
+class MovementEncoder(object):
+    """
+    Encoder for entity movement packets, as seen by a single client.
+
+    The encoder remembers the last position and orientation sent to its client
+    for each entity. Small movements are sent as relative moves and looks,
+    which are much smaller than teleports. Teleports are only sent for an
+    entity's first update, for large jumps, and periodically, to correct any
+    drift in the client. Updates which wouldn't change anything visible are
+    not sent at all.
+
+    All coordinates are in the absolute fixed-point format used on the wire,
+    and all angles are in bytes.
+    """
+
+    teleport_interval = 20
+    """
+    The number of relative moves after which a teleport is forced.
+    """
+
+    def __init__(self):
+        self.entities = {}
+
+    def forget(self, eid):
+        """
+        Forget everything about an entity.
+
+        The next update for this entity will be a teleport.
+        """
+
+        self.entities.pop(eid, None)
+
+    def teleport(self, eid, x, y, z, yaw, pitch):
+        self.entities[eid] = x, y, z, yaw, pitch, 0
+        return make_packet("teleport", eid=eid, x=x, y=y, z=z, yaw=yaw,
+            pitch=pitch)
+
+    def encode(self, eid, x, y, z, yaw, pitch):
+        """
+        Encode an entity's movement.
+
+        :returns: a packet, or an empty string if the client already knows
+                  about this position and orientation
+        """
+
+        if eid not in self.entities:
+            return self.teleport(eid, x, y, z, yaw, pitch)
+
+        lx, ly, lz, lyaw, lpitch, count = self.entities[eid]
+
+        dx, dy, dz = x - lx, y - ly, z - lz
+        moved = dx or dy or dz
+        turned = yaw != lyaw or pitch != lpitch
+
+        if not moved and not turned:
+            return ""
+
+        if moved:
+            if count >= self.teleport_interval:
+                return self.teleport(eid, x, y, z, yaw, pitch)
+            if not all(-128 <= d <= 127 for d in (dx, dy, dz)):
+                return self.teleport(eid, x, y, z, yaw, pitch)
+
+            count += 1
+
+            if turned:
+                packet = make_packet("entity-location", eid=eid, x=dx, y=dy,
+                    z=dz, yaw=yaw, pitch=pitch)
+            else:
+                packet = make_packet("entity-position", eid=eid, x=dx, y=dy,
+                    z=dz)
+        else:
+            packet = make_packet("entity-orientation", eid=eid, yaw=yaw,
+                pitch=pitch)
+
+        self.entities[eid] = x, y, z, yaw, pitch, count
+        return packet
@@ -1,9 +1,11 @@
+from time import time
 from types import ModuleType
 from xml.sax import saxutils
 
 from exocet import ExclusiveMapper, getModule, load, pep302Mapper
 
 from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
 from twisted.plugin import IPlugin
 from twisted.python import log
 
@@ -150,6 +152,92 @@ def synthesize_parameters(parameters):
     module.__dict__.update(parameters)
     return module
 
+module_cache = {}
+"""
+Loaded plugin modules, keyed by module name and parameters key. Each entry is
+the modification time of the module's source and either the loaded module or
+the ``ImportError`` raised while loading it.
+"""
+
+catalogue = {}
+"""
+The names of the modules which provide plugins, keyed by interface and
+parameters key, and then by plugin name.
+"""
+
+def parameters_key(parameters):
+    """
+    Make a hashable key for a dictionary of plugin parameters.
+
+    :returns: a key, or None if the parameters can't be hashed, in which case
+              modules loaded with them shouldn't be cached
+    """
+
+    if not parameters:
+        return ()
+
+    key = tuple(sorted(parameters.iteritems()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def load_module(pm, parameters=None):
+    """
+    Load a plugin module, reusing a previously loaded copy if the module's
+    source hasn't changed since.
+
+    :param ``PythonModule`` pm: the module to load
+    :param dict parameters: parameters to pass into the module
+    """
+
+    key = parameters_key(parameters)
+    mtime = pm.filePath.getModificationTime()
+
+    if key is not None:
+        cached = module_cache.get((pm.name, key))
+        if cached is not None and cached[0] == mtime:
+            m = cached[1]
+            if isinstance(m, ImportError):
+                raise m
+            return m
+
+    mapper = bravoMapper
+
+    if parameters:
+        mapper = mapper.withOverrides(
+            {"bravo.parameters": synthesize_parameters(parameters)})
+
+    try:
+        m = load(pm, mapper)
+    except ImportError, ie:
+        # Modules which can't be imported won't start working until they
+        # change, so remember that too.
+        if key is not None:
+            module_cache[pm.name, key] = mtime, ie
+        raise
+
+    if key is not None:
+        module_cache[pm.name, key] = mtime, m
+
+    return m
+
+def adapt_plugins(interface, m):
+    """
+    Lazily find objects in a module which implement a given interface.
+    """
+
+    for obj in vars(m).itervalues():
+        try:
+            adapted = IPlugin(obj, None)
+            adapted = interface(adapted, None)
+        except:
+            log.err()
+        else:
+            if adapted is not None:
+                yield adapted
+
 def get_plugins(interface, package, parameters=None):
     """
     Lazily find objects in a package which implement a given interface.
@@ -167,6 +255,11 @@ def get_plugins(interface, package, parameters=None):
 
     >>> from bravo import parameters as params
 
+    Loaded modules are cached, and are only loaded again once their source
+    has changed, so repeated lookups with the same parameters will find the
+    same plugin objects. The module providing each plugin is recorded in the
+    catalogue.
+
     This is a rewrite of Twisted's ``twisted.plugin.getPlugins`` which uses
     Exocet instead of Twisted to find the plugins.
 
@@ -175,34 +268,28 @@ def get_plugins(interface, package, parameters=None):
     :param dict parameters: parameters to pass into the plugins
     """
 
-    mapper = bravoMapper
-
-    if parameters:
-        mapper = mapper.withOverrides(
-            {"bravo.parameters": synthesize_parameters(parameters)})
+    key = parameters_key(parameters)
+    found = {}
 
     p = getModule(package)
     for pm in p.iterModules():
         try:
-            m = load(pm, mapper)
-            for obj in vars(m).itervalues():
-                try:
-                    adapted = IPlugin(obj, None)
-                    adapted = interface(adapted, None)
-                except:
-                    log.err()
-                else:
-                    if adapted is not None:
-                        yield adapted
+            m = load_module(pm, parameters)
+            for adapted in adapt_plugins(interface, m):
+                found[getattr(adapted, "name", None)] = pm.name
+                yield adapted
         except ImportError, ie:
             log.msg(ie)
 
+    if key is not None:
+        catalogue[interface, key] = found
+
 def retrieve_plugins(interface, parameters=None):
     """
     Look up all plugins for a certain interface.
 
-    If the plugin cache is enabled, this function will not attempt to reload
-    plugins from disk or discover new plugins.
+    Plugin modules are only loaded from disk if they haven't been loaded
+    before with the same parameters, or if they have changed since.
 
     :param interface interface: the interface to use
     :param dict parameters: parameters to pass into the plugins
@@ -226,12 +313,52 @@ def retrieve_plugins(interface, parameters=None):
 
     return d
 
+def retrieve_cataloged_plugins(interface, names, parameters=None):
+    """
+    Look up a list of plugins by name, using only the catalogue.
+
+    Sortable plugins need edges from all of their peers, and wildcards need
+    every plugin, so neither can be looked up this way.
+
+    :returns: a dict of plugins, keyed by name, or None if the plugins
+              couldn't all be found
+    """
+
+    if issubclass(interface, ISortedPlugin) or "*" in names:
+        return None
+
+    found = catalogue.get((interface, parameters_key(parameters)))
+    if found is None or not all(name in found for name in names):
+        return None
+
+    d = {}
+    for name in set(found[name] for name in names):
+        try:
+            m = load_module(getModule(name), parameters)
+        except ImportError, ie:
+            log.msg(ie)
+            return None
+        for p in adapt_plugins(interface, m):
+            try:
+                verify_plugin(interface, p)
+                d[p.name] = p
+            except PluginException:
+                pass
+
+    if not all(name in d for name in names):
+        return None
+
+    return d
+
 def retrieve_named_plugins(interface, names, parameters=None):
     """
     Look up a list of plugins by name.
 
     Plugins are returned in the same order as their names.
 
+    If all of the plugins have been seen before, only the modules which
+    provided them are examined, instead of the entire package.
+
     :param interface interface: the interface to use
     :param list names: plugins to find
     :param dict parameters: parameters to pass into the plugins
@@ -240,7 +367,9 @@ def retrieve_named_plugins(interface, names, parameters=None):
     :raises PluginException: no plugins could be found for the given interface
     """
 
-    d = retrieve_plugins(interface, parameters)
+    d = retrieve_cataloged_plugins(interface, names, parameters)
+    if d is None:
+        d = retrieve_plugins(interface, parameters)
 
     # Handle wildcards and options.
     names = expand_names(d, names)
@@ -264,3 +393,105 @@ def retrieve_sorted_plugins(interface, names, parameters=None):
     except KeyError, e:
         raise PluginException("Couldn't find plugin %s for interface %s!" %
             (e.args[0], interface))
+
+class CommandRegistry(object):
+    """
+    A table of commands, indexed by name and by alias.
+
+    Discovering plugins is slow, so the table is built once, and is only
+    rebuilt when ``reload()`` is called. The time taken by each dispatched
+    command is recorded in ``timings``.
+    """
+
+    def __init__(self, interface, method, parameters=None, adapted=()):
+        """
+        :param interface interface: the interface which commands provide
+        :param str method: the name of the method which runs a command
+        :param dict parameters: parameters to pass into the plugins
+        :param tuple adapted: other interfaces whose plugins should be adapted
+                              to ``interface`` and included
+        """
+
+        self.interface = interface
+        self.method = method
+        self.parameters = parameters
+        self.adapted = adapted
+
+        self.timings = {}
+        """
+        Dispatch timings, keyed by command name, as lists of call count, total
+        time, and worst time.
+        """
+
+        self.reload()
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    def __getitem__(self, name):
+        return self.commands[name]
+
+    def reload(self):
+        """
+        Discover commands again, replacing the current table.
+        """
+
+        plugins = retrieve_plugins(self.interface, parameters=self.parameters)
+        for interface in self.adapted:
+            d = retrieve_plugins(interface, parameters=self.parameters)
+            for name, plugin in d.iteritems():
+                if name not in plugins:
+                    plugins[name] = self.interface(plugin)
+
+        # Names take precedence over aliases.
+        commands = dict(plugins)
+        for plugin in plugins.itervalues():
+            for alias in plugin.aliases:
+                commands.setdefault(alias, plugin)
+
+        self.plugins = plugins
+        self.commands = commands
+
+    def dispatch(self, name, *args):
+        """
+        Run a command, collecting its output.
+
+        :param str name: the name or alias of the command
+        :returns: a ``Deferred`` which will fire with a list of lines
+        :raises KeyError: no such command exists
+        """
+
+        plugin = self.commands[name]
+        before = time()
+
+        def record(result):
+            self.record(plugin.name, time() - before)
+            return result
+
+        d = maybeDeferred(getattr(plugin, self.method), *args)
+        d.addCallback(list)
+        d.addBoth(record)
+        return d
+
+    def record(self, name, elapsed):
+        """
+        Record the time taken by a single run of a command.
+        """
+
+        timing = self.timings.setdefault(name, [0, 0, 0])
+        timing[0] += 1
+        timing[1] += elapsed
+        timing[2] = max(timing[2], elapsed)
+
+    def latency(self):
+        """
+        Summarize dispatch timings across all commands.
+
+        :returns: a tuple of call count, mean time, and worst time
+        """
+
+        count = sum(timing[0] for timing in self.timings.itervalues())
+        total = sum(timing[1] for timing in self.timings.itervalues())
+        worst = max([timing[2] for timing in self.timings.itervalues()] or
+            [0])
+        return count, total / count if count else 0, worst
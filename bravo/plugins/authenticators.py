@@ -28,7 +28,7 @@ class OfflineAuthenticator(object):
         # we send anything back to the client, because otherwise we won't have
         # a valid entity ready to use.
         d = deferLater(reactor, 0, protocol.challenged)
-        d.addCallback(lambda none: protocol.transport.write(packet))
+        d.addCallback(lambda none: protocol.write(packet))
 
         return True
 
@@ -38,7 +38,7 @@ class OfflineAuthenticator(object):
         packet = make_packet("login", protocol=protocol.eid, username="",
             seed=protocol.factory.world.seed,
             dimension=protocol.factory.world.dimension)
-        protocol.transport.write(packet)
+        protocol.write(packet)
 
         return succeed(None)
 
@@ -65,7 +65,7 @@ class OnlineAuthenticator(object):
         packet = make_packet("handshake", username=challenge)
 
         d = deferLater(reactor, 0, protocol.challenged)
-        d.addCallback(lambda none: protocol.transport.write(packet))
+        d.addCallback(lambda none: protocol.write(packet))
 
         return True
 
@@ -93,7 +93,7 @@ class OnlineAuthenticator(object):
         packet = make_packet("login", protocol=protocol.eid, username="",
             seed=protocol.factory.world.seed,
             dimension=protocol.factory.world.dimension)
-        protocol.transport.write(packet)
+        protocol.write(packet)
 
     def error(self, description, protocol):
 
@@ -118,7 +118,7 @@ class PasswordAuthenticator(object):
         # we send anything back to the client, because otherwise we won't have
         # a valid entity ready to use.
         d = deferLater(reactor, 0, protocol.challenged)
-        d.addCallback(lambda none: protocol.transport.write(packet))
+        d.addCallback(lambda none: protocol.write(packet))
 
         return True
 
@@ -132,7 +132,7 @@ class PasswordAuthenticator(object):
         packet = make_packet("login", protocol=protocol.eid, username="",
             seed=protocol.factory.world.seed,
             dimension=protocol.factory.world.dimension)
-        protocol.transport.write(packet)
+        protocol.write(packet)
 
         return succeed(None)
 
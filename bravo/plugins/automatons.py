@@ -3,7 +3,6 @@ from __future__ import division
 from itertools import product
 from random import randint, random
 
-from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
 from zope.interface import implements
 
@@ -33,18 +32,19 @@ class Trees(object):
             RoundTree,
             NormalTree,
         ]
-        self.tracked = set()
+        self.tracked = {}
 
     def start(self):
         # Noop for now -- this is wrong for several reasons.
         pass
 
     def stop(self):
-        for call in self.tracked:
-            if call.active():
-                call.cancel()
+        for timer in self.tracked.itervalues():
+            timer.cancel()
 
     def process(self, coords):
+        self.tracked.pop(coords, None)
+
         try:
             metadata = factory.world.sync_get_metadata(coords)
             # Is this sapling ready to grow into a big tree? We use a bit-trick to
@@ -55,28 +55,25 @@ class Trees(object):
                 tree.prepare(factory.world)
                 tree.make_trunk(factory.world)
                 tree.make_foliage(factory.world)
-                # We can't easily tell how many chunks were modified, so we have
-                # to flush all of them.
-                factory.flush_all_chunks()
             else:
                 # Increment metadata.
                 metadata += 4
                 factory.world.sync_set_metadata(coords, metadata)
-                call = reactor.callLater(
-                    randint(self.grow_step_min, self.grow_step_max), self.process,
-                    coords)
-                self.tracked.add(call)
-
-            # Filter tracked set.
-            self.tracked = set(i for i in self.tracked if i.active())
+                timer = factory.wheel.schedule(
+                    randint(self.grow_step_min, self.grow_step_max),
+                    self.process, coords)
+                self.tracked[coords] = timer
         except ChunkNotLoaded:
             pass
 
     def feed(self, coords):
-        call = reactor.callLater(
+        if coords in self.tracked:
+            return
+
+        timer = factory.wheel.schedule(
             randint(self.grow_step_min, self.grow_step_max), self.process,
             coords)
-        self.tracked.add(call)
+        self.tracked[coords] = timer
 
     scan = column_scan
 
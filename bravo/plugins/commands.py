@@ -1,12 +1,14 @@
 from textwrap import wrap
 
 from twisted.internet import reactor
+from twisted.internet.task import Cooperator
+from twisted.python import log
 from zope.interface import implements
 
 from bravo.blocks import parse_block
 from bravo.config import configuration
 from bravo.ibravo import IChatCommand, IConsoleCommand, ISeason
-from bravo.plugin import retrieve_plugins, retrieve_named_plugins
+from bravo.plugin import retrieve_named_plugins
 from bravo.plugin import PluginException
 from bravo.packets.beta import make_packet
 from bravo.utilities.temporal import split_time
@@ -29,8 +31,6 @@ class Help(object):
 
     implements(IChatCommand, IConsoleCommand)
 
-    pp = {"factory": factory}
-
     def general_help(self, plugins):
         """
         Return a list of commands.
@@ -70,22 +70,18 @@ class Help(object):
         return help_text
 
     def chat_command(self, username, parameters):
+        plugins = factory.chat_commands.commands
         if parameters:
-            return self.specific_help(retrieve_plugins(IChatCommand,
-                parameters=self.pp),
-                "".join(parameters))
+            return self.specific_help(plugins, "".join(parameters))
         else:
-            return self.general_help(retrieve_plugins(IChatCommand,
-                parameters=self.pp))
+            return self.general_help(plugins)
 
     def console_command(self, parameters):
+        plugins = factory.console_commands.commands
         if parameters:
-            return self.specific_help(retrieve_plugins(IConsoleCommand,
-                parameters=self.pp),
-                "".join(parameters))
+            return self.specific_help(plugins, "".join(parameters))
         else:
-            return self.general_help(retrieve_plugins(IConsoleCommand,
-                parameters=self.pp))
+            return self.general_help(plugins)
 
     name = "help"
     aliases = tuple()
@@ -123,9 +119,8 @@ class Time(object):
         hours, minutes = split_time(factory.time)
 
         # Check if the world has seasons enabled
-        seasons = retrieve_plugins(ISeason).values()
-        if seasons:
-            season = factory.world.season
+        season = factory.world.season
+        if season:
             day_of_season = factory.day - season.day
             while day_of_season < 0:
                 day_of_season += 360
@@ -236,8 +231,7 @@ class Quit(object):
         factory.broadcast(packet)
 
         yield "Saving all chunks to disk..."
-        for chunk in factory.world.dirty_chunk_cache.itervalues():
-            factory.world.save_chunk(chunk)
+        factory.world.save_chunks(factory.world.dirty_chunk_cache.values())
 
         yield "Halting."
         reactor.stop()
@@ -254,8 +248,9 @@ class SaveAll(object):
     def console_command(self, parameters):
         yield "Flushing all chunks..."
 
-        for chunk in factory.world.chunk_cache.itervalues():
-            factory.world.save_chunk(chunk)
+        world = factory.world
+        world.save_chunks(world.dirty_chunk_cache.values() +
+            world.chunk_cache.values())
 
         yield "Save complete!"
 
@@ -264,6 +259,43 @@ class SaveAll(object):
     usage = ""
     info = "Saves all world data to disk"
 
+class Compact(object):
+    """
+    Compact fragmented regions, a little at a time.
+    """
+
+    implements(IConsoleCommand)
+
+    interval = 0.01
+    """
+    The number of seconds between copying each chunk.
+    """
+
+    def console_command(self, parameters):
+        serializer = factory.world.serializer
+        if not hasattr(serializer, "compact_regions"):
+            yield "This world can't be compacted."
+            return
+
+        threshold = float(parameters[0]) if parameters else 0.25
+        spawn = factory.world.spawn[0] // 16, factory.world.spawn[2] // 16
+
+        # One chunk per tick, with a pause between ticks.
+        cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=lambda f: reactor.callLater(self.interval, f))
+        d = cooperator.coiterate(serializer.compact_regions(threshold,
+            spawn))
+        d.addCallback(lambda chaff: log.msg("Compaction finished"))
+        d.addErrback(log.err)
+
+        yield "Compacting regions in the background..."
+
+    name = "compact"
+    aliases = tuple()
+    usage = "[<threshold>]"
+    info = "Compacts regions with at least <threshold> free space"
+
 class SaveOff(object):
 
     implements(IConsoleCommand)
@@ -296,6 +328,25 @@ class SaveOn(object):
     usage = ""
     info = "Enables saving of world data to disk"
 
+class ReloadCommands(object):
+
+    implements(IConsoleCommand)
+
+    def console_command(self, parameters):
+        yield "Reloading commands..."
+
+        factory.chat_commands.reload()
+        factory.console_commands.reload()
+
+        yield "Loaded %d chat commands and %d console commands." % (
+            len(factory.chat_commands.plugins),
+            len(factory.console_commands.plugins))
+
+    name = "reload-commands"
+    aliases = tuple()
+    usage = ""
+    info = "Discovers chat and console commands again"
+
 class WriteConfig(object):
 
     implements(IConsoleCommand)
@@ -365,7 +416,7 @@ class Kick(object):
             reason = " ".join(parameters[1:])
             msg = "%s has been kicked for %s" % (parameters[0],reason)
         packet = make_packet("error", message=msg)
-        player.transport.write(packet)
+        player.write_now(packet)
         yield msg
 
     def console_command(self, parameters):
@@ -444,8 +495,10 @@ say  = Say()
 give = Give()
 quit = Quit()
 save_all = SaveAll()
+compact = Compact()
 save_off = SaveOff()
 save_on = SaveOn()
+reload_commands = ReloadCommands()
 write_config = WriteConfig()
 season = Season()
 me = Me()
@@ -1,3 +1,7 @@
+from __future__ import division
+
+from time import time
+
 from zope.interface import implements
 
 from bravo.ibravo import IConsoleCommand, IChatCommand
@@ -36,13 +40,43 @@ class Status(object):
         for name, protocol in factory.protocols.iteritems():
             count = len(protocol.chunks)
             dirty = len([i for i in protocol.chunks.values() if i.dirty])
-            yield "%s: %d chunks (%d dirty)" % (name, count, dirty)
+            yield "%s: %d chunks (%d dirty), view distance %d" % (name,
+                count, dirty, protocol.view_distance)
+            yield "%s: %d bytes buffered, %s (paused %d times)" % (name,
+                protocol.buffered_bytes(),
+                "paused" if protocol.paused else "streaming",
+                protocol.pause_count)
+            elapsed = max(time() - protocol.login_time, 1)
+            yield "%s: %d writes (%.1f per second, %d bytes per write)" % (
+                name, protocol.writes, protocol.writes / elapsed,
+                protocol.written // max(protocol.writes, 1))
+
+        governor = factory.governor
+        yield "Load: %.3fs reactor lag, %d chunks pending generation" % (
+            governor.lag, governor.backlog)
+
+        timings = factory.tick_timings
+        yield "Tick %d: %.1fms movement, %.1fms damage, %.1fms send" % (
+            factory.ticks, timings["movement"] * 1000,
+            timings["damage"] * 1000, timings["send"] * 1000)
+
+        for kind, registry in (("Chat", factory.chat_commands),
+            ("Console", factory.console_commands)):
+            count, mean, worst = registry.latency()
+            yield "%s commands: %d run, %.1fms mean, %.1fms worst" % (kind,
+                count, mean * 1000, worst * 1000)
 
         chunk_count = len(factory.world.chunk_cache)
         dirty = len(factory.world.dirty_chunk_cache)
         chunk_count += dirty
         yield "World cache: %d chunks (%d dirty)" % (chunk_count, dirty)
 
+        serializer = factory.world.serializer
+        if getattr(serializer, "readahead", 0):
+            cache = serializer.readahead_cache
+            yield "Read-ahead: %d of %d chunks used (%.1f%% hit rate)" % (
+                cache.hits, cache.fetched, cache.hit_rate() * 100)
+
     name = "status"
     aliases = tuple()
     usage = ""
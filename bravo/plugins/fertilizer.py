@@ -44,9 +44,6 @@ class Fertilizer(object):
                 tree.prepare(factory.world)
                 tree.make_trunk(factory.world)
                 tree.make_foliage(factory.world)
-                # We can't easily tell how many chunks were modified, so we have
-                # to flush all of them.
-                factory.flush_all_chunks()
 
         # Interrupt the processing here.
         returnValue((False, builddata))
@@ -1,13 +1,12 @@
 from __future__ import division
 
-from gzip import GzipFile
+from collections import defaultdict
 from itertools import chain
 import os
-from StringIO import StringIO
-from struct import pack, unpack
+from struct import unpack_from
 from urlparse import urlparse
 
-from numpy import array, fromstring, uint8
+from numpy import array, dstack, frombuffer, fromstring, uint8
 
 from twisted.python import log
 from twisted.python.filepath import FilePath
@@ -21,7 +20,12 @@ from bravo.location import Location
 from bravo.nbt import NBTFile
 from bravo.nbt import TAG_Compound, TAG_List, TAG_Byte_Array, TAG_String
 from bravo.nbt import TAG_Double, TAG_Long, TAG_Short, TAG_Int, TAG_Byte
+from bravo.nbt import TAG_LIST, read_tag, scan_compound, scan_root
+from bravo.region import (PageAllocator, ReadAheadCache, RegionCompactor,
+    RegionPool, compress_chunk, distance_from, morton, pack_header,
+    read_header, region_coords)
 from bravo.utilities.bits import unpack_nibbles, pack_nibbles
+from bravo.utilities.compression import Compressor
 
 # Due to technical limitations in the way Twisted discovers plugins, here is
 # how this file works:
@@ -163,8 +167,9 @@ class Alpha(object):
     # place.
 
     def _read_tag(self, fp):
+        # Lazily, since most callers only look at a few of the tags.
         if fp.exists() and fp.getsize():
-            return NBTFile(fileobj=fp.open("r"))
+            return NBTFile(fileobj=fp.open("r"), lazy=True)
         return None
 
     def _write_tag(self, fp, tag):
@@ -372,27 +377,85 @@ class Alpha(object):
         chunk.populated = bool(level["TerrainPopulated"])
 
         if "Entities" in level:
-            for tag in level["Entities"].tags:
-                try:
-                    entity = self._load_entity_from_tag(tag)
-                    chunk.entities.add(entity)
-                except KeyError:
-                    print "Unknown entity %s" % tag["id"].value
-                    print "Tag for entity:"
-                    print tag.pretty_tree()
+            self._load_chunk_entities(chunk, level["Entities"].tags)
 
         if "TileEntities" in level:
-            for tag in level["TileEntities"].tags:
-                try:
-                    tile = self._load_tile_from_tag(tag)
-                    chunk.tiles[tile.x, tile.y, tile.z] = tile
-                except KeyError:
-                    print "Unknown tile entity %s" % tag["id"].value
-                    print "Tag for tile:"
-                    print tag.pretty_tree()
+            self._load_chunk_tiles(chunk, level["TileEntities"].tags)
 
         chunk.dirty = not chunk.populated
 
+    def _load_chunk_from_data(self, chunk, data):
+        """
+        Load a chunk straight from its uncompressed NBT data.
+
+        This is a faster path than ``_load_chunk_from_tag()``. The chunk's
+        compound is scanned in place, the block arrays are NumPy views into
+        a single copy of the data, and only entities and tile entities are
+        built into tags.
+        """
+
+        # One writable copy, which all of the arrays share.
+        data = bytearray(data)
+        view = memoryview(data)
+
+        chaff, offset = scan_root(view)
+        children, chaff = scan_compound(view, offset)
+        root = dict((name, offset) for name, tagid, offset in children)
+        children, chaff = scan_compound(view, root["Level"])
+        level = dict((name, (tagid, offset))
+            for name, tagid, offset in children)
+
+        def byte_array(name):
+            tagid, offset = level[name]
+            length = unpack_from(">i", view, offset)[0]
+            return frombuffer(data, uint8, length, offset + 4)
+
+        def nibble_array(name):
+            packed = byte_array(name)
+            return dstack((packed & 0xf, packed >> 4))
+
+        chunk.blocks = byte_array("Blocks").reshape(chunk.blocks.shape)
+        chunk.heightmap = byte_array("HeightMap").reshape(
+            chunk.heightmap.shape)
+        chunk.blocklight = nibble_array("BlockLight").reshape(
+            chunk.blocklight.shape)
+        chunk.metadata = nibble_array("Data").reshape(chunk.metadata.shape)
+        chunk.skylight = nibble_array("SkyLight").reshape(
+            chunk.skylight.shape)
+
+        # The tag path takes any TerrainPopulated tag as true, too.
+        chunk.populated = "TerrainPopulated" in level
+
+        if "Entities" in level:
+            self._load_chunk_entities(chunk,
+                read_tag(view, level["Entities"][1], TAG_LIST).tags)
+
+        if "TileEntities" in level:
+            self._load_chunk_tiles(chunk,
+                read_tag(view, level["TileEntities"][1], TAG_LIST).tags)
+
+        chunk.dirty = not chunk.populated
+
+    def _load_chunk_entities(self, chunk, tags):
+        for tag in tags:
+            try:
+                entity = self._load_entity_from_tag(tag)
+                chunk.entities.add(entity)
+            except KeyError:
+                print "Unknown entity %s" % tag["id"].value
+                print "Tag for entity:"
+                print tag.pretty_tree()
+
+    def _load_chunk_tiles(self, chunk, tags):
+        for tag in tags:
+            try:
+                tile = self._load_tile_from_tag(tag)
+                chunk.tiles[tile.x, tile.y, tile.z] = tile
+            except KeyError:
+                print "Unknown tile entity %s" % tag["id"].value
+                print "Tag for tile:"
+                print tag.pretty_tree()
+
     def _save_chunk_to_tag(self, chunk):
         tag = NBTFile()
         tag.name = ""
@@ -515,6 +578,10 @@ class Alpha(object):
 
         self._write_tag(fp, tag)
 
+    def save_chunks(self, chunks):
+        for chunk in chunks:
+            self.save_chunk(chunk)
+
     def load_level(self, level):
         tag = self._read_tag(self.folder.child("level.dat"))
         if not tag:
@@ -598,10 +665,31 @@ class Beta(Alpha):
 
     name = "beta"
 
+    fsync = False
+    """
+    Whether to force region files onto the disk after saving chunks.
+    """
+
+    readahead = 0
+    """
+    How far around each loaded chunk, in chunks, to read ahead; zero turns
+    read-ahead off.
+    """
+
     def __init__(self, url):
         Alpha.__init__(self, url)
 
         self.regions = dict()
+        self.pool = RegionPool()
+
+        # Worlds start this, and share it with their network code.
+        self.compressor = Compressor()
+
+        self.readahead_cache = ReadAheadCache()
+
+        # Regions being compacted, and whether they have been written to
+        # since their compaction started.
+        self.compacting = dict()
 
     def _save_level_to_tag(self, level):
         tag = Alpha._save_level_to_tag(self, level)
@@ -619,36 +707,108 @@ class Beta(Alpha):
         """
 
         fp = self.folder.child("region").child(region)
-        handle = fp.open("r")
-        page = handle.read(4096)
-        # The + 1 is not gratuitous. Remember that range/xrange won't include
-        # the upper index, but we want it, so we need to increase our upper
-        # bound. Additionally, the first page is off-limits.
-        free_pages = set(xrange(2, (fp.getsize() // 4096) + 1))
-        positions = dict()
-
-        for x in xrange(32):
-            for z in xrange(32):
-                offset = 4 * (x + z * 32)
-                position = unpack(">L", page[offset:offset+4])[0]
-                pages = position & 0xff
-                position >>= 8
-                if position and pages:
-                    positions[x, z] = position, pages
-                    for i in xrange(pages):
-                        free_pages.discard(position + i)
+        handle = self.pool.open(fp)
+        positions = read_header(handle.read(0, 4096))
+        allocator = PageAllocator.from_positions(positions)
+
+        self.regions[region] = positions, allocator
+
+    def fragmentation(self, region):
+        """
+        Get the fraction of a region's pages which are free.
+        """
+
+        if region not in self.regions:
+            self.cache_region_pages(region)
+
+        return self.regions[region][1].fragmentation()
+
+    def compact_region(self, region, key=morton):
+        """
+        Compact a region, packing its chunks together in order.
+
+        This is a generator which copies one chunk per iteration. Chunks may
+        be loaded and saved in the meantime; if any chunk in the region is
+        saved before the copy is finished, the copy is thrown away and the
+        region is left as it was. Otherwise, the compacted file replaces the
+        region in a single step.
+
+        Regions which are already being compacted are skipped.
+
+        :param str region: the name of the region file
+        :param callable key: a function of chunk coordinates within the
+                             region, giving the order of the chunks
+        """
+
+        if region in self.compacting:
+            log.msg("Region %s is already being compacted; skipping" %
+                region)
+            return
+
+        fp = self.folder.child("region").child(region)
+        compactor = RegionCompactor(fp, key)
+        self.compacting[region] = False
+
+        try:
+            for step in compactor.copy():
+                yield step
+
+            if self.compacting[region]:
+                log.msg("Region %s changed while compacting; skipping" %
+                    region)
+                compactor.abort()
+                return
+
+            self.pool.close(fp)
+            compactor.commit()
+            self.regions.pop(region, None)
+            log.msg("Compacted region %s from %d to %d pages" % (region,
+                compactor.old_pages, compactor.new_pages))
+        except:
+            compactor.abort()
+            raise
+        finally:
+            del self.compacting[region]
+
+    def compact_regions(self, threshold=0.25, spawn=None):
+        """
+        Compact every region which is at least ``threshold`` free pages.
+
+        This is a generator, like ``compact_region()``.
+
+        :param float threshold: the fragmentation needed for compaction
+        :param tuple spawn: the chunk coordinates of the spawn point; if
+                            given, chunks are ordered by distance from it,
+                            instead of along a Z-order curve
+        """
+
+        folder = self.folder.child("region")
+        if not folder.exists():
+            return
 
-        self.regions[region] = positions, free_pages
+        for fp in sorted(folder.globChildren("r.*.mcr")):
+            region = fp.basename()
+            if self.fragmentation(region) < threshold:
+                continue
+
+            if spawn is None:
+                key = morton
+            else:
+                rx, rz = region_coords(region)
+                key = distance_from(rx, rz, *spawn)
+
+            for step in self.compact_region(region, key):
+                yield step
 
     def load_chunk(self, chunk):
         region = name_for_region(chunk.x, chunk.z)
         fp = self.folder.child("region").child(region)
-        if not fp.exists():
-            return
 
         x, z = chunk.x % 32, chunk.z % 32
 
         if region not in self.regions:
+            if not fp.exists():
+                return
             self.cache_region_pages(region)
 
         positions = self.regions[region][0]
@@ -661,30 +821,117 @@ class Beta(Alpha):
         if not position or not pages:
             return
 
-        handle = fp.open("r")
-        handle.seek(position * 4096)
-        data = handle.read(pages * 4096)
-        length = unpack(">L", data[:4])[0] - 1
+        data = None
+        if self.readahead:
+            data = self.readahead_cache.take((region, x, z))
+
+        if data is None:
+            # Slice the payload straight out of the region's map.
+            handle = self.pool.open(fp)
+            data = handle.read(position * 4096, pages * 4096)
+
+            if self.readahead:
+                self.read_ahead(region, x, z)
+
+        length = unpack_from(">L", data)[0] - 1
         version = ord(data[4])
 
-        data = data[5:length+5]
-        if version == 1:
-            data = data.decode("gzip")
-            fileobj = GzipFile(fileobj=StringIO(data))
-        elif version == 2:
-            fileobj = StringIO(data.decode("zlib"))
+        if self.compressor.pool is None:
+            data = buffer(data, 5, length)
+        else:
+            # Saves can rewrite the region's pages in place while a worker
+            # thread is still decompressing, so workers get their own copy.
+            data = data[5:5 + length]
+        d = self.compressor.decompress(data, gzip=version == 1)
+
+        def load(data):
+            return self._load_chunk_from_data(chunk, data)
+
+        d.addCallback(load)
+        return d
+
+    def read_ahead(self, region, x, z):
+        """
+        Read the chunks around a chunk into the read-ahead cache.
+
+        Only chunks in the same region are read. Chunks in adjacent pages are
+        read together, in a single read.
+
+        :param str region: the name of the region file
+        :param int x: chunk x coordinate within the region
+        :param int z: chunk z coordinate within the region
+        """
+
+        positions = self.regions[region][0]
+        r = self.readahead
+
+        wanted = []
+        for i in range(max(x - r, 0), min(x + r + 1, 32)):
+            for j in range(max(z - r, 0), min(z + r + 1, 32)):
+                if ((i, j) in positions and (i, j) != (x, z) and
+                    (region, i, j) not in self.readahead_cache):
+                    position, pages = positions[i, j]
+                    wanted.append((position, pages, i, j))
 
-        tag = NBTFile(buffer=fileobj)
+        if not wanted:
+            return
+
+        wanted.sort()
+        handle = self.pool.open(self.folder.child("region").child(region))
+
+        k = 0
+        while k < len(wanted):
+            start = end = wanted[k][0]
+            run = []
+            while k < len(wanted) and wanted[k][0] == end:
+                run.append(wanted[k])
+                end += wanted[k][1]
+                k += 1
 
-        return self._load_chunk_from_tag(chunk, tag)
+            data = str(handle.read(start * 4096, (end - start) * 4096))
+
+            for position, pages, i, j in run:
+                offset = (position - start) * 4096
+                payload = data[offset:offset + pages * 4096]
+                if len(payload) < 5:
+                    continue
+                length = unpack_from(">L", payload)[0] + 4
+                self.readahead_cache.add((region, i, j), payload[:length])
 
     def save_chunk(self, chunk):
-        tag = self._save_chunk_to_tag(chunk)
-        b = StringIO()
-        tag.write_file(buffer=b)
-        data = b.getvalue().encode("zlib")
+        self.save_chunks([chunk])
+
+    def save_chunks(self, chunks):
+        """
+        Save many chunks at once.
+
+        Chunks are grouped by region, and each region is written in one pass:
+        the chunks are compressed together, their pages are allocated, their
+        payloads are written in order of position, and then the header is
+        written once.
+        """
+
+        regions = defaultdict(dict)
+        for chunk in chunks:
+            region = name_for_region(chunk.x, chunk.z)
+            regions[region][chunk.x % 32, chunk.z % 32] = chunk
+
+        for region, chunks in sorted(regions.iteritems()):
+            self.save_region_chunks(region, chunks)
+
+    def save_region_chunks(self, region, chunks):
+        """
+        Save chunks which are all in a single region.
+
+        :param str region: the name of the region file
+        :param dict chunks: chunks, keyed by coordinates within the region
+        """
+
+        payloads = [self._save_chunk_to_tag(chunk).encode()
+            for chunk in chunks.itervalues()]
+        payloads = self.compressor.map(compress_chunk, payloads,
+            self.compressor.level)
 
-        region = name_for_region(chunk.x, chunk.z)
         fp = self.folder.child("region")
         if not fp.exists():
             fp.makedirs()
@@ -699,66 +946,50 @@ class Beta(Alpha):
         if region not in self.regions:
             self.cache_region_pages(region)
 
-        positions = self.regions[region][0]
+        if region in self.compacting:
+            self.compacting[region] = True
 
-        x, z = chunk.x % 32, chunk.z % 32
+        positions, allocator = self.regions[region]
 
-        if (x, z) in positions:
-            position, pages = positions[x, z]
-        else:
-            position, pages = 0, 0
-
-        # Pack up the data, all ready to go.
-        data = "%s\x02%s" % (pack(">L", len(data) + 1), data)
-        needed_pages = (len(data) + 4095) // 4096
-
-        handle = fp.open("r+")
-
-        # I should comment this, since it's not obvious in the original MCR
-        # code either. The reason that we might want to reallocate pages if we
-        # have shrunk, and not just grown, is that it allows the region to
-        # self-vacuum somewhat by reusing single unused pages near the
-        # beginning of the file. While this isn't an absolute guarantee, the
-        # potential savings, and the guarantee that sometime during this
-        # method we *will* be blocking, makes it worthwhile computationally.
-        # This is a lot cheaper than an explicit vacuum, by the way!
-        if not position or not pages or pages != needed_pages:
-            free_pages = self.regions[region][1]
-
-            # Deallocate our current home.
-            for i in xrange(pages):
-                free_pages.add(position + i)
-
-            # Find a new home for us.
-            found = False
-            for candidate in sorted(free_pages):
-                if all(candidate + i in free_pages
-                    for i in range(needed_pages)):
-                        # Excellent.
-                        position = candidate
-                        found = True
-                        break
-
-            # If we couldn't find a reusable run of pages, we should just go
-            # to the end of the file.
-            if not found:
-                position = (fp.getsize() + 4095) // 4096
-
-            # And allocate our new home.
-            for i in xrange(needed_pages):
-                free_pages.discard(position + i)
-
-        pages = needed_pages
-
-        positions[x, z] = position, pages
-
-        # Write our payload.
-        handle.seek(position * 4096)
-        handle.write(data)
-
-        # Write our position and page count.
-        offset = 4 * (x + z * 32)
-        position = position << 8 | pages
-        handle.seek(offset)
-        handle.write(pack(">L", position))
-        handle.close()
+        for x, z in chunks:
+            self.readahead_cache.discard((region, x, z))
+
+        writes = []
+        moving = []
+
+        for coords, data in zip(chunks, payloads):
+            needed_pages = (len(data) + 4095) // 4096
+
+            position, pages = positions.get(coords, (0, 0))
+
+            # I should comment this, since it's not obvious in the original
+            # MCR code either. The reason that we might want to reallocate
+            # pages if we have shrunk, and not just grown, is that it allows
+            # the region to self-vacuum somewhat by reusing single unused
+            # pages near the beginning of the file. While this isn't an
+            # absolute guarantee, the potential savings, and the guarantee
+            # that sometime during this method we *will* be blocking, makes
+            # it worthwhile computationally. This is a lot cheaper than an
+            # explicit vacuum, by the way!
+            if position and pages == needed_pages:
+                writes.append((position, data))
+            else:
+                # Deallocate our current home; we'll find a new one once
+                # every other moving chunk has done the same.
+                if position and pages:
+                    allocator.free(position, pages)
+                moving.append((needed_pages, coords, data))
+
+        # Big chunks go first, while there are still big runs of free pages.
+        moving.sort(key=lambda t: t[0], reverse=True)
+        for pages, coords, data in moving:
+            position = allocator.allocate(pages)
+            positions[coords] = position, pages
+            writes.append((position, data))
+
+        handle = self.pool.open(fp)
+        handle.write_chunks(writes)
+        handle.write(0, pack_header(positions))
+
+        if self.fsync:
+            handle.sync()
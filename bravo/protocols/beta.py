@@ -4,27 +4,32 @@ from time import time
 from urlparse import urlunparse
 from math import pi
 
+from construct import ConstructError
 from twisted.internet import reactor
 from twisted.internet.defer import (DeferredList, inlineCallbacks,
     maybeDeferred, succeed)
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol
 from twisted.internet.task import cooperate, deferLater, LoopingCall
-from twisted.internet.task import TaskDone, TaskFailed
+from twisted.internet.task import NotPaused, TaskDone, TaskFailed
+from twisted.internet.task import TaskFinished
 from twisted.python import log
 from twisted.web.client import getPage
+from zope.interface import implements
 
 from bravo.blocks import blocks, items
 from bravo.config import configuration
 from bravo.entity import Sign
 from bravo.errors import BuildError
 from bravo.factories.infini import InfiniClientFactory
-from bravo.ibravo import (IChatCommand, IPreBuildHook, IPostBuildHook,
-    IDigHook, ISignHook, IUseHook)
+from bravo.ibravo import (IPreBuildHook, IPostBuildHook, IDigHook, ISignHook,
+    IUseHook)
 from bravo.inventory import Workbench, sync_inventories
 from bravo.location import Location
 from bravo.motd import get_motd
-from bravo.packets.beta import parse_packets, make_packet, make_error_packet
-from bravo.plugin import retrieve_plugins
+from bravo.packets.beta import (PacketDecoder, make_packet,
+    make_error_packet)
+from bravo.packets.movement import MovementEncoder
 from bravo.policy.dig import dig_policies
 from bravo.utilities.coords import split_coords
 from bravo.utilities.chat import username_alternatives
@@ -33,10 +38,28 @@ from bravo.utilities.chat import username_alternatives
 
 SUPPORTED_PROTOCOL = 13
 
-circle = [(i, j)
-    for i, j in product(xrange(-10, 10), xrange(-10, 10))
-    if i**2 + j**2 <= 100
-]
+_circles = {}
+
+def points_in_circle(radius):
+    """
+    Get a list of points in a filled circle of the given radius.
+
+    Circles are cached, since they are requested every time a player moves
+    between chunks.
+
+    :param int radius: radius of the circle, in chunks
+    :returns: list of (x, z) offsets from the center of the circle
+    """
+
+    if radius not in _circles:
+        _circles[radius] = [(i, j)
+            for i, j in product(xrange(-radius, radius), repeat=2)
+            if i**2 + j**2 <= radius**2
+        ]
+
+    return _circles[radius]
+
+circle = points_in_circle(10)
 """
 A list of points in a filled circle of radius 10.
 """
@@ -49,14 +72,34 @@ class BetaServerProtocol(Protocol):
 
     This class is mostly designed to be a skeleton for featureful clients. It
     tries hard to not step on the toes of potential subclasses.
+
+    Protocols are push producers for their own transports. When more than
+    ``high_water`` bytes are waiting to be sent, the protocol is paused, and
+    it is resumed once the backlog has drained to ``low_water`` bytes.
     """
 
+    implements(IPushProducer)
+
     excess = ""
     packet = None
 
+    high_water = 128 * 1024
+    low_water = 32 * 1024
+    drain_interval = 0.1
+
+    paused = False
+    pause_count = 0
+
+    clock = reactor
+
+    _ping_loop = None
+
+    writes = 0
+    written = 0
+    _flush_call = None
+
     state = STATE_UNAUTHENTICATED
 
-    buf = ""
     parser = None
     handler = None
 
@@ -64,6 +107,11 @@ class BetaServerProtocol(Protocol):
     username = None
 
     def __init__(self):
+        self.decoder = PacketDecoder()
+
+        self.outbound = []
+        self.outbound_bytes = 0
+
         self.chunks = dict()
         self.windows = dict()
         self.wid = 1
@@ -94,7 +142,7 @@ class BetaServerProtocol(Protocol):
             255: self.quit,
         }
 
-        self._ping_loop = LoopingCall(self.update_ping)
+        self._drain_loop = LoopingCall(self.check_drain)
 
     # Low-level packet handlers
     # Try not to hook these if possible, since they offer no convenient
@@ -267,12 +315,27 @@ class BetaServerProtocol(Protocol):
     # Please don't override these needlessly, as they are pretty solid and
     # shouldn't need to be touched.
 
+    def connectionMade(self):
+        # Let the transport pause us once its buffer passes the high-water
+        # mark, in addition to our own checks.
+        self.transport.bufferSize = self.high_water
+        self.transport.registerProducer(self, True)
+
     def dataReceived(self, data):
-        self.buf += data
+        self.decoder.feed(data)
+
+        while True:
+            try:
+                packet = self.decoder.next_packet()
+            except ConstructError, e:
+                log.err("Couldn't parse packet: %s" % e)
+                self.error("Couldn't parse packet")
+                return
 
-        packets, self.buf = parse_packets(self.buf)
+            if packet is None:
+                break
 
-        for header, payload in packets:
+            header, payload = packet
             if header in self.handlers:
                 self.handlers[header](payload)
             else:
@@ -280,8 +343,49 @@ class BetaServerProtocol(Protocol):
                 log.err(payload)
 
     def connectionLost(self, reason):
-        if self._ping_loop.running:
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self.outbound = []
+        self.outbound_bytes = 0
+
+        if self._ping_loop is not None and self._ping_loop.running:
             self._ping_loop.stop()
+        if self._drain_loop.running:
+            self._drain_loop.stop()
+
+    # IPushProducer methods
+    # These are called by the transport when its buffer fills and empties.
+
+    def pauseProducing(self):
+        if self.paused:
+            return
+
+        self.paused = True
+        self.pause_count += 1
+
+        if not self._drain_loop.running:
+            self._drain_loop.start(self.drain_interval, now=False)
+
+        self.flow_paused()
+
+    def resumeProducing(self):
+        if not self.paused:
+            return
+
+        self.paused = False
+
+        if self._drain_loop.running:
+            self._drain_loop.stop()
+
+        self.flow_resumed()
+
+    def stopProducing(self):
+        """
+        Called when the transport is going away.
+
+        Cleanup happens in ``connectionLost()``.
+        """
 
     # State-change callbacks
     # Feel free to override these, but call them at some point.
@@ -300,7 +404,7 @@ class BetaServerProtocol(Protocol):
 
         self.state = STATE_AUTHENTICATED
 
-        self._ping_loop.start(5)
+        self.start_keepalive()
 
     # Event callbacks
     # These are meant to be overriden.
@@ -323,15 +427,118 @@ class BetaServerProtocol(Protocol):
 
         pass
 
+    def flow_paused(self):
+        """
+        Called when too much data is waiting to be sent to the client.
+
+        Bulk senders should stop sending until ``flow_resumed()`` is called.
+        """
+
+        pass
+
+    def flow_resumed(self):
+        """
+        Called when the data waiting to be sent has drained.
+        """
+
+        pass
+
     # Convenience methods
 
+    def check_flow(self):
+        """
+        Pause producing if the outbound buffer is past the high-water mark.
+        """
+
+        if not self.paused and self.buffered_bytes() > self.high_water:
+            self.pauseProducing()
+
+    def check_drain(self):
+        """
+        Resume producing if the outbound buffer is below the low-water mark.
+        """
+
+        if self.paused and self.buffered_bytes() <= self.low_water:
+            self.resumeProducing()
+
+    def start_keepalive(self):
+        """
+        Start sending keepalives to the client.
+        """
+
+        self._ping_loop = LoopingCall(self.update_ping)
+        self._ping_loop.start(5)
+
     def update_ping(self):
         """
         Send a keepalive to the client.
         """
 
         packet = make_packet("ping")
-        self.transport.write(packet)
+        self.write_now(packet)
+
+    def write(self, data):
+        """
+        Queue data to be sent to the client.
+
+        Everything queued during a reactor turn is handed to the transport
+        in a single write at the end of the turn.
+        """
+
+        self.outbound.append(data)
+        self.outbound_bytes += len(data)
+
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(0, self.flush)
+
+    def write_now(self, data):
+        """
+        Send data to the client immediately, along with anything already
+        queued.
+
+        This is for packets which shouldn't wait, like keepalives and kicks.
+        """
+
+        self.outbound.append(data)
+        self.outbound_bytes += len(data)
+        self.flush()
+
+    def flush(self):
+        """
+        Hand all queued data to the transport in a single write.
+        """
+
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+
+        if not self.outbound:
+            return
+
+        self.transport.writeSequence(self.outbound)
+        self.writes += 1
+        self.written += self.outbound_bytes
+
+        self.outbound = []
+        self.outbound_bytes = 0
+
+    def buffered_bytes(self):
+        """
+        Get the number of bytes queued or written to the transport which have
+        not yet been sent to the client.
+
+        :rtype: int
+        """
+
+        transport = self.transport
+        if transport is None:
+            return self.outbound_bytes
+
+        buffered = self.outbound_bytes
+        buffered += len(getattr(transport, "dataBuffer", ""))
+        buffered -= getattr(transport, "offset", 0)
+        buffered += getattr(transport, "_tempDataLen", 0)
+        return buffered
 
     def error(self, message):
         """
@@ -341,7 +548,7 @@ class BetaServerProtocol(Protocol):
         message, then closes the connection.
         """
 
-        self.transport.write(make_error_packet(message))
+        self.write_now(make_error_packet(message))
         self.transport.loseConnection()
 
 
@@ -366,14 +573,14 @@ class BetaProxyProtocol(BetaServerProtocol):
 
     def handshake(self, container):
         packet = make_packet("handshake", username="-")
-        self.transport.write(packet)
+        self.write(packet)
 
     def login(self, container):
         self.username = container.username
 
         packet = make_packet("login", protocol=0, username="", seed=0,
             dimension=0)
-        self.transport.write(packet)
+        self.write(packet)
 
         url = urlunparse(("http", self.gateway, "/node/0/0/", None, None,
             None))
@@ -420,17 +627,48 @@ class BravoProtocol(BetaServerProtocol):
 
     chunk_tasks = None
 
-    time_loop = None
-
     eid = 0
 
     last_dig = None
 
+    login_time = None
+
+    current_chunk = None
+    """
+    The coordinates of the chunk this player is in, as known to the factory's
+    player grid.
+    """
+
+    view_distance = 10
+    """
+    The radius, in chunks, of the area which is sent to this client.
+    """
+
+    disconnected = False
+    """
+    Whether the connection has been lost. Chunks which are still being
+    compressed are thrown away once this is set.
+    """
+
     def __init__(self, name):
         BetaServerProtocol.__init__(self)
 
+        # Chunks which have been requested, but not yet sent.
+        self.pending_chunks = set()
+
         self.config_name = "world %s" % name
 
+        self.view_distance = configuration.getintdefault(self.config_name,
+            "view_distance", self.view_distance)
+
+        # Players whose avatars are spawned in our client, and players which
+        # have our avatar spawned in their clients, respectively.
+        self.visible = set()
+        self.observers = set()
+
+        # Tracks what our client knows about the movement of other entities.
+        self.movement = MovementEncoder()
+
         log.msg("Registering client hooks...")
 
         # Retrieve the MOTD. Only needs to be done once.
@@ -468,56 +706,35 @@ class BravoProtocol(BetaServerProtocol):
             message="%s is joining the game..." % self.username)
         self.factory.broadcast(packet)
 
-        # Craft our avatar and send it to already-connected other players.
-        packet = self.player.save_to_packet()
-        packet += make_packet("create", eid=self.player.eid)
-        self.factory.broadcast_for_others(packet, self)
-
-        # And of course spawn all of those players' avatars in our client as
-        # well. Note that, at this point, we are not listed in the factory's
-        # list of protocols, so we won't accidentally send one of these to
-        # ourselves.
-        for protocol in self.factory.protocols.itervalues():
-            packet = protocol.player.save_to_packet()
-            packet += protocol.player.save_equipment_to_packet()
-            packet += make_packet("create", eid=protocol.player.eid)
-            self.transport.write(packet)
+        # Our avatar is not sent to anybody, nor are other avatars sent to
+        # us, until we have chunks loaded; the factory's player grid takes
+        # care of spawning avatars as players come into view of each other.
 
+        self.login_time = time()
         self.factory.protocols[self.username] = self
 
         # Send spawn and inventory.
         spawn = self.factory.world.spawn
         packet = make_packet("spawn", x=spawn[0], y=spawn[1], z=spawn[2])
         packet += self.player.inventory.save_to_packet()
-        self.transport.write(packet)
+        self.write(packet)
 
         self.send_initial_chunk_and_location()
 
-        self.time_loop = LoopingCall(self.update_time)
-        self.time_loop.start(10)
-
     def orientation_changed(self):
         # Bang your head!
-        packet = make_packet("entity-orientation",
-            eid=self.player.eid,
-            yaw=int(self.location.theta * 255 / (2 * pi)) % 256,
-            pitch=int(self.location.phi * 255 / (2 * pi)) % 256,
-        )
-        self.factory.broadcast_for_others(packet, self)
+        self.factory.mark_moved(self)
 
     def position_changed(self):
         x, chaff, z, chaff = split_coords(self.location.x, self.location.z)
 
-        # Inform everybody of our new location.
-        packet = make_packet("teleport",
-            eid=self.player.eid,
-            x=self.location.x * 32,
-            y=self.location.y * 32,
-            z=self.location.z * 32,
-            yaw=int(self.location.theta * 255 / (2 * pi)) % 256,
-            pitch=int(self.location.phi * 255 / (2 * pi)) % 256,
-        )
-        self.factory.broadcast_for_others(packet, self)
+        # Update our place in the player grid, so that players who can now
+        # see us have our avatar spawned.
+        self.factory.move_player(self, (x, z))
+
+        # Inform everybody who can see us of our new location, on the next
+        # tick.
+        self.factory.mark_moved(self)
 
         self.update_chunks()
 
@@ -534,10 +751,26 @@ class BravoProtocol(BetaServerProtocol):
                 self.factory.broadcast(packet)
 
                 packet = self.player.inventory.save_to_packet()
-                self.transport.write(packet)
+                self.write(packet)
 
                 self.factory.destroy_entity(entity)
 
+    def wire_location(self):
+        """
+        Get this player's location as it is sent to other clients.
+
+        :returns: tuple of fixed-point x, y, and z coordinates, and yaw and
+                  pitch bytes
+        """
+
+        return (
+            int(round(self.location.x * 32)),
+            int(round(self.location.y * 32)),
+            int(round(self.location.z * 32)),
+            int(self.location.theta * 255 / (2 * pi)) % 256,
+            int(self.location.phi * 255 / (2 * pi)) % 256,
+        )
+
     def entities_near(self, radius):
         """
         Obtain the entities within a radius of this player.
@@ -608,13 +841,7 @@ class BravoProtocol(BetaServerProtocol):
 
     def chat(self, container):
         if container.message.startswith("/"):
-            pp = {"factory": self.factory}
-
-            commands = retrieve_plugins(IChatCommand, parameters=pp)
-            # Register aliases.
-            for plugin in commands.values():
-                for alias in plugin.aliases:
-                    commands[alias] = plugin
+            commands = self.factory.chat_commands
 
             params = container.message[1:].split(" ")
             command = params.pop(0).lower()
@@ -622,20 +849,19 @@ class BravoProtocol(BetaServerProtocol):
             if command and command in commands:
                 def cb(iterable):
                     for line in iterable:
-                        self.transport.write(
+                        self.write(
                             make_packet("chat", message=line)
                         )
                 def eb(error):
-                    self.transport.write(
+                    self.write(
                         make_packet("chat", message="Error: %s" %
                                     error.getErrorMessage())
                     )
-                d = maybeDeferred(commands[command].chat_command,
-                                  self.username, params)
+                d = commands.dispatch(command, self.username, params)
                 d.addCallback(cb)
                 d.addErrback(eb)
             else:
-                self.transport.write(
+                self.write(
                     make_packet("chat",
                         message="Unknown command: %s" % command)
                 )
@@ -679,7 +905,7 @@ class BravoProtocol(BetaServerProtocol):
 
                     # Re-send inventory.
                     packet = self.player.inventory.save_to_packet()
-                    self.transport.write(packet)
+                    self.write(packet)
 
                     # If no items in this slot are left, this player isn't
                     # holding an item anymore.
@@ -690,7 +916,7 @@ class BravoProtocol(BetaServerProtocol):
                             primary=65535,
                             secondary=0
                         )
-                        self.factory.broadcast_for_others(packet, self)
+                        self.factory.broadcast_for_observers(packet, self)
             return
 
         bigx, smallx, bigz, smallz = split_coords(container.x, container.z)
@@ -770,7 +996,7 @@ class BravoProtocol(BetaServerProtocol):
             packet = make_packet("window-open", wid=self.wid, type="workbench",
                 title="Hurp", slots=2)
             self.wid += 1
-            self.transport.write(packet)
+            self.write(packet)
             return
 
         # Ignore clients that think -1 is placeable.
@@ -830,11 +1056,7 @@ class BravoProtocol(BetaServerProtocol):
         # Re-send inventory.
         # XXX this could be optimized if/when inventories track damage.
         packet = self.player.inventory.save_to_packet()
-        self.transport.write(packet)
-
-        # Flush damaged chunks.
-        for chunk in self.chunks.itervalues():
-            self.factory.flush_chunk(chunk)
+        self.write(packet)
 
     def run_build(self, builddata):
         block, metadata, x, y, z, face = builddata
@@ -898,7 +1120,7 @@ class BravoProtocol(BetaServerProtocol):
             primary=primary,
             secondary=secondary
         )
-        self.factory.broadcast_for_others(packet, self)
+        self.factory.broadcast_for_observers(packet, self)
 
     def pickup(self, container):
         self.factory.give((container.x, container.y, container.z),
@@ -911,7 +1133,7 @@ class BravoProtocol(BetaServerProtocol):
             eid=self.player.eid,
             animation=container.animation
         )
-        self.factory.broadcast_for_others(packet, self)
+        self.factory.broadcast_for_observers(packet, self)
 
     def wclose(self, container):
         if container.wid in self.windows:
@@ -949,7 +1171,7 @@ class BravoProtocol(BetaServerProtocol):
         if selected:
             # XXX should be if there's any damage to the inventory
             packet = i.save_to_packet()
-            self.transport.write(packet)
+            self.write(packet)
 
             # Inform other players about changes to this player's equipment.
             if container.wid == 0 and (container.slot in range(5, 9) or
@@ -975,11 +1197,11 @@ class BravoProtocol(BetaServerProtocol):
                     primary=primary,
                     secondary=secondary
                 )
-                self.factory.broadcast_for_others(packet, self)
+                self.factory.broadcast_for_observers(packet, self)
 
         packet = make_packet("window-token", wid=0, token=container.token,
             acknowledged=selected)
-        self.transport.write(packet)
+        self.write(packet)
 
     def sign(self, container):
         bigx, smallx, bigz, smallz = split_coords(container.x, container.z)
@@ -1017,14 +1239,19 @@ class BravoProtocol(BetaServerProtocol):
 
     def disable_chunk(self, x, z):
         # Remove the chunk from cache.
-        chunk = self.chunks.pop(x, z)
+        chunk = self.chunks.pop((x, z))
+        self.factory.unwatch_chunk(self, x, z)
 
         for entity in chunk.entities:
             packet = make_packet("destroy", eid=entity.eid)
-            self.transport.write(packet)
+            self.write(packet)
+
+        for protocol in self.factory.players_in_chunk(x, z):
+            if protocol in self.visible:
+                self.despawn_player(protocol)
 
         packet = make_packet("prechunk", x=x, z=z, enabled=0)
-        self.transport.write(packet)
+        self.write(packet)
 
     def enable_chunk(self, x, z):
         """
@@ -1040,28 +1267,101 @@ class BravoProtocol(BetaServerProtocol):
         if (x, z) in self.chunks:
             return succeed(None)
 
+        self.pending_chunks.add((x, z))
         d = self.factory.world.request_chunk(x, z)
         d.addCallback(self.send_chunk)
 
         return d
 
     def send_chunk(self, chunk):
+        """
+        Compress a chunk, off of the reactor, and then send it.
+
+        :returns: ``Deferred`` that will be fired once the chunk is sent
+        """
+
+        d = self.factory.world.compressor.compress(chunk.packet_data())
+        d.addCallback(self.send_compressed_chunk, chunk, chunk.modified)
+        return d
+
+    def send_compressed_chunk(self, data, chunk, modified):
+        """
+        Send a chunk which has been compressed.
+
+        :param str data: compressed data from ``packet_data()``
+        :param ``Chunk`` chunk: the chunk
+        :param int modified: the chunk's modification counter, as of when
+                             its data was taken
+        """
+
+        # The chunk might have gone out of view, or the client might have
+        # left, while it was being compressed.
+        if self.disconnected or (chunk.x, chunk.z) not in self.pending_chunks:
+            return
+
+        # Damage to the chunk in the meantime was only sent to its watchers,
+        # which don't include us yet, so the data is stale.
+        if chunk.modified != modified:
+            return self.send_chunk(chunk)
+
+        self.pending_chunks.discard((chunk.x, chunk.z))
+
         packet = make_packet("prechunk", x=chunk.x, z=chunk.z, enabled=1)
-        self.transport.write(packet)
+        self.write(packet)
 
-        packet = chunk.save_to_packet()
-        self.transport.write(packet)
+        packet = chunk.save_to_compressed_packet(data)
+        self.write(packet)
 
         for entity in chunk.entities:
             packet = entity.save_to_packet()
-            self.transport.write(packet)
+            self.write(packet)
 
         for entity in chunk.tiles.itervalues():
             if entity.name == "Sign":
                 packet = entity.save_to_packet()
-                self.transport.write(packet)
+                self.write(packet)
 
         self.chunks[chunk.x, chunk.z] = chunk
+        self.factory.watch_chunk(self, chunk.x, chunk.z)
+
+        for protocol in self.factory.players_in_chunk(chunk.x, chunk.z):
+            if protocol is not self and protocol not in self.visible:
+                self.spawn_player(protocol)
+
+        self.check_flow()
+
+    def spawn_player(self, protocol):
+        """
+        Spawn another player's avatar in our client.
+        """
+
+        eid = protocol.player.eid
+
+        packet = protocol.player.save_to_packet()
+        packet += protocol.player.save_equipment_to_packet()
+        packet += make_packet("create", eid=eid)
+
+        # Start movement tracking with an absolute position.
+        self.movement.forget(eid)
+        packet += self.movement.encode(eid, *protocol.wire_location())
+
+        self.write(packet)
+
+        self.visible.add(protocol)
+        protocol.observers.add(self)
+
+    def despawn_player(self, protocol):
+        """
+        Remove another player's avatar from our client.
+        """
+
+        packet = make_packet("destroy", eid=protocol.player.eid)
+        self.write(packet)
+
+        self.movement.forget(protocol.player.eid)
+
+        self.visible.discard(protocol)
+        protocol.observers.discard(self)
 
     def send_initial_chunk_and_location(self):
         bigx, smallx, bigz, smallz = split_coords(self.location.x,
@@ -1087,7 +1387,7 @@ class BravoProtocol(BetaServerProtocol):
         if self.motd:
             packet = make_packet("chat",
                 message=self.motd.replace("<tagline>", get_motd()))
-            d.addCallback(lambda none: self.transport.write(packet))
+            d.addCallback(lambda none: self.write(packet))
 
         # Finally, start the secondary chunk loop.
         d.addCallback(lambda none: self.update_chunks())
@@ -1102,16 +1402,39 @@ class BravoProtocol(BetaServerProtocol):
         self.location.y = height
 
         packet = self.location.save_to_packet()
-        self.transport.write(packet)
+        self.write(packet)
+
+    def set_view_distance(self, radius):
+        """
+        Change the radius of the area sent to this client.
+
+        Chunks are loaded or unloaded as needed, but not before the initial
+        chunks have been sent.
+
+        :param int radius: new view distance, in chunks
+        """
+
+        if radius == self.view_distance:
+            return
+
+        self.view_distance = radius
+
+        if self.chunk_tasks is not None:
+            self.update_chunks()
 
     def update_chunks(self):
         x, chaff, z, chaff = split_coords(self.location.x, self.location.z)
 
-        new = set((i + x, j + z) for i, j in circle)
+        new = set((i + x, j + z)
+            for i, j in points_in_circle(self.view_distance))
         old = set(self.chunks.iterkeys())
         added = new - old
         discarded = old - new
 
+        # Chunks which are on their way, but are no longer wanted, are
+        # dropped when they arrive.
+        self.pending_chunks &= new
+
         # Perhaps some explanation is in order.
         # The cooperate() function iterates over the iterable it is fed,
         # without tying up the reactor, by yielding after each iteration. The
@@ -1134,13 +1457,41 @@ class BravoProtocol(BetaServerProtocol):
             (self.disable_chunk(i, j) for i, j in discarded)
         ]
 
-    def update_time(self):
-        packet = make_packet("time", timestamp=int(self.factory.time))
-        self.transport.write(packet)
+        # Don't start streaming if the client is still catching up.
+        if self.paused:
+            self.flow_paused()
+
+    def flow_paused(self):
+        """
+        Stop streaming chunks until the client catches up.
+        """
+
+        for task in self.chunk_tasks or []:
+            try:
+                task.pause()
+            except TaskFinished:
+                pass
+
+    def flow_resumed(self):
+        """
+        Resume streaming chunks.
+        """
+
+        for task in self.chunk_tasks or []:
+            try:
+                task.resume()
+            except (TaskFinished, NotPaused):
+                pass
+
+    def start_keepalive(self):
+        # The factory sends keepalives to everybody at once.
+        pass
 
     def connectionLost(self, reason):
-        if self.time_loop:
-            self.time_loop.stop()
+        BetaServerProtocol.connectionLost(self, reason)
+
+        self.disconnected = True
+        self.pending_chunks.clear()
 
         if self.chunk_tasks:
             for task in self.chunk_tasks:
@@ -1149,11 +1500,13 @@ class BravoProtocol(BetaServerProtocol):
                 except (TaskDone, TaskFailed):
                     pass
 
+        for x, z in self.chunks:
+            self.factory.unwatch_chunk(self, x, z)
+
         if self.player:
             self.factory.world.save_player(self.username, self.player)
             self.factory.destroy_entity(self.player)
-            packet = make_packet("destroy", eid=self.player.eid)
-            self.factory.broadcast(packet)
+            self.factory.remove_player(self)
             self.factory.chat("%s has left the game." % self.username)
 
         if self.username in self.factory.protocols:
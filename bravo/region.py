@@ -0,0 +1,582 @@
+"""
+MCRegion file access.
+
+Region files hold 32x32 chunks in 4KiB pages. The first page is a header of
+chunk positions and page counts, the second page is reserved, and chunks are
+stored in the pages after those.
+"""
+
+from __future__ import division
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from mmap import mmap, ACCESS_READ
+import os
+from struct import Struct, pack_into, unpack_from
+from zlib import compressobj
+
+_header = Struct(">1024L")
+
+def region_coords(name):
+    """
+    Figure out a region's coordinates from the name of its file.
+
+    >>> region_coords("r.-1.2.mcr")
+    (-1, 2)
+    """
+
+    r, x, z, extension = name.split(".")
+    return int(x), int(z)
+
+def morton(x, z):
+    """
+    Get the position of a chunk along a Z-order curve through its region.
+
+    Chunks which are near each other in the region are mostly near each other
+    along the curve, too.
+    """
+
+    key = 0
+    for bit in range(5):
+        key |= ((x >> bit) & 1) << (2 * bit)
+        key |= ((z >> bit) & 1) << (2 * bit + 1)
+    return key
+
+def distance_from(rx, rz, x, z):
+    """
+    Make a key for ordering the chunks in a region by their distance from a
+    point, such as the spawn point.
+
+    :param int rx: region x coordinate
+    :param int rz: region z coordinate
+    :param int x: chunk x coordinate of the point
+    :param int z: chunk z coordinate of the point
+    """
+
+    def key(cx, cz):
+        dx = rx * 32 + cx - x
+        dz = rz * 32 + cz - z
+        return dx * dx + dz * dz, morton(cx, cz)
+
+    return key
+
+def read_header(page):
+    """
+    Read the chunk positions out of a region header.
+
+    :param str page: the first page of a region file
+    :returns: a dict of (position, page count) tuples, keyed by chunk
+              coordinates within the region
+    """
+
+    positions = {}
+
+    for i, entry in enumerate(_header.unpack_from(page)):
+        pages = entry & 0xff
+        position = entry >> 8
+        if position and pages:
+            positions[i % 32, i // 32] = position, pages
+
+    return positions
+
+def pack_header(positions):
+    """
+    Make a region header.
+
+    :param dict positions: (position, page count) tuples, keyed by chunk
+                           coordinates within the region
+    :returns: the first page of a region file
+    """
+
+    entries = [0] * 1024
+
+    for (x, z), (position, pages) in positions.iteritems():
+        entries[x + z * 32] = position << 8 | pages
+
+    return _header.pack(*entries)
+
+def compress_chunk(data, level=6):
+    """
+    Compress a chunk, ready to be written to a region.
+
+    The compressed data is streamed straight into a buffer which already has
+    room for the chunk's length and compression type in front, so that the
+    payload is never copied just to put them there.
+
+    :param data: uncompressed NBT data, such as from ``NBTFile.encode()``
+    :param int level: zlib compression level
+    :returns: a ``bytearray`` of the length, compression type and payload
+    """
+
+    compressor = compressobj(level)
+    chunk = bytearray(5)
+    chunk += compressor.compress(buffer(data))
+    chunk += compressor.flush()
+    pack_into(">LB", chunk, 0, len(chunk) - 4, 2)
+    return chunk
+
+class PageAllocator(object):
+    """
+    An allocator for the pages of a region file.
+
+    Free pages are kept as runs of adjacent pages. Freed runs are merged with
+    their neighbours, and allocations are made from the smallest run which
+    fits, so that large runs stay available for large chunks. Runs are
+    indexed by size, which makes finding the best fit logarithmic in the
+    number of runs.
+
+    Free pages at the end of the file are not kept as a run; instead, the end
+    of the allocated pages moves back, and allocations which don't fit in any
+    run are made there.
+    """
+
+    reserved = 2
+    """
+    The number of pages at the beginning of the file which are never
+    allocated.
+    """
+
+    def __init__(self):
+        self.end = self.reserved
+        self.free_pages = 0
+        self.runs = {}
+        self.run_ends = {}
+        self.by_size = []
+
+    @classmethod
+    def from_positions(cls, positions):
+        """
+        Make an allocator for a region, with every page which isn't used by a
+        chunk already free.
+
+        :param dict positions: (position, page count) tuples, as returned by
+                               ``read_header()``
+        """
+
+        allocator = cls()
+        cursor = allocator.reserved
+
+        for position, pages in sorted(positions.itervalues()):
+            if position > cursor:
+                allocator._add(cursor, position - cursor)
+            cursor = max(cursor, position + pages)
+
+        allocator.end = cursor
+        return allocator
+
+    def _add(self, start, length):
+        self.runs[start] = length
+        self.run_ends[start + length] = start
+        insort(self.by_size, (length, start))
+        self.free_pages += length
+
+    def _remove(self, start):
+        length = self.runs.pop(start)
+        del self.run_ends[start + length]
+        del self.by_size[bisect_left(self.by_size, (length, start))]
+        self.free_pages -= length
+        return length
+
+    def allocate(self, count):
+        """
+        Allocate a run of pages.
+
+        :returns: the first page of the run
+        """
+
+        i = bisect_left(self.by_size, (count, 0))
+        if i < len(self.by_size):
+            length, start = self.by_size[i]
+            self._remove(start)
+            if length > count:
+                self._add(start + count, length - count)
+            return start
+
+        start = self.end
+        self.end += count
+        return start
+
+    def free(self, start, count):
+        """
+        Free a run of pages.
+        """
+
+        end = start + count
+
+        if start in self.run_ends:
+            start = self.run_ends[start]
+            self._remove(start)
+        if end in self.runs:
+            end += self._remove(end)
+
+        if end >= self.end:
+            self.end = start
+        else:
+            self._add(start, end - start)
+
+    def fragmentation(self):
+        """
+        Get the fraction of the pages before the end which are free.
+
+        This is the fraction of the file which compacting would reclaim.
+        """
+
+        used = self.end - self.reserved
+        return self.free_pages / used if used else 0
+
+class RegionFile(object):
+    """
+    An open region file.
+
+    Reads are served from a read-only memory map of the file, so that chunks
+    can be sliced out of it without copying. Writes go through a regular file
+    handle, and the map is made again whenever a read reaches past its end
+    and the file has grown since it was mapped.
+
+    The file is opened for reading only, so that read-only worlds can still
+    be loaded, and is opened again for writing on the first write.
+    """
+
+    writable = False
+    """
+    Whether the file has been opened for writing.
+    """
+
+    def __init__(self, fp):
+        """
+        :param ``FilePath`` fp: the region file, which must exist
+        """
+
+        self.fp = fp
+        self.handle = fp.open("r")
+        self.size = os.fstat(self.handle.fileno()).st_size
+        self.map = None
+
+    def remap(self):
+        """
+        Map the entire file into memory.
+
+        Any previous map is closed, so slices of it must not be kept.
+        """
+
+        if self.map is not None:
+            self.map.close()
+
+        if self.size:
+            self.map = mmap(self.handle.fileno(), self.size,
+                access=ACCESS_READ)
+        else:
+            self.map = None
+
+    def read(self, offset, length):
+        """
+        Read from the file, without copying.
+
+        Reads past the end of the file are truncated.
+
+        :returns: a ``buffer`` into the map
+        """
+
+        if self.map is None or (offset + length > len(self.map) and
+            self.size > len(self.map)):
+            self.remap()
+            if self.map is None:
+                return buffer("")
+
+        return buffer(self.map, offset, length)
+
+    def write(self, offset, data):
+        """
+        Write to the file.
+        """
+
+        if not self.writable:
+            # Maps don't depend on the handle they were made from, so they
+            # can be kept.
+            self.handle.close()
+            self.handle = self.fp.open("r+")
+            self.writable = True
+
+        self.handle.seek(offset)
+        self.handle.write(data)
+        self.handle.flush()
+        self.size = max(self.size, offset + len(data))
+
+    def write_chunks(self, chunks):
+        """
+        Write several chunks, in order of their position in the file.
+
+        Chunks in adjacent pages are written together, in a single write.
+
+        :param list chunks: tuples of the first page of each chunk and its
+                            data
+        """
+
+        chunks = sorted(chunks)
+        i = 0
+
+        while i < len(chunks):
+            start, data = chunks[i]
+            run = [data]
+            end = start + (len(data) + 4095) // 4096
+            i += 1
+
+            while i < len(chunks) and chunks[i][0] == end:
+                # Pad the previous chunk out to the start of this one.
+                run.append("\x00" * (-len(run[-1]) % 4096))
+                data = chunks[i][1]
+                run.append(data)
+                end += (len(data) + 4095) // 4096
+                i += 1
+
+            if len(run) == 1:
+                self.write(start * 4096, data)
+            else:
+                self.write(start * 4096, bytearray().join(run))
+
+    def sync(self):
+        """
+        Force everything written so far onto the disk.
+        """
+
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.handle.close()
+
+class RegionPool(object):
+    """
+    A pool of open region files.
+
+    At most ``limit`` regions are kept open; when the pool is full, the least
+    recently used region is closed to make room.
+    """
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.regions = OrderedDict()
+
+        self.opened = 0
+        """
+        The number of times that a region file has been opened.
+        """
+
+    def __len__(self):
+        return len(self.regions)
+
+    def open(self, fp):
+        """
+        Get an open region file.
+
+        :param ``FilePath`` fp: the region file, which must exist
+        :returns: a ``RegionFile``
+        """
+
+        region = self.regions.pop(fp.path, None)
+
+        if region is None:
+            while len(self.regions) >= self.limit:
+                path, evicted = self.regions.popitem(last=False)
+                evicted.close()
+
+            region = RegionFile(fp)
+            self.opened += 1
+
+        self.regions[fp.path] = region
+        return region
+
+    def close(self, fp=None):
+        """
+        Close a region file, or all region files.
+        """
+
+        if fp is None:
+            for region in self.regions.itervalues():
+                region.close()
+            self.regions.clear()
+        else:
+            region = self.regions.pop(fp.path, None)
+            if region is not None:
+                region.close()
+
+class ReadAheadCache(object):
+    """
+    A small cache of compressed chunks, which were read before anybody asked
+    for them.
+
+    At most ``limit`` chunks are kept; when the cache is full, the chunk which
+    was read ahead the longest time ago is dropped to make room.
+    """
+
+    def __init__(self, limit=64):
+        self.limit = limit
+        self.chunks = OrderedDict()
+
+        self.hits = 0
+        """
+        The number of lookups which found their chunk.
+        """
+
+        self.misses = 0
+        """
+        The number of lookups which didn't find their chunk.
+        """
+
+        self.fetched = 0
+        """
+        The number of chunks which have been read ahead.
+        """
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __contains__(self, key):
+        return key in self.chunks
+
+    def add(self, key, data):
+        """
+        Cache a chunk.
+        """
+
+        if key in self.chunks:
+            return
+
+        while len(self.chunks) >= self.limit:
+            self.chunks.popitem(last=False)
+
+        self.chunks[key] = data
+        self.fetched += 1
+
+    def take(self, key):
+        """
+        Remove a chunk from the cache.
+
+        :returns: the chunk's data, or None if it wasn't cached
+        """
+
+        data = self.chunks.pop(key, None)
+
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return data
+
+    def discard(self, key):
+        """
+        Forget a chunk, if it is cached, without counting a lookup.
+        """
+
+        self.chunks.pop(key, None)
+
+    def hit_rate(self):
+        """
+        Get the fraction of lookups which found their chunk.
+        """
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+class RegionCompactor(object):
+    """
+    A rewrite of a region file, with its chunks packed together.
+
+    Chunks are copied, still compressed, into a new file next to the region,
+    in the order given by ``key``. The new file then atomically replaces the
+    region.
+    """
+
+    old_pages = 0
+    new_pages = 0
+
+    def __init__(self, fp, key=morton):
+        """
+        :param ``FilePath`` fp: the region file
+        :param callable key: a function of chunk coordinates within the
+                             region, giving the order of the chunks
+        """
+
+        self.fp = fp
+        self.temp = fp.siblingExtension(".compact")
+        self.key = key
+
+    def copy(self):
+        """
+        Copy chunks to the new file.
+
+        This is a generator which copies one chunk per iteration, so that
+        the work can be spread out.
+        """
+
+        source = RegionFile(self.fp)
+        out = self.temp.open("w")
+
+        try:
+            positions = read_header(source.read(0, 4096))
+            self.old_pages = (source.size + 4095) // 4096
+
+            # The header is written last. The second page is kept as it is.
+            out.write("\x00" * 4096)
+            out.write(str(source.read(4096, 4096)).ljust(4096, "\x00"))
+
+            entries = [0] * 1024
+            cursor = PageAllocator.reserved
+
+            order = sorted(positions, key=lambda coords: self.key(*coords))
+
+            for x, z in order:
+                position, pages = positions[x, z]
+                data = source.read(position * 4096, pages * 4096)
+                if len(data) < 5:
+                    continue
+
+                # Only copy the chunk's data, not the slack after it.
+                length = min(unpack_from(">L", data)[0] + 4, len(data))
+                needed = (length + 4095) // 4096
+                out.write(data[:length])
+                out.write("\x00" * (needed * 4096 - length))
+
+                entries[x + z * 32] = cursor << 8 | needed
+                cursor += needed
+                yield
+
+            out.seek(0)
+            out.write(_header.pack(*entries))
+            out.flush()
+            os.fsync(out.fileno())
+            self.new_pages = cursor
+        finally:
+            out.close()
+            source.close()
+
+    def commit(self):
+        """
+        Replace the region with the new file.
+        """
+
+        os.rename(self.temp.path, self.fp.path)
+
+    def abort(self):
+        """
+        Throw away the new file.
+        """
+
+        if self.temp.exists():
+            self.temp.remove()
+
+    def run(self):
+        """
+        Compact the region all at once.
+        """
+
+        try:
+            for step in self.copy():
+                pass
+        except:
+            self.abort()
+            raise
+        self.commit()
@@ -5,6 +5,7 @@ from twisted.trial import unittest
 
 import bravo.config
 import bravo.factories.beta
+from bravo.packets.movement import MovementEncoder
 
 class MockProtocol(object):
 
@@ -14,6 +15,66 @@ class MockProtocol(object):
         self.player = player
         self.location = player.location if player else None
 
+class MockTransport(object):
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+class MockPlayer(object):
+
+    def __init__(self, eid):
+        self.eid = eid
+
+class MockChunk(object):
+
+    def __init__(self, x, z):
+        self.x = x
+        self.z = z
+        self.damaged = True
+
+    def is_damaged(self):
+        return self.damaged
+
+    def get_damage_packet(self):
+        return "damage"
+
+    def clear_damage(self):
+        self.damaged = False
+
+class GridProtocol(object):
+    """
+    A protocol which tracks avatar spawns instead of sending packets.
+    """
+
+    current_chunk = None
+    disconnected = False
+
+    def __init__(self, chunks=(), eid=1):
+        self.chunks = dict((coords, None) for coords in chunks)
+        self.visible = set()
+        self.observers = set()
+        self.transport = MockTransport()
+        self.player = MockPlayer(eid)
+        self.movement = MovementEncoder()
+        self.location = (0, 0, 0, 0, 0)
+
+    def wire_location(self):
+        return self.location
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def spawn_player(self, protocol):
+        self.visible.add(protocol)
+        protocol.observers.add(self)
+
+    def despawn_player(self, protocol):
+        self.visible.discard(protocol)
+        protocol.observers.discard(self)
+
 class TestBravoFactory(unittest.TestCase):
 
     def setUp(self):
@@ -121,6 +182,192 @@ class TestBravoFactory(unittest.TestCase):
 
         self.assertFalse(self.f.set_username(p, "Hurp"))
 
+    def test_move_player(self):
+        p = GridProtocol()
+        self.f.move_player(p, (1, 2))
+
+        self.assertEqual(p.current_chunk, (1, 2))
+        self.assertEqual(self.f.players_in_chunk(1, 2), set([p]))
+        self.assertFalse(self.f.players_in_chunk(0, 0))
+
+        self.f.move_player(p, (0, 0))
+        self.assertFalse(self.f.players_in_chunk(1, 2))
+        self.assertEqual(self.f.players_in_chunk(0, 0), set([p]))
+
+    def test_move_player_into_view(self):
+        watcher = GridProtocol(chunks=[(0, 0), (0, 1)])
+        self.f.move_player(watcher, (0, 0))
+
+        mover = GridProtocol()
+        self.f.move_player(mover, (0, 1))
+
+        self.assertTrue(mover in watcher.visible)
+        self.assertEqual(mover.observers, set([watcher]))
+        self.assertFalse(watcher in mover.visible)
+
+    def test_move_player_out_of_view(self):
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.move_player(watcher, (0, 0))
+
+        mover = GridProtocol()
+        self.f.move_player(mover, (0, 0))
+        self.f.move_player(mover, (1000, 1000))
+
+        self.assertFalse(mover in watcher.visible)
+        self.assertFalse(mover.observers)
+
+    def test_broadcast_for_observers(self):
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.move_player(watcher, (0, 0))
+        stranger = GridProtocol(chunks=[(50, 50)])
+        self.f.move_player(stranger, (50, 50))
+
+        mover = GridProtocol()
+        self.f.move_player(mover, (0, 0))
+        self.f.broadcast_for_observers("packet", mover)
+
+        self.assertEqual(watcher.transport.written, ["packet"])
+        self.assertEqual(stranger.transport.written, [])
+        self.assertEqual(mover.transport.written, [])
+
+    def test_remove_player(self):
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.move_player(watcher, (0, 0))
+
+        mover = GridProtocol(chunks=[(0, 0)])
+        self.f.move_player(mover, (0, 0))
+        self.assertTrue(watcher in mover.observers)
+
+        self.f.remove_player(mover)
+
+        self.assertFalse(mover in watcher.visible)
+        self.assertFalse(watcher.observers)
+        self.assertEqual(self.f.players_in_chunk(0, 0), set([watcher]))
+
+    def test_watch_chunk(self):
+        protocol = GridProtocol()
+        self.f.watch_chunk(protocol, 1, 2)
+        self.assertEqual(self.f.watchers(1, 2), set([protocol]))
+        self.assertEqual(self.f.watchers(2, 1), set())
+
+    def test_watch_chunk_disconnected(self):
+        protocol = GridProtocol()
+        protocol.disconnected = True
+        self.f.watch_chunk(protocol, 1, 2)
+        self.assertFalse(self.f.chunk_watchers)
+
+    def test_unwatch_chunk(self):
+        protocol = GridProtocol()
+        self.f.watch_chunk(protocol, 1, 2)
+        self.f.unwatch_chunk(protocol, 1, 2)
+        self.assertEqual(self.f.watchers(1, 2), set())
+        self.assertFalse(self.f.chunk_watchers)
+
+    def test_unwatch_chunk_unwatched(self):
+        self.f.unwatch_chunk(GridProtocol(), 1, 2)
+
+    def test_broadcast_for_chunk(self):
+        watcher = GridProtocol()
+        self.f.watch_chunk(watcher, 0, 0)
+        stranger = GridProtocol()
+        self.f.watch_chunk(stranger, 1, 0)
+
+        self.f.broadcast_for_chunk("packet", 0, 0)
+
+        self.assertEqual(watcher.transport.written, ["packet"])
+        self.assertEqual(stranger.transport.written, [])
+
+    def test_broadcast_keepalive(self):
+        packets = []
+        protocol = GridProtocol()
+        protocol.write_now = packets.append
+        self.f.protocols["unittest"] = protocol
+
+        self.f.broadcast_keepalive()
+
+        self.assertEqual(packets, ["\x00"])
+
+    def test_tick_coalesces_movement(self):
+        watcher = GridProtocol(chunks=[(0, 0)], eid=1)
+        self.f.move_player(watcher, (0, 0))
+        mover = GridProtocol(eid=2)
+        self.f.move_player(mover, (0, 0))
+        watcher.transport.written = []
+
+        for i in range(5):
+            mover.location = (i, 0, 0, 0, 0)
+            self.f.mark_moved(mover)
+        self.f.tick()
+
+        self.assertEqual(len(watcher.transport.written), 1)
+        self.assertEqual(mover.transport.written, [])
+        self.assertEqual(watcher.movement.entities[2][0], 4)
+
+    def test_tick_idle(self):
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.move_player(watcher, (0, 0))
+
+        self.f.tick()
+
+        self.assertEqual(watcher.transport.written, [])
+        self.assertEqual(self.f.ticks, 1)
+
+    def test_tick_single_write(self):
+        """
+        Movement and damage are sent together in a single write.
+        """
+
+        watcher = GridProtocol(chunks=[(0, 0)], eid=1)
+        self.f.move_player(watcher, (0, 0))
+        self.f.watch_chunk(watcher, 0, 0)
+        mover = GridProtocol(eid=2)
+        self.f.move_player(mover, (0, 0))
+
+        self.f.mark_moved(mover)
+        self.f.flush_chunk(MockChunk(0, 0))
+        self.f.flush_chunk(MockChunk(1, 1))
+        self.f.tick()
+
+        self.assertEqual(len(watcher.transport.written), 1)
+        self.assertTrue(watcher.transport.written[0].endswith("damage"))
+
+    def test_tick_flushes_damage_once(self):
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.watch_chunk(watcher, 0, 0)
+        chunk = MockChunk(0, 0)
+
+        self.f.flush_chunk(chunk)
+        self.f.flush_chunk(chunk)
+        self.f.tick()
+        self.f.tick()
+
+        self.assertEqual(watcher.transport.written, ["damage"])
+        self.assertFalse(chunk.damaged)
+
+    def test_tick_flushes_world_damage(self):
+        """
+        Damage registered by chunks is sent without flushing each chunk.
+        """
+
+        watcher = GridProtocol(chunks=[(0, 0)])
+        self.f.watch_chunk(watcher, 0, 0)
+        chunk = MockChunk(0, 0)
+        self.f.world.damaged_chunks.add(chunk)
+
+        self.f.tick()
+
+        self.assertEqual(watcher.transport.written, ["damage"])
+        self.assertFalse(self.f.world.damaged_chunks)
+
+    def test_remove_player_forgets_movement(self):
+        mover = GridProtocol()
+        self.f.move_player(mover, (0, 0))
+        self.f.mark_moved(mover)
+
+        self.f.remove_player(mover)
+
+        self.assertFalse(self.f.moved)
+
 class TestBravoFactoryStarted(unittest.TestCase):
     """
     Tests which require ``startFactory()`` to be called.
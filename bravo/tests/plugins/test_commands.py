@@ -85,6 +85,30 @@ class TestGive(unittest.TestCase):
 
         self.assertFalse(called[0])
 
+class TestHelp(unittest.TestCase):
+
+    def setUp(self):
+        self.f = CommandsMockFactory()
+        self.f.chat_commands = bravo.plugin.CommandRegistry(
+            bravo.ibravo.IChatCommand, "chat_command",
+            parameters={"factory": self.f})
+
+        if "help" not in self.f.chat_commands:
+            raise unittest.SkipTest("Plugin not present")
+
+        self.hook = self.f.chat_commands["help"]
+
+    def test_general_help(self):
+        lines = self.hook.chat_command("unittest", [])
+        self.assertTrue("help" in " ".join(lines))
+
+    def test_specific_help_alias(self):
+        if "date" not in self.f.chat_commands:
+            raise unittest.SkipTest("Plugin not present")
+
+        lines = self.hook.chat_command("unittest", ["date"])
+        self.assertTrue(lines[0].startswith("Usage: time"))
+
 class TestTime(unittest.TestCase):
 
     def setUp(self):
@@ -1,12 +1,17 @@
-import unittest
+from twisted.trial import unittest
 import shutil
+from StringIO import StringIO
 import tempfile
 
+import numpy
+
+from twisted.internet.defer import DeferredList
 from twisted.python.filepath import FilePath
 
 import bravo.chunk
+import bravo.entity
 import bravo.plugins.serializers
-from bravo.nbt import TAG_Compound, TAG_List, TAG_String
+from bravo.nbt import NBTFile, TAG_Compound, TAG_List, TAG_String
 from bravo.nbt import TAG_Double, TAG_Byte, TAG_Short
 
 class TestAlphaUtilities(unittest.TestCase):
@@ -90,6 +95,61 @@ class TestAlphaSerializer(unittest.TestCase):
         self.assertEqual(tag["Level"]["xPos"].value, 1)
         self.assertEqual(tag["Level"]["zPos"].value, 2)
 
+    def test_load_chunk_from_data(self):
+        """
+        The fast chunk decoder agrees with the tag decoder.
+        """
+
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.blocks[:] = numpy.random.randint(0, 255, chunk.blocks.shape)
+        chunk.metadata[:] = numpy.random.randint(0, 15, chunk.metadata.shape)
+        chunk.skylight[:] = numpy.random.randint(0, 15, chunk.skylight.shape)
+        chunk.heightmap[:] = numpy.random.randint(0, 127,
+            chunk.heightmap.shape)
+        chunk.entities.add(bravo.entity.Pickup(item=(3, 0), quantity=5))
+        sign = bravo.entity.Sign(17, 64, 34)
+        sign.text1 = "Hello"
+        chunk.tiles[17, 64, 34] = sign
+
+        b = StringIO()
+        self.serializer._save_chunk_to_tag(chunk).write_file(buffer=b)
+        data = b.getvalue()
+
+        slow = bravo.chunk.Chunk(1, 2)
+        self.serializer._load_chunk_from_tag(slow,
+            NBTFile(buffer=StringIO(data)))
+        fast = bravo.chunk.Chunk(1, 2)
+        self.serializer._load_chunk_from_data(fast, data)
+
+        for name in ("blocks", "metadata", "skylight", "blocklight",
+            "heightmap"):
+            expected = getattr(chunk, name)
+            self.assertTrue((getattr(fast, name) == expected).all())
+            self.assertTrue((getattr(slow, name) == expected).all())
+            self.assertEqual(getattr(fast, name).shape,
+                getattr(slow, name).shape)
+        self.assertEqual(fast.populated, slow.populated)
+        self.assertEqual(fast.dirty, slow.dirty)
+
+        self.assertEqual(len(fast.entities), 1)
+        entity = list(fast.entities)[0]
+        self.assertEqual(entity.item, (3, 0))
+        self.assertEqual(fast.tiles.keys(), [(17, 64, 34)])
+        self.assertEqual(fast.tiles[17, 64, 34].text1, "Hello")
+
+    def test_load_chunk_from_data_writable(self):
+        b = StringIO()
+        self.serializer._save_chunk_to_tag(
+            bravo.chunk.Chunk(0, 0)).write_file(buffer=b)
+        chunk = bravo.chunk.Chunk(0, 0)
+        self.serializer._load_chunk_from_data(chunk, b.getvalue())
+
+        chunk.set_block((1, 2, 3), 4)
+        chunk.set_metadata((1, 2, 3), 5)
+        self.assertEqual(chunk.get_block((1, 2, 3)), 4)
+        self.assertEqual(chunk.get_metadata((1, 2, 3)), 5)
+        self.assertEqual(chunk.get_block((1, 2, 4)), 0)
+
     def test_save_data(self):
         data = 'Foo\nbar'
         self.serializer.save_plugin_data('plugin1', data)
@@ -101,3 +161,291 @@ class TestAlphaSerializer(unittest.TestCase):
         data = 'Foo\nbar'
         self.serializer.save_plugin_data('plugin1', data)
         self.assertEqual(self.serializer.load_plugin_data('plugin1'), data)
+
+class TestBetaSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.folder = FilePath(self.d)
+        self.serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+
+    def tearDown(self):
+        self.serializer.pool.close()
+        shutil.rmtree(self.d)
+
+    def test_trivial(self):
+        pass
+
+    def test_load_chunk_missing(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.blocks.any())
+
+    def test_round_trip(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.blocks[0, 0, :64] = 1
+        self.serializer.save_chunk(chunk)
+
+        serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+        loaded = bravo.chunk.Chunk(1, 2)
+        serializer.load_chunk(loaded)
+        serializer.pool.close()
+        self.assertTrue((loaded.blocks == chunk.blocks).all())
+
+    def test_region_opened_once(self):
+        for x in range(4):
+            self.serializer.save_chunk(bravo.chunk.Chunk(x, 0))
+        for x in range(4):
+            self.serializer.load_chunk(bravo.chunk.Chunk(x, 0))
+        self.assertEqual(self.serializer.pool.opened, 1)
+
+    def test_grow_chunk(self):
+        """
+        Chunks which outgrow their pages are moved without disturbing their
+        neighbours.
+        """
+
+        first = bravo.chunk.Chunk(0, 0)
+        second = bravo.chunk.Chunk(1, 0)
+        self.serializer.save_chunk(first)
+        self.serializer.save_chunk(second)
+
+        # Noise doesn't compress, so this needs many more pages.
+        first.blocks[:] = numpy.random.randint(0, 255, first.blocks.shape)
+        second.blocks[0, 0, 0] = 1
+        self.serializer.save_chunk(first)
+        self.serializer.save_chunk(second)
+
+        serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+        for chunk in first, second:
+            loaded = bravo.chunk.Chunk(chunk.x, chunk.z)
+            serializer.load_chunk(loaded)
+            self.assertTrue((loaded.blocks == chunk.blocks).all())
+        serializer.pool.close()
+
+    def fragment(self):
+        """
+        Save a row of chunks, then grow every other one, leaving holes.
+        """
+
+        chunks = [bravo.chunk.Chunk(x, 0) for x in range(6)]
+        for chunk in chunks:
+            self.serializer.save_chunk(chunk)
+        for chunk in chunks[::2]:
+            chunk.blocks[:] = numpy.random.randint(0, 255, chunk.blocks.shape)
+            self.serializer.save_chunk(chunk)
+        return chunks
+
+    def assertChunksEqual(self, chunks):
+        serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+        for chunk in chunks:
+            loaded = bravo.chunk.Chunk(chunk.x, chunk.z)
+            serializer.load_chunk(loaded)
+            self.assertTrue((loaded.blocks == chunk.blocks).all())
+        serializer.pool.close()
+
+    def test_compact_region(self):
+        chunks = self.fragment()
+        self.assertTrue(self.serializer.fragmentation("r.0.0.mcr") > 0)
+
+        for step in self.serializer.compact_region("r.0.0.mcr"):
+            pass
+
+        self.assertEqual(self.serializer.fragmentation("r.0.0.mcr"), 0)
+        self.assertChunksEqual(chunks)
+
+        # The serializer is still usable afterwards.
+        chunks[1].blocks[0, 0, 0] = 1
+        self.serializer.save_chunk(chunks[1])
+        self.assertChunksEqual(chunks)
+
+    def test_compact_region_changed(self):
+        """
+        Regions which are saved to during compaction are left alone.
+        """
+
+        chunks = self.fragment()
+        before = self.serializer.fragmentation("r.0.0.mcr")
+
+        steps = self.serializer.compact_region("r.0.0.mcr")
+        steps.next()
+        chunks[1].blocks[0, 0, 0] = 1
+        self.serializer.save_chunk(chunks[1])
+        for step in steps:
+            pass
+
+        self.assertEqual(self.serializer.fragmentation("r.0.0.mcr"), before)
+        self.assertFalse(self.folder.child("region").child(
+            "r.0.0.mcr.compact").exists())
+        self.assertChunksEqual(chunks)
+
+    def test_compact_region_overlapping(self):
+        """
+        A region can't be compacted twice at once.
+        """
+
+        chunks = self.fragment()
+
+        first = self.serializer.compact_region("r.0.0.mcr")
+        first.next()
+        self.assertEqual(list(self.serializer.compact_region("r.0.0.mcr")),
+            [])
+        self.assertTrue("r.0.0.mcr" in self.serializer.compacting)
+
+        for step in first:
+            pass
+
+        self.assertEqual(self.serializer.fragmentation("r.0.0.mcr"), 0)
+        self.assertChunksEqual(chunks)
+
+    def test_compact_regions_threshold(self):
+        self.fragment()
+        self.assertEqual(list(self.serializer.compact_regions(1)), [])
+        self.assertNotEqual(list(self.serializer.compact_regions(0)), [])
+
+    def test_save_chunks(self):
+        """
+        Chunks in several regions can be saved together.
+        """
+
+        chunks = [bravo.chunk.Chunk(x, z) for x, z in
+            ((0, 0), (1, 0), (31, 31), (32, 0), (-1, -1))]
+        for i, chunk in enumerate(chunks):
+            chunk.blocks[0, 0, :i + 1] = 1
+        self.serializer.save_chunks(chunks)
+
+        region = self.folder.child("region")
+        for name in "r.0.0.mcr", "r.1.0.mcr", "r.-1.-1.mcr":
+            self.assertTrue(region.child(name).exists())
+        self.assertChunksEqual(chunks)
+
+    def test_save_chunks_header_once(self):
+        """
+        Saving several chunks into a region writes its header only once.
+        """
+
+        chunks = [bravo.chunk.Chunk(x, 0) for x in range(4)]
+        self.serializer.save_chunks(chunks)
+
+        handle = self.serializer.pool.open(
+            self.folder.child("region").child("r.0.0.mcr"))
+        writes = []
+        write = handle.write
+        def record(offset, data):
+            writes.append(offset)
+            write(offset, data)
+        handle.write = record
+
+        for chunk in chunks:
+            chunk.blocks[0, 0, 0] = 1
+        self.serializer.save_chunks(chunks)
+
+        self.assertEqual(writes.count(0), 1)
+        self.assertChunksEqual(chunks)
+
+    def test_save_chunks_grow(self):
+        """
+        Chunks which outgrow their pages in a batch are moved, and their old
+        pages are reused.
+        """
+
+        chunks = self.fragment()
+        for chunk in chunks[1::2]:
+            chunk.blocks[:] = numpy.random.randint(0, 255, chunk.blocks.shape)
+        self.serializer.save_chunks(chunks)
+        self.assertChunksEqual(chunks)
+
+    def test_round_trip_threaded(self):
+        chunks = [bravo.chunk.Chunk(x, 0) for x in range(4)]
+        for chunk in chunks:
+            chunk.blocks[chunk.x, 0, :64] = 1
+
+        self.serializer.compressor.start()
+        self.addCleanup(self.serializer.compressor.stop)
+        self.serializer.save_chunks(chunks)
+
+        loaded = [bravo.chunk.Chunk(x, 0) for x in range(4)]
+        d = DeferredList([self.serializer.load_chunk(chunk)
+            for chunk in loaded], fireOnOneErrback=True)
+        @d.addCallback
+        def check(chaff):
+            for chunk, original in zip(loaded, chunks):
+                self.assertTrue((chunk.blocks == original.blocks).all())
+        return d
+
+    def test_load_threaded_copied(self):
+        """
+        Worker threads aren't given slices of the region's map, which saves
+        could rewrite underneath them.
+        """
+
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+
+        payloads = []
+        decompress = self.serializer.compressor.decompress
+        def record(data, gzip=False):
+            payloads.append(data)
+            return decompress(data, gzip)
+        self.serializer.compressor.decompress = record
+
+        self.serializer.compressor.start()
+        self.addCleanup(self.serializer.compressor.stop)
+        d = self.serializer.load_chunk(bravo.chunk.Chunk(0, 0))
+        self.assertTrue(isinstance(payloads[0], str))
+        return d
+
+    def test_read_ahead(self):
+        # Saved one at a time, these end up next to each other on disk.
+        for x, z in (0, 0), (1, 0), (0, 1), (1, 1):
+            chunk = bravo.chunk.Chunk(x, z)
+            chunk.blocks[x, z, :64] = 1
+            self.serializer.save_chunk(chunk)
+        self.serializer.readahead = 1
+
+        fp = self.folder.child("region").child("r.0.0.mcr")
+        handle = self.serializer.pool.open(fp)
+        reads = []
+        read = handle.read
+        def record(offset, length):
+            reads.append(offset)
+            return read(offset, length)
+        handle.read = record
+
+        loaded = bravo.chunk.Chunk(0, 0)
+        self.serializer.load_chunk(loaded)
+        # The chunk itself, then its three neighbours, all together.
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(len(self.serializer.readahead_cache), 3)
+
+        for x, z in (1, 0), (0, 1), (1, 1):
+            loaded = bravo.chunk.Chunk(x, z)
+            self.serializer.load_chunk(loaded)
+            self.assertTrue(loaded.blocks[x, z, 0])
+
+        cache = self.serializer.readahead_cache
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+
+    def test_read_ahead_off(self):
+        for x in range(3):
+            self.serializer.save_chunk(bravo.chunk.Chunk(x, 0))
+        self.serializer.load_chunk(bravo.chunk.Chunk(0, 0))
+        self.assertEqual(len(self.serializer.readahead_cache), 0)
+
+    def test_read_ahead_saved(self):
+        """
+        Chunks which are saved after being read ahead aren't loaded from the
+        cache.
+        """
+
+        chunks = [bravo.chunk.Chunk(x, 0) for x in range(2)]
+        self.serializer.save_chunks(chunks)
+        self.serializer.readahead = 1
+        self.serializer.load_chunk(bravo.chunk.Chunk(0, 0))
+
+        chunks[1].blocks[0, 0, 0] = 1
+        self.serializer.save_chunk(chunks[1])
+
+        loaded = bravo.chunk.Chunk(1, 0)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.blocks[0, 0, 0], 1)
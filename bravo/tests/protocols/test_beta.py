@@ -1,9 +1,48 @@
+from zlib import compress
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
 from twisted.trial import unittest
 
 from construct import Container
 
+from bravo.chunk import Chunk
+import bravo.packets.beta
+import bravo.packets.movement
 import bravo.protocols.beta
 
+class MockTransport(object):
+    """
+    A transport which never sends anything, and only buffers.
+    """
+
+    offset = 0
+    producer = None
+    sequences = 0
+
+    def __init__(self):
+        self.dataBuffer = ""
+
+    def write(self, data):
+        self.dataBuffer += data
+
+    def writeSequence(self, seq):
+        self.dataBuffer += "".join(seq)
+        self.sequences += 1
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+class MockTask(object):
+
+    paused = False
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
 class TestBetaServerProtocol(unittest.TestCase):
 
     def setUp(self):
@@ -34,6 +73,30 @@ class TestBetaServerProtocol(unittest.TestCase):
         self.assertEqual(self.p.location.pitch, 6)
         self.assertTrue(self.p.location.grounded)
 
+    def test_location_update_split(self):
+        """
+        Packets split across several reads are handled once they are
+        complete.
+        """
+
+        location_packet = """
+        DT/wAAAAAAAAQAAAAAAAAABACAAAAAAAAEAQAAAAAAAAQKAAAEDAAAAB
+        """.decode("base64")
+
+        for c in location_packet:
+            self.p.dataReceived(c)
+
+        self.assertEqual(self.p.location.x, 1)
+        self.assertEqual(self.p.location.z, 4)
+
+    def test_unparseable_packet(self):
+        errors = []
+        self.patch(self.p, "error", errors.append)
+
+        self.p.dataReceived("\xfe")
+
+        self.assertEqual(len(errors), 1)
+
     def test_reject_ancient_and_newfangled_clients(self):
         """
         Directly test the login() method for client protocol checking.
@@ -57,3 +120,247 @@ class TestBetaServerProtocol(unittest.TestCase):
         self.p.login(container)
 
         self.assertTrue(error_called[0])
+
+class TestBetaServerProtocolOutbound(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.protocols.beta.BetaServerProtocol()
+        self.p.clock = Clock()
+        self.p.transport = MockTransport()
+
+    def test_write_queued(self):
+        self.p.write("abc")
+        self.assertEqual(self.p.transport.dataBuffer, "")
+        self.assertEqual(self.p.buffered_bytes(), 3)
+
+    def test_write_coalesced(self):
+        self.p.write("abc")
+        self.p.write("def")
+        self.p.clock.advance(0)
+
+        self.assertEqual(self.p.transport.dataBuffer, "abcdef")
+        self.assertEqual(self.p.transport.sequences, 1)
+        self.assertEqual(self.p.writes, 1)
+        self.assertEqual(self.p.written, 6)
+
+    def test_write_now(self):
+        self.p.write("abc")
+        self.p.write_now("def")
+
+        self.assertEqual(self.p.transport.dataBuffer, "abcdef")
+        self.assertEqual(self.p.transport.sequences, 1)
+        self.assertFalse(self.p.clock.getDelayedCalls())
+
+    def test_flush_empty(self):
+        self.p.flush()
+        self.assertEqual(self.p.transport.sequences, 0)
+
+    def test_connection_lost(self):
+        self.p.write("abc")
+        self.p.connectionLost(None)
+
+        self.assertFalse(self.p.clock.getDelayedCalls())
+        self.assertEqual(self.p.buffered_bytes(), 0)
+
+class TestBetaServerProtocolFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.protocols.beta.BetaServerProtocol()
+        self.p._drain_loop.clock = Clock()
+        self.p.transport = MockTransport()
+        self.p.connectionMade()
+
+    def test_registered(self):
+        self.assertTrue(self.p.transport.producer is self.p)
+        self.assertEqual(self.p.transport.bufferSize, self.p.high_water)
+
+    def test_buffered_bytes(self):
+        self.p.transport.write("\x00" * 10)
+        self.assertEqual(self.p.buffered_bytes(), 10)
+
+    def test_high_water(self):
+        self.p.transport.write("\x00" * self.p.high_water)
+        self.p.check_flow()
+        self.assertFalse(self.p.paused)
+
+        self.p.transport.write("\x00")
+        self.p.check_flow()
+        self.assertTrue(self.p.paused)
+        self.assertEqual(self.p.pause_count, 1)
+
+    def test_low_water(self):
+        self.p.transport.write("\x00" * (self.p.high_water + 1))
+        self.p.pauseProducing()
+
+        # Drain down to just above the low-water mark.
+        self.p.transport.offset = self.p.high_water - self.p.low_water
+        self.p._drain_loop.clock.advance(self.p.drain_interval)
+        self.assertTrue(self.p.paused)
+
+        self.p.transport.offset += 1
+        self.p._drain_loop.clock.advance(self.p.drain_interval)
+        self.assertFalse(self.p.paused)
+        self.assertFalse(self.p._drain_loop.running)
+
+    def test_pause_idempotent(self):
+        self.p.pauseProducing()
+        self.p.pauseProducing()
+        self.assertEqual(self.p.pause_count, 1)
+
+        self.p.resumeProducing()
+        self.assertFalse(self.p.paused)
+
+class TestBravoProtocolFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.protocols.beta.BravoProtocol("unittest")
+        self.p._drain_loop.clock = Clock()
+        self.p.chunk_tasks = [MockTask(), MockTask()]
+
+    def test_pause_chunk_tasks(self):
+        self.p.pauseProducing()
+        self.assertTrue(all(task.paused for task in self.p.chunk_tasks))
+
+        self.p.resumeProducing()
+        self.assertFalse(any(task.paused for task in self.p.chunk_tasks))
+
+class TestBravoProtocolMovement(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.protocols.beta.BravoProtocol("unittest")
+
+    def test_wire_location_quantised(self):
+        self.p.location.x = 0.9
+        self.p.location.y = 64.01
+        self.p.location.z = -0.02
+        self.assertEqual(self.p.wire_location()[:3], (29, 2048, -1))
+
+    def test_small_steps(self):
+        """
+        Steps smaller than a fixed-point unit aren't sent, and don't make
+        the client's idea of the position drift.
+        """
+
+        encoder = bravo.packets.movement.MovementEncoder()
+        self.p.location.x = 0
+        encoder.encode(1, *self.p.wire_location())
+
+        sent = []
+        for i in range(1, 20):
+            self.p.location.x = i * 0.9 / 32
+            packet = encoder.encode(1, *self.p.wire_location())
+            if packet:
+                header, payload = bravo.packets.beta.parse_packets(
+                    packet)[0][0]
+                sent.append(payload.x)
+
+        self.assertTrue(all(sent))
+        self.assertEqual(sum(sent), self.p.wire_location()[0])
+
+class MockFactory(object):
+
+    def __init__(self):
+        self.protocols = {}
+        self.watched = []
+
+    def watch_chunk(self, protocol, x, z):
+        self.watched.append((x, z))
+
+    def unwatch_chunk(self, protocol, x, z):
+        self.watched.remove((x, z))
+
+    def players_in_chunk(self, x, z):
+        return []
+
+class MockCompressor(object):
+    """
+    A compressor which doesn't finish until it's told to.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def compress(self, data):
+        d = Deferred()
+        self.pending.append((data, d))
+        return d
+
+    def finish(self):
+        data, d = self.pending.pop(0)
+        d.callback(compress(data))
+
+class TestBravoProtocolChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.protocols.beta.BravoProtocol("unittest")
+        self.p.clock = Clock()
+        self.p.transport = MockTransport()
+        self.p.factory = MockFactory()
+        self.p.factory.world = Container(compressor=MockCompressor())
+        self.chunk = Chunk(1, 2)
+        self.data = compress(self.chunk.packet_data())
+
+    def test_send_compressed_chunk(self):
+        self.p.pending_chunks.add((1, 2))
+        self.p.send_compressed_chunk(self.data, self.chunk, 0)
+
+        self.assertTrue((1, 2) in self.p.chunks)
+        self.assertEqual(self.p.factory.watched, [(1, 2)])
+        self.assertFalse(self.p.pending_chunks)
+        self.assertTrue(self.p.buffered_bytes())
+
+    def test_send_compressed_chunk_unwanted(self):
+        self.p.send_compressed_chunk(self.data, self.chunk, 0)
+
+        self.assertFalse(self.p.chunks)
+        self.assertFalse(self.p.factory.watched)
+        self.assertEqual(self.p.buffered_bytes(), 0)
+
+    def test_send_compressed_chunk_disconnected(self):
+        self.p.pending_chunks.add((1, 2))
+        self.p.connectionLost(None)
+        self.p.send_compressed_chunk(self.data, self.chunk, 0)
+
+        self.assertFalse(self.p.chunks)
+        self.assertFalse(self.p.factory.watched)
+        self.assertEqual(self.p.buffered_bytes(), 0)
+
+    def test_send_chunk_damaged(self):
+        """
+        Chunks which are damaged while they are being compressed are sent
+        again, so that the client doesn't miss the damage.
+        """
+
+        compressor = self.p.factory.world.compressor
+        self.p.pending_chunks.add((1, 2))
+        self.p.send_chunk(self.chunk)
+
+        self.chunk.populated = True
+        self.chunk.set_block((1, 1, 1), 1)
+        compressor.finish()
+
+        self.assertFalse(self.p.chunks)
+        self.assertEqual(self.p.buffered_bytes(), 0)
+        self.assertEqual(compressor.pending[0][0], self.chunk.packet_data())
+
+        compressor.finish()
+        self.assertTrue((1, 2) in self.p.chunks)
+        self.assertTrue(compress(self.chunk.packet_data()) in
+            "".join(self.p.outbound))
+
+class TestPointsInCircle(unittest.TestCase):
+
+    def test_circle(self):
+        """
+        The default circle should be the same as the Notchian view distance.
+        """
+
+        self.assertEqual(bravo.protocols.beta.points_in_circle(10),
+            bravo.protocols.beta.circle)
+        self.assertTrue((9, 0) in bravo.protocols.beta.circle)
+        self.assertTrue((9, 9) not in bravo.protocols.beta.circle)
+
+    def test_cached(self):
+        first = bravo.protocols.beta.points_in_circle(4)
+        second = bravo.protocols.beta.points_in_circle(4)
+        self.assertTrue(first is second)
@@ -1,5 +1,6 @@
 from twisted.trial import unittest
 import warnings
+from zlib import compress
 
 from numpy import empty
 from numpy.testing import assert_array_equal
@@ -72,6 +73,21 @@ class TestChunkBlocks(unittest.TestCase):
         self.c.destroy((0, 30, 0))
         self.assertEqual(self.c.heightmap[0, 0], 20)
 
+class TestChunkPackets(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(1, 2)
+        self.c.set_block((1, 2, 3), 4)
+
+    def test_save_to_compressed_packet(self):
+        """
+        Packets made from compressed data match the usual packets.
+        """
+
+        data = compress(self.c.packet_data())
+        self.assertEqual(self.c.save_to_compressed_packet(data),
+            self.c.save_to_packet())
+
 class TestNumpyQuirks(unittest.TestCase):
     """
     Tests for the bad interaction between several components of Bravo.
@@ -110,6 +126,52 @@ class TestNumpyQuirks(unittest.TestCase):
         # ...And reset the warning filters.
         warnings.resetwarnings()
 
+class TestDamageTracking(unittest.TestCase):
+
+    def setUp(self):
+        self.damaged = set()
+        self.c = bravo.chunk.Chunk(0, 0)
+        self.c.populated = True
+        self.c.damaged_chunks = self.damaged
+
+    def test_trivial(self):
+        pass
+
+    def test_untracked(self):
+        c = bravo.chunk.Chunk(0, 0)
+        c.populated = True
+        c.set_block((0, 0, 0), 1)
+        self.assertTrue(c.is_damaged())
+
+    def test_damage_registers(self):
+        self.assertFalse(self.damaged)
+        self.c.set_block((0, 0, 0), 1)
+        self.assertEqual(self.damaged, set([self.c]))
+
+    def test_clear_damage_unregisters(self):
+        self.c.set_block((0, 0, 0), 1)
+        self.c.clear_damage()
+        self.assertFalse(self.damaged)
+
+    def test_sed_registers(self):
+        self.c.sed(0, 1)
+        self.assertEqual(self.damaged, set([self.c]))
+
+    def test_modified(self):
+        self.c.set_block((0, 0, 0), 1)
+        self.assertEqual(self.c.modified, 1)
+        self.c.sed(0, 2)
+        self.assertEqual(self.c.modified, 2)
+
+    def test_modified_all_damaged(self):
+        """
+        Damage is counted even once the whole chunk is damaged.
+        """
+
+        self.c.all_damaged = True
+        self.c.set_block((0, 0, 0), 1)
+        self.assertEqual(self.c.modified, 1)
+
 class TestLightmaps(unittest.TestCase):
 
     def setUp(self):
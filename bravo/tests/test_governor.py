@@ -0,0 +1,122 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+import bravo.config
+from bravo.governor import LoadGovernor
+
+class MockWorld(object):
+
+    backlog = 0
+
+    def generation_backlog(self):
+        return self.backlog
+
+class MockFactory(object):
+
+    config_name = "world unittest"
+
+    def __init__(self):
+        self.world = MockWorld()
+        self.protocols = {}
+
+class MockProtocol(object):
+
+    def __init__(self, login_time, buffered=0, view_distance=10):
+        self.login_time = login_time
+        self.buffered = buffered
+        self.view_distance = view_distance
+
+    def buffered_bytes(self):
+        return self.buffered
+
+    def set_view_distance(self, radius):
+        self.view_distance = radius
+
+class TestLoadGovernor(unittest.TestCase):
+
+    def setUp(self):
+        bravo.config.configuration.add_section("world unittest")
+        bravo.config.configuration.set("world unittest", "view_distance",
+            "10")
+        bravo.config.configuration.set("world unittest",
+            "min_view_distance", "4")
+
+        self.clock = Clock()
+        self.factory = MockFactory()
+        self.governor = LoadGovernor(self.factory, clock=self.clock)
+
+    def tearDown(self):
+        bravo.config.configuration.remove_section("world unittest")
+
+    def test_trivial(self):
+        pass
+
+    def test_bounds(self):
+        self.assertEqual(self.governor.minimum, 4)
+        self.assertEqual(self.governor.maximum, 10)
+
+    def test_measure_lag(self):
+        self.governor.start()
+        self.clock.advance(1.5)
+        self.assertAlmostEqual(self.governor.lag, 0.5)
+
+    def test_shrink_newest_first(self):
+        old = MockProtocol(1)
+        new = MockProtocol(2)
+        self.factory.protocols = {"old": old, "new": new}
+        self.factory.world.backlog = 100
+
+        self.governor.step()
+
+        self.assertEqual(new.view_distance, 9)
+        self.assertEqual(old.view_distance, 10)
+
+    def test_shrink_backlogged_first(self):
+        backlogged = MockProtocol(1, buffered=4096)
+        new = MockProtocol(2)
+        self.factory.protocols = {"backlogged": backlogged, "new": new}
+        self.factory.world.backlog = 100
+
+        self.governor.step()
+
+        self.assertEqual(backlogged.view_distance, 9)
+        self.assertEqual(new.view_distance, 10)
+
+    def test_shrink_minimum(self):
+        protocol = MockProtocol(1, view_distance=4)
+        self.factory.protocols = {"protocol": protocol}
+        self.factory.world.backlog = 100
+
+        self.governor.step()
+
+        self.assertEqual(protocol.view_distance, 4)
+
+    def test_shrink_overbuffered_idle(self):
+        """
+        Clients which can't keep up are shrunk even when the server is idle.
+        """
+
+        protocol = MockProtocol(1, buffered=1024 * 1024)
+        self.factory.protocols = {"protocol": protocol}
+
+        self.governor.step()
+
+        self.assertEqual(protocol.view_distance, 9)
+
+    def test_grow_oldest_first(self):
+        old = MockProtocol(1, view_distance=5)
+        new = MockProtocol(2, view_distance=5)
+        self.factory.protocols = {"old": old, "new": new}
+
+        self.governor.step()
+
+        self.assertEqual(old.view_distance, 6)
+        self.assertEqual(new.view_distance, 5)
+
+    def test_grow_maximum(self):
+        protocol = MockProtocol(1)
+        self.factory.protocols = {"protocol": protocol}
+
+        self.governor.step()
+
+        self.assertEqual(protocol.view_distance, 10)
@@ -2,7 +2,8 @@ from twisted.trial import unittest
 
 import bravo.blocks
 
-from bravo.inventory import Equipment, Inventory, Slot, Workbench
+from bravo.inventory import (Equipment, Inventory, RecipeIndex, Slot,
+    Workbench, crop)
 
 class TestSlot(unittest.TestCase):
     """
@@ -27,6 +28,98 @@ class TestSlot(unittest.TestCase):
         slot2 = Slot(4, 6, 1)
         self.assertFalse(slot1.holds(slot2))
 
+class TestCrop(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(crop([None] * 9, 3), None)
+
+    def test_single(self):
+        self.assertEqual(crop([None, None, None, None, 1, None, None, None,
+            None], 3), (4, 1, [1]))
+
+    def test_column(self):
+        self.assertEqual(crop([None, None, 1, None, None, 2, None, None,
+            None], 3), (2, 1, [1, 2]))
+
+    def test_corners(self):
+        """
+        Empty cells inside the bounding box are kept.
+        """
+
+        self.assertEqual(crop([1, None, None, None, None, 2], 3),
+            (0, 3, [1, None, None, None, None, 2]))
+
+class RecipeMock(object):
+
+    def __init__(self, name, dimensions, recipe):
+        self.name = name
+        self.dimensions = dimensions
+        self.recipe = recipe
+
+class TestRecipeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.recipes = {
+            "stick": RecipeMock("stick", (1, 2), (((5, 0), 1), ((5, 0), 1))),
+            "many": RecipeMock("many", (1, 2), (((5, 0), 4), ((5, 0), 4))),
+            "hollow": RecipeMock("hollow", (2, 2),
+                (((4, 0), 1), None, None, ((4, 0), 1))),
+        }
+        self.index = RecipeIndex(self.recipes)
+
+    def test_len(self):
+        self.assertEqual(len(self.index), 3)
+
+    def test_empty(self):
+        self.assertEqual(self.index.match([None] * 9, 3), None)
+
+    def test_translation(self):
+        for offset in (0, 1, 2, 3, 4, 5):
+            crafting = [None] * 9
+            crafting[offset] = Slot(5, 0, 1)
+            crafting[offset + 3] = Slot(5, 0, 1)
+            self.assertEqual(self.index.match(crafting, 3),
+                (self.recipes["stick"], offset))
+
+    def test_no_wrap(self):
+        """
+        Shapes don't wrap around the edge of the crafting table.
+        """
+
+        crafting = [None] * 9
+        crafting[2] = Slot(4, 0, 1)
+        crafting[4] = Slot(4, 0, 1)
+        self.assertEqual(self.index.match(crafting, 3), None)
+
+    def test_hollow(self):
+        crafting = [None] * 9
+        crafting[4] = Slot(4, 0, 1)
+        crafting[8] = Slot(4, 0, 1)
+        self.assertEqual(self.index.match(crafting, 3),
+            (self.recipes["hollow"], 4))
+
+    def test_stray_slot(self):
+        crafting = [None] * 9
+        crafting[0] = Slot(5, 0, 1)
+        crafting[3] = Slot(5, 0, 1)
+        crafting[8] = Slot(1, 0, 1)
+        self.assertEqual(self.index.match(crafting, 3), None)
+
+    def test_quantity(self):
+        """
+        Recipes sharing a shape are told apart by quantity, in order of name.
+        """
+
+        crafting = [None] * 4
+        crafting[0] = Slot(5, 0, 4)
+        crafting[2] = Slot(5, 0, 4)
+        self.assertEqual(self.index.match(crafting, 2),
+            (self.recipes["many"], 0))
+
+        crafting[2] = Slot(5, 0, 3)
+        self.assertEqual(self.index.match(crafting, 2),
+            (self.recipes["stick"], 0))
+
 class TestInventoryInternals(unittest.TestCase):
     """
     The Inventory class might be near-useless when not subclassed, but we can
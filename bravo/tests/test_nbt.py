@@ -4,7 +4,10 @@ import tempfile
 import unittest
 
 from bravo.nbt import NBTFile, MalformedFileError
-from bravo.nbt import TAG_Compound
+from bravo.nbt import TAG, TAG_Compound, TAG_List, TAG_Int, TAG_String
+from bravo.nbt import TAG_Byte_Array, TAG_Long
+from bravo.nbt import TAG_COMPOUND, TAG_LIST
+from bravo.nbt import read_tag, scan_compound, scan_root, skip_tag
 
 bigtest = """
 H4sIAAAAAAAAAO1Uz08aQRR+wgLLloKxxBBjzKu1hKXbzUIRibGIFiyaDRrYqDGGuCvDgi67Znew
@@ -61,6 +64,45 @@ class ReadWriteTest(unittest.TestCase):
         mynbt = NBTFile(self.f.name)
         mynbt.write_file()
 
+class TestEncode(unittest.TestCase):
+
+    def setUp(self):
+        self.f = tempfile.NamedTemporaryFile()
+        self.f.write(bigtest)
+        self.f.flush()
+        self.data = GzipFile(self.f.name).read()
+
+    def test_encode(self):
+        encoded = NBTFile(self.f.name).encode()
+        self.assertTrue(isinstance(encoded, bytearray))
+        self.assertEqual(str(encoded), self.data)
+
+    def test_encode_lazy(self):
+        tag = NBTFile(self.f.name, lazy=True)
+        tag["intTest"]
+        self.assertEqual(str(tag.encode()), self.data)
+
+    def test_encode_built(self):
+        tag = NBTFile()
+        tag.name = u"\u2603"
+        tag["bytes"] = TAG_Byte_Array()
+        tag["bytes"].value = "\x00\x01\x02"
+        tag["longs"] = TAG_List(type=TAG_Long)
+        tag["longs"].tags.extend(TAG_Long(i) for i in range(3))
+        tag["nested"] = TAG_Compound()
+        tag["nested"]["s"] = TAG_String(u"\u2603")
+        tag["empty"] = TAG_List(type=TAG_Compound)
+
+        b = StringIO()
+        tag.write_file(buffer=b)
+        self.assertEqual(str(tag.encode()), b.getvalue())
+
+    def test_encode_list_mismatch(self):
+        tag = NBTFile()
+        tag["list"] = TAG_List(type=TAG_Int)
+        tag["list"].tags.append(TAG_String(u"wrong"))
+        self.assertRaises(ValueError, tag.encode)
+
 class TreeManipulationTest(unittest.TestCase):
 
     def setUp(self):
@@ -97,5 +139,209 @@ class TestTAGCompound(unittest.TestCase):
         self.tag["test"] = TAG_Compound()
         self.assertTrue("test" in self.tag)
 
+    def test_contains_missing(self):
+        self.assertFalse("test" in self.tag)
+
+    def test_setitem_replaces(self):
+        self.tag["a"] = TAG_Int(1)
+        self.tag["b"] = TAG_Int(2)
+        self.tag["a"] = TAG_Int(3)
+        self.assertEqual(self.tag.keys(), ["a", "b"])
+        self.assertEqual(self.tag["a"].value, 3)
+
+    def test_setitem_index(self):
+        self.tag["a"] = TAG_Int(1)
+        replacement = TAG_Int(2)
+        replacement.name = "b"
+        self.tag[0] = replacement
+        self.assertFalse("a" in self.tag)
+        self.assertEqual(self.tag["b"].value, 2)
+
+    def test_delitem(self):
+        for name in "abc":
+            self.tag[name] = TAG_Int(ord(name))
+        del self.tag["b"]
+        self.assertEqual(self.tag.keys(), ["a", "c"])
+        self.assertFalse("b" in self.tag)
+        self.assertEqual(self.tag["c"].value, ord("c"))
+
+    def test_delitem_index(self):
+        for name in "abc":
+            self.tag[name] = TAG_Int(ord(name))
+        del self.tag[0]
+        self.assertEqual(self.tag.keys(), ["b", "c"])
+        self.assertEqual(self.tag["b"].value, ord("b"))
+
+    def test_delitem_missing(self):
+        self.assertRaises(KeyError, self.tag.__delitem__, "a")
+
+    def test_getitem_unicode(self):
+        self.tag["a"] = TAG_Int(1)
+        self.assertEqual(self.tag[u"a"].value, 1)
+
+    def test_tags_assignment(self):
+        first = TAG_Int(1)
+        first.name = "a"
+        second = TAG_Int(2)
+        second.name = "b"
+        self.tag.tags = [first, second]
+        self.assertTrue(self.tag["b"] is second)
+
+    def test_duplicate_names(self):
+        """
+        When names are repeated, the first tag is found.
+        """
+
+        first = TAG_Int(1)
+        first.name = "a"
+        second = TAG_Int(2)
+        second.name = "a"
+        self.tag.tags = [first, second]
+        self.assertTrue(self.tag["a"] is first)
+
+    def test_parsed_index(self):
+        b = StringIO()
+        for name in "abc":
+            self.tag[name] = TAG_Int(ord(name))
+        self.tag._render_buffer(b)
+        b.seek(0)
+        parsed = TAG_Compound(buffer=b)
+        self.assertEqual(parsed["c"].value, ord("c"))
+        self.assertEqual(len(parsed), 3)
+
+class TestLazy(unittest.TestCase):
+
+    def setUp(self):
+        self.f = tempfile.NamedTemporaryFile()
+        self.f.write(bigtest)
+        self.f.flush()
+        self.data = GzipFile(self.f.name).read()
+        self.tag = NBTFile(self.f.name, lazy=True)
+
+    def write(self, tag):
+        b = StringIO()
+        tag.write_file(buffer=b)
+        return b.getvalue()
+
+    def test_keys(self):
+        eager = NBTFile(self.f.name)
+        self.assertEqual(self.tag.name, eager.name)
+        self.assertEqual(self.tag.keys(), eager.keys())
+        self.assertEqual(len(self.tag), len(eager))
+
+    def test_not_decoded(self):
+        """
+        Children aren't decoded until they are used.
+        """
+
+        self.assertFalse(any(isinstance(tag, TAG) for tag in self.tag._tags))
+        self.tag["intTest"]
+        decoded = [tag.name for tag in self.tag._tags if isinstance(tag, TAG)]
+        self.assertEqual(decoded, ["intTest"])
+
+    def test_values(self):
+        eager = NBTFile(self.f.name)
+        self.assertEqual(self.tag.pretty_tree(), eager.pretty_tree())
+
+    def test_nested(self):
+        eager = NBTFile(self.f.name)
+        name = [key for key in eager.keys()
+            if isinstance(eager[key], TAG_Compound)][0]
+        self.assertEqual(self.tag[name].pretty_tree(),
+            eager[name].pretty_tree())
+
+    def test_round_trip(self):
+        self.assertEqual(self.write(self.tag), self.data)
+
+    def test_round_trip_partly_read(self):
+        for name in self.tag.keys()[::2]:
+            self.tag[name]
+        self.assertEqual(self.write(self.tag), self.data)
+
+    def test_edit(self):
+        eager = NBTFile(self.f.name)
+        for tag in eager, self.tag:
+            tag["intTest"].value = 42
+            tag["new"] = TAG_String(u"value")
+        self.assertEqual(self.write(self.tag), self.write(eager))
+
+    def test_empty_file(self):
+        temp = tempfile.NamedTemporaryFile()
+        temp.flush()
+        self.assertRaises(MalformedFileError, NBTFile, temp.name, lazy=True)
+
+    def test_truncated(self):
+        b = StringIO()
+        f = GzipFile(fileobj=b, mode="wb")
+        f.write(self.data[:-100])
+        f.close()
+        b.seek(0)
+        self.assertRaises(MalformedFileError, NBTFile, fileobj=b, lazy=True)
+
+class TestScanning(unittest.TestCase):
+
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile()
+        f.write(bigtest)
+        f.flush()
+        self.data = GzipFile(f.name).read()
+        self.tag = NBTFile(f.name)
+
+    def test_scan_root(self):
+        name, offset = scan_root(self.data)
+        self.assertEqual(name, self.tag.name)
+
+    def test_scan_root_not_compound(self):
+        self.assertRaises(MalformedFileError, scan_root, "\x01\x00\x00\x00")
+
+    def test_scan_root_truncated(self):
+        self.assertRaises(MalformedFileError, scan_root, "")
+
+    def test_scan_compound(self):
+        name, offset = scan_root(self.data)
+        children, end = scan_compound(self.data, offset)
+        self.assertEqual([child[0] for child in children], self.tag.keys())
+        self.assertEqual([child[1] for child in children],
+            [tag.id for tag in self.tag.tags])
+        self.assertEqual(end, len(self.data))
+
+    def test_skip_tag(self):
+        name, offset = scan_root(self.data)
+        self.assertEqual(skip_tag(self.data, offset, TAG_COMPOUND),
+            len(self.data))
+
+    def test_read_tag(self):
+        name, offset = scan_root(self.data)
+        children, end = scan_compound(self.data, offset)
+        for name, tagid, offset in children:
+            tag = read_tag(self.data, offset, tagid)
+            self.assertEqual(tag.pretty_tree(),
+                self.tag[str(name)].pretty_tree().replace(
+                    '("%s")' % name, "", 1))
+
+    def test_memoryview(self):
+        view = memoryview(bytearray(self.data))
+        name, offset = scan_root(view)
+        children, end = scan_compound(view, offset)
+        self.assertEqual(name, self.tag.name)
+        self.assertEqual(end, len(self.data))
+
+    def test_list_of_compounds(self):
+        tag = TAG_List(type=TAG_Compound)
+        for i in range(3):
+            item = TAG_Compound()
+            item["i"] = TAG_Int(i)
+            item["s"] = TAG_String(u"\u2603" * i)
+            tag.tags.append(item)
+
+        b = StringIO()
+        tag._render_buffer(b)
+        data = b.getvalue() + "trailing"
+
+        self.assertEqual(skip_tag(data, 0, TAG_LIST), len(data) - 8)
+        read = read_tag(data, 0, TAG_LIST)
+        self.assertEqual([child["s"].value for child in read.tags],
+            [u"", u"\u2603", u"\u2603\u2603"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,10 +3,12 @@
 from twisted.trial import unittest
 
 from construct import Container
-from construct import ArrayError, MappingError
+from construct import ArrayError, MappingError, SwitchError
 
 import bravo.packets.beta
+import bravo.packets.codec
 import bravo.packets.infini
+import bravo.packets.movement
 
 class TestPacketDataStructures(unittest.TestCase):
 
@@ -230,6 +232,244 @@ class TestPacketIntegration(unittest.TestCase):
         reconstructed = bravo.packets.beta.make_packet("location", payload)
         self.assertEqual(packet, reconstructed)
 
+class TestPacketDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = bravo.packets.beta.PacketDecoder()
+        self.parses = []
+
+        original = bravo.packets.beta.BufferReader.read
+        def read(reader, length):
+            self.parses.append(length)
+            return original(reader, length)
+        self.patch(bravo.packets.beta.BufferReader, "read", read)
+
+    def test_trivial(self):
+        pass
+
+    def test_empty(self):
+        self.assertEqual(list(self.decoder), [])
+
+    def test_single(self):
+        self.decoder.feed("\x04\x00\x00\x00\x00\x00\x00\x00\x2a")
+        packets = list(self.decoder)
+        self.assertEqual(len(packets), 1)
+        header, payload = packets[0]
+        self.assertEqual(header, 4)
+        self.assertEqual(payload.timestamp, 42)
+        self.assertEqual(self.decoder.leftovers(), "")
+
+    def test_several(self):
+        packet = bravo.packets.beta.make_packet("time", timestamp=1)
+        self.decoder.feed(packet * 3)
+        self.assertEqual(len(list(self.decoder)), 3)
+
+    def test_fixed_size_not_parsed_until_complete(self):
+        packet = bravo.packets.beta.make_packet("time", timestamp=1)
+        for c in packet[:-1]:
+            self.decoder.feed(c)
+            self.assertEqual(list(self.decoder), [])
+        self.assertEqual(self.parses, [])
+
+        self.decoder.feed(packet[-1])
+        self.assertEqual(len(list(self.decoder)), 1)
+
+    def test_variable_size_trickle(self):
+        """
+        Partially received variable-size packets aren't parsed again until
+        there might be enough data.
+        """
+
+        packet = bravo.packets.beta.make_packet("chat", message=u"a" * 50)
+        for c in packet[:-1]:
+            self.decoder.feed(c)
+            self.assertEqual(list(self.decoder), [])
+        self.decoder.feed(packet[-1])
+
+        packets = list(self.decoder)
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0][1].message, u"a" * 50)
+        # Three attempts: with only the header, with only the length, and
+        # with the complete packet, which reads the length and string.
+        self.assertEqual(len(self.parses), 5)
+
+    def test_leftovers(self):
+        packet = bravo.packets.beta.make_packet("time", timestamp=1)
+        self.decoder.feed(packet + packet[:3])
+        self.assertEqual(len(list(self.decoder)), 1)
+        self.assertEqual(self.decoder.leftovers(), packet[:3])
+
+    def test_compact(self):
+        self.decoder.compact_threshold = 10
+        packet = bravo.packets.beta.make_packet("time", timestamp=1)
+
+        self.decoder.feed(packet * 3 + packet[:3])
+        list(self.decoder)
+        self.decoder.feed(packet[3:])
+
+        self.assertEqual(self.decoder.offset, 0)
+        self.assertEqual(len(list(self.decoder)), 1)
+
+    def test_unknown(self):
+        self.decoder.feed("\xfe")
+        self.assertRaises(SwitchError, self.decoder.next_packet)
+
+    def test_parse_packets_leftovers(self):
+        packet = bravo.packets.beta.make_packet("time", timestamp=1)
+        packets, leftovers = bravo.packets.beta.parse_packets(packet + "\x04")
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(leftovers, "\x04")
+
+class TestCodec(unittest.TestCase):
+    """
+    The precompiled codecs must agree exactly with construct.
+    """
+
+    payloads = {
+        "grounded": [{"grounded": 0}, {"grounded": True}],
+        "position": [{
+            "position": Container(x=1.5, y=64.0, stance=65.62, z=-7.25),
+            "grounded": Container(grounded=1),
+        }],
+        "orientation": [{
+            "orientation": Container(rotation=-90.0, pitch=12.5),
+            "grounded": Container(grounded=0),
+        }],
+        "location": [{
+            "position": Container(x=6.5, y=67.24, stance=65.62, z=7.5),
+            "orientation": Container(rotation=0.0, pitch=0.0),
+            "grounded": Container(grounded=0),
+        }],
+        "destroy": [{"eid": 1}, {"eid": 2**32 - 1}],
+        "create": [{"eid": 42}],
+        "entity-position": [{"eid": 2, "x": -128, "y": 0, "z": 127}],
+        "entity-orientation": [{"eid": 2, "yaw": 255, "pitch": 0}],
+        "entity-location": [
+            {"eid": 2, "x": 1, "y": -1, "z": 0, "yaw": 3, "pitch": 4},
+        ],
+        "teleport": [
+            {"eid": 2, "x": -3200, "y": 2048, "z": 96, "yaw": 128,
+                "pitch": 64},
+        ],
+        "time": [{"timestamp": 0}, {"timestamp": 23999}],
+        "prechunk": [{"x": -1, "z": 5, "enabled": 1}],
+        "block": [{"x": -17, "y": 127, "z": 33, "type": 4, "meta": 15}],
+        "chunk": [{"x": -16, "y": 0, "z": 32, "x_size": 15, "y_size": 127,
+            "z_size": 15, "data": "\x01\x02" * 1000}],
+        "batch": [{"x": 1, "z": -1, "length": 2, "coords": [4097, 3],
+            "types": [1, 2], "metadata": [0, 15]}],
+    }
+
+    def build(self, name, payload):
+        header = bravo.packets.beta.packets_by_name[name]
+        packet = bravo.packets.beta.packets[header]
+        return chr(header) + packet.build(Container(**payload))
+
+    def test_covered(self):
+        self.assertEqual(set(self.payloads),
+            set(bravo.packets.codec.encoders))
+
+    def test_encoders(self):
+        for name, payloads in self.payloads.iteritems():
+            encoder = bravo.packets.codec.encoders[name]
+            for payload in payloads:
+                self.assertEqual(encoder(payload), self.build(name, payload),
+                    "%s %r" % (name, payload))
+
+    def test_decoders(self):
+        for name, payloads in self.payloads.iteritems():
+            header = bravo.packets.beta.packets_by_name[name]
+            if header not in bravo.packets.codec.decoders:
+                continue
+            decoder = bravo.packets.codec.decoders[header]
+            for payload in payloads:
+                packet = bytearray("\xff" + self.build(name, payload))
+                expected = bravo.packets.beta.packets[header].parse(
+                    str(packet[2:]))
+                self.assertEqual(decoder(packet, 2), expected)
+
+    def test_decoders_fixed_size(self):
+        for header in bravo.packets.codec.decoders:
+            self.assertTrue(header in bravo.packets.beta.packet_sizes)
+
+    def test_make_packet_fallback(self):
+        """
+        Payloads the codec can't handle are given to construct.
+        """
+
+        built = []
+
+        class FakeStruct(object):
+            def build(self, container):
+                built.append(container)
+                return "built"
+
+        header = bravo.packets.beta.packets_by_name["destroy"]
+        packets = dict(bravo.packets.beta.packets)
+        packets[header] = FakeStruct()
+        self.patch(bravo.packets.beta, "packets", packets)
+
+        # The codec can't encode a destroy without an eid.
+        packet = bravo.packets.beta.make_packet("destroy", entity=1)
+        self.assertEqual(packet, chr(header) + "built")
+        self.assertEqual(built, [Container(entity=1)])
+
+class TestMovementEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.me = bravo.packets.movement.MovementEncoder()
+
+    def parse(self, packet):
+        header, payload = bravo.packets.beta.parse_packets(packet)[0][0]
+        return bravo.packets.beta.packets[header].name, payload
+
+    def test_first_teleport(self):
+        name, payload = self.parse(self.me.encode(1, 32, 64, 96, 0, 0))
+        self.assertEqual(name, "teleport")
+        self.assertEqual(payload.x, 32)
+
+    def test_suppressed(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        self.assertEqual(self.me.encode(1, 32, 64, 96, 0, 0), "")
+
+    def test_relative_move(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        name, payload = self.parse(self.me.encode(1, 0, 64, 128, 0, 0))
+        self.assertEqual(name, "entity-position")
+        self.assertEqual((payload.x, payload.y, payload.z), (-32, 0, 32))
+
+    def test_relative_move_and_look(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        name, payload = self.parse(self.me.encode(1, 64, 64, 96, 128, 0))
+        self.assertEqual(name, "entity-location")
+        self.assertEqual(payload.x, 32)
+        self.assertEqual(payload.yaw, 128)
+
+    def test_look(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        name, payload = self.parse(self.me.encode(1, 32, 64, 96, 64, 32))
+        self.assertEqual(name, "entity-orientation")
+        self.assertEqual((payload.yaw, payload.pitch), (64, 32))
+
+    def test_large_jump(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        name, payload = self.parse(self.me.encode(1, 32 * 5, 64, 96, 0, 0))
+        self.assertEqual(name, "teleport")
+
+    def test_periodic_teleport(self):
+        self.me.encode(1, 0, 0, 0, 0, 0)
+        for i in range(self.me.teleport_interval):
+            name, payload = self.parse(self.me.encode(1, i + 1, 0, 0, 0, 0))
+            self.assertEqual(name, "entity-position")
+        name, payload = self.parse(self.me.encode(1, 0, 0, 0, 0, 0))
+        self.assertEqual(name, "teleport")
+
+    def test_forget(self):
+        self.me.encode(1, 32, 64, 96, 0, 0)
+        self.me.forget(1)
+        name, payload = self.parse(self.me.encode(1, 32, 64, 96, 0, 0))
+        self.assertEqual(name, "teleport")
+
 class TestInfiniPacketParsing(unittest.TestCase):
 
     def test_ping(self):
@@ -2,6 +2,7 @@ from twisted.trial import unittest
 
 import zope.interface
 
+import bravo.ibravo
 import bravo.plugin
 
 class EdgeHolder(object):
@@ -178,3 +179,153 @@ class TestVerifyPlugin(unittest.TestCase):
         valid = Valid()
         self.assertEqual(bravo.plugin.verify_plugin(ITestInterface, valid),
                          valid)
+
+class ICommandInterface(zope.interface.Interface):
+    name = zope.interface.Attribute("")
+    aliases = zope.interface.Attribute("")
+    def run(arg):
+        pass
+
+class Command(object):
+    zope.interface.implements(ICommandInterface)
+
+    def __init__(self, name, aliases=()):
+        self.name = name
+        self.aliases = aliases
+
+    def run(self, arg):
+        return [self.name, arg]
+
+class TestCommandRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.plugins = {
+            "first": Command("first", ("one", "second")),
+            "second": Command("second"),
+        }
+
+        def retrieve_plugins(interface, parameters=None):
+            self.calls += 1
+            return dict(self.plugins)
+
+        self.patch(bravo.plugin, "retrieve_plugins", retrieve_plugins)
+
+        self.registry = bravo.plugin.CommandRegistry(ICommandInterface,
+            "run")
+
+    def test_discovery_once(self):
+        "first" in self.registry
+        self.registry["first"]
+        self.registry.dispatch("first", None)
+        self.assertEqual(self.calls, 1)
+
+    def test_aliases(self):
+        self.assertTrue("one" in self.registry)
+        self.assertEqual(self.registry["one"].name, "first")
+
+    def test_aliases_shadowed(self):
+        """
+        Names take precedence over aliases.
+        """
+
+        self.assertEqual(self.registry["second"].name, "second")
+
+    def test_reload(self):
+        self.plugins["third"] = Command("third")
+        self.assertFalse("third" in self.registry)
+        self.registry.reload()
+        self.assertTrue("third" in self.registry)
+
+    def test_dispatch(self):
+        d = self.registry.dispatch("one", "arg")
+        d.addCallback(self.assertEqual, ["first", "arg"])
+        return d
+
+    def test_dispatch_unknown(self):
+        self.assertRaises(KeyError, self.registry.dispatch, "third", None)
+
+    def test_dispatch_timings(self):
+        self.registry.dispatch("first", None)
+        self.registry.dispatch("one", None)
+        self.assertEqual(self.registry.timings["first"][0], 2)
+        self.assertEqual(self.registry.latency()[0], 2)
+
+    def test_latency_empty(self):
+        self.assertEqual(self.registry.latency(), (0, 0, 0))
+
+class TestPluginCache(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(bravo.plugin, "module_cache", {})
+        self.patch(bravo.plugin, "catalogue", {})
+
+        self.loaded = []
+        load = bravo.plugin.load
+        def counting_load(pm, mapper):
+            self.loaded.append(pm.name)
+            return load(pm, mapper)
+        self.patch(bravo.plugin, "load", counting_load)
+
+        self.pp = {"factory": object()}
+
+    def retrieve(self):
+        return bravo.plugin.retrieve_plugins(bravo.ibravo.IChatCommand,
+            parameters=self.pp)
+
+    def test_parameters_key_empty(self):
+        self.assertEqual(bravo.plugin.parameters_key(None), ())
+        self.assertEqual(bravo.plugin.parameters_key({}), ())
+
+    def test_parameters_key_unhashable(self):
+        self.assertEqual(bravo.plugin.parameters_key({"a": []}), None)
+
+    def test_cached(self):
+        first = self.retrieve()
+        count = len(self.loaded)
+        second = self.retrieve()
+        self.assertEqual(len(self.loaded), count)
+        self.assertTrue(first["help"] is second["help"])
+
+    def test_cached_per_parameters(self):
+        first = self.retrieve()
+        self.pp = {"factory": object()}
+        second = self.retrieve()
+        self.assertFalse(first["help"] is second["help"])
+
+    def test_changed(self):
+        """
+        Modules are loaded again after their source changes.
+        """
+
+        first = self.retrieve()
+        for key, (mtime, m) in bravo.plugin.module_cache.items():
+            bravo.plugin.module_cache[key] = mtime - 1, m
+        second = self.retrieve()
+        self.assertFalse(first["help"] is second["help"])
+
+    def test_catalogue(self):
+        self.retrieve()
+        key = bravo.plugin.parameters_key(self.pp)
+        found = bravo.plugin.catalogue[bravo.ibravo.IChatCommand, key]
+        self.assertEqual(found["help"], "bravo.plugins.commands")
+
+    def test_named_from_catalogue(self):
+        """
+        Named lookups of known plugins only examine their own modules.
+        """
+
+        self.retrieve()
+        del self.loaded[:]
+        bravo.plugin.module_cache.clear()
+
+        plugins = bravo.plugin.retrieve_named_plugins(
+            bravo.ibravo.IChatCommand, ["help"], parameters=self.pp)
+        self.assertEqual([plugin.name for plugin in plugins], ["help"])
+        self.assertEqual(self.loaded, ["bravo.plugins.commands"])
+
+    def test_named_unknown(self):
+        self.retrieve()
+        self.assertRaises(bravo.plugin.PluginException,
+            bravo.plugin.retrieve_named_plugins, bravo.ibravo.IChatCommand,
+            ["nonexistent"], parameters=self.pp)
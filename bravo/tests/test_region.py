@@ -0,0 +1,401 @@
+import os
+import shutil
+from struct import pack, unpack_from
+import tempfile
+from zlib import decompress
+
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+
+from bravo.region import (PageAllocator, ReadAheadCache, RegionCompactor,
+    RegionFile, RegionPool, compress_chunk, distance_from, morton,
+    pack_header, read_header, region_coords)
+
+class TestOrdering(unittest.TestCase):
+
+    def test_region_coords(self):
+        self.assertEqual(region_coords("r.-1.2.mcr"), (-1, 2))
+
+    def test_morton(self):
+        self.assertEqual(morton(0, 0), 0)
+        self.assertEqual(morton(1, 0), 1)
+        self.assertEqual(morton(0, 1), 2)
+        self.assertEqual(morton(1, 1), 3)
+        self.assertEqual(morton(2, 0), 4)
+        self.assertEqual(morton(31, 31), 1023)
+
+    def test_morton_unique(self):
+        keys = set(morton(x, z) for x in range(32) for z in range(32))
+        self.assertEqual(len(keys), 1024)
+
+    def test_distance_from(self):
+        key = distance_from(-1, 0, 0, 0)
+        self.assertTrue(key(31, 0) < key(30, 0))
+        self.assertTrue(key(31, 0) < key(31, 1))
+
+class TestReadHeader(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(read_header("\x00" * 4096), {})
+
+    def test_entries(self):
+        entries = [0] * 1024
+        entries[0] = 2 << 8 | 1
+        entries[33] = 3 << 8 | 2
+        page = pack(">1024L", *entries)
+        self.assertEqual(read_header(page), {(0, 0): (2, 1), (1, 1): (3, 2)})
+
+class TestCompressChunk(unittest.TestCase):
+
+    def test_header(self):
+        chunk = compress_chunk(bytearray("test" * 100))
+        self.assertTrue(isinstance(chunk, bytearray))
+        length, version = unpack_from(">LB", chunk)
+        self.assertEqual(length, len(chunk) - 4)
+        self.assertEqual(version, 2)
+
+    def test_round_trip(self):
+        chunk = compress_chunk("test" * 100, 9)
+        self.assertEqual(decompress(str(chunk[5:])), "test" * 100)
+
+class TestPackHeader(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(pack_header({}), "\x00" * 4096)
+
+    def test_round_trip(self):
+        positions = {(0, 0): (2, 1), (31, 31): (5, 3), (4, 7): (3, 2)}
+        self.assertEqual(read_header(pack_header(positions)), positions)
+
+class TestPageAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.allocator = PageAllocator()
+
+    def test_allocate_empty(self):
+        self.assertEqual(self.allocator.allocate(3), 2)
+        self.assertEqual(self.allocator.allocate(1), 5)
+        self.assertEqual(self.allocator.end, 6)
+
+    def test_from_positions(self):
+        allocator = PageAllocator.from_positions({
+            (0, 0): (2, 1),
+            (1, 0): (5, 2),
+            (2, 0): (10, 1),
+        })
+        self.assertEqual(allocator.runs, {3: 2, 7: 3})
+        self.assertEqual(allocator.free_pages, 5)
+        self.assertEqual(allocator.end, 11)
+
+    def test_best_fit(self):
+        allocator = PageAllocator.from_positions({
+            (0, 0): (5, 1),
+            (1, 0): (8, 1),
+        })
+        # Free runs are 2-4 and 6-7; the smaller one fits best.
+        self.assertEqual(allocator.allocate(2), 6)
+        self.assertEqual(allocator.allocate(2), 2)
+        self.assertEqual(allocator.runs, {4: 1})
+
+    def test_allocate_past_runs(self):
+        allocator = PageAllocator.from_positions({(0, 0): (4, 1)})
+        self.assertEqual(allocator.allocate(3), 5)
+
+    def test_free_merges(self):
+        for i in range(5):
+            self.allocator.allocate(1)
+        self.allocator.free(3, 1)
+        self.allocator.free(5, 1)
+        self.allocator.free(4, 1)
+        self.assertEqual(self.allocator.runs, {3: 3})
+        self.assertEqual(self.allocator.by_size, [(3, 3)])
+
+    def test_free_end(self):
+        """
+        Freeing the last pages moves the end back, along with any run
+        before them.
+        """
+
+        for i in range(4):
+            self.allocator.allocate(1)
+        self.allocator.free(3, 1)
+        self.allocator.free(4, 2)
+        self.assertEqual(self.allocator.end, 3)
+        self.assertEqual(self.allocator.runs, {})
+
+    def test_fragmentation(self):
+        allocator = PageAllocator.from_positions({
+            (0, 0): (2, 1),
+            (1, 0): (5, 1),
+        })
+        self.assertEqual(allocator.fragmentation(), 0.5)
+
+    def test_fragmentation_empty(self):
+        self.assertEqual(self.allocator.fragmentation(), 0)
+
+class TestRegionFile(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.fp = FilePath(self.d).child("r.0.0.mcr")
+        self.fp.setContent("\x00" * 8192)
+        self.region = RegionFile(self.fp)
+
+    def tearDown(self):
+        self.region.close()
+        shutil.rmtree(self.d)
+
+    def test_size(self):
+        self.assertEqual(self.region.size, 8192)
+
+    def test_read(self):
+        self.assertEqual(str(self.region.read(0, 4)), "\x00" * 4)
+
+    def test_read_buffer(self):
+        """
+        Reads are sliced from the map, not copied.
+        """
+
+        self.assertTrue(isinstance(self.region.read(0, 4), buffer))
+
+    def test_read_only(self):
+        """
+        Region files which can't be written to can still be read.
+        """
+
+        self.region.close()
+        os.chmod(self.fp.path, 0444)
+        self.region = RegionFile(self.fp)
+        self.assertEqual(str(self.region.read(0, 4)), "\x00" * 4)
+        self.assertFalse(self.region.writable)
+        self.assertEqual(self.region.handle.mode, "rb")
+
+    def test_write_reopens(self):
+        self.region.read(0, 4)
+        self.region.write(4096, "test")
+        self.assertTrue(self.region.writable)
+        self.assertEqual(self.fp.getContent()[4096:4100], "test")
+        self.assertEqual(str(self.region.read(4096, 4)), "test")
+
+    def test_write_read(self):
+        self.region.write(4096, "test")
+        self.assertEqual(str(self.region.read(4096, 4)), "test")
+
+    def test_write_grows(self):
+        self.region.read(0, 4)
+        self.region.write(8192, "grown")
+        self.assertEqual(self.region.size, 8197)
+        self.assertEqual(str(self.region.read(8192, 5)), "grown")
+
+    def test_read_past_end(self):
+        self.assertEqual(len(self.region.read(8190, 10)), 2)
+
+    def test_read_past_end_mapped_once(self):
+        """
+        Reads which run off of the end of an unchanged file don't map it
+        again.
+        """
+
+        self.region.read(8190, 10)
+        mapped = self.region.map
+        self.region.read(8190, 10)
+        self.assertTrue(self.region.map is mapped)
+
+    def test_remap_closes(self):
+        self.region.read(0, 4)
+        mapped = self.region.map
+        self.region.write(8192, "grown")
+        self.region.read(8192, 5)
+        self.assertRaises(ValueError, len, mapped)
+
+    def test_read_empty(self):
+        fp = FilePath(self.d).child("r.0.1.mcr")
+        fp.setContent("")
+        region = RegionFile(fp)
+        self.assertEqual(str(region.read(0, 4096)), "")
+        region.close()
+
+    def test_write_chunks(self):
+        self.region.write_chunks([(3, "second"), (2, "first")])
+        self.assertEqual(str(self.region.read(8192, 5)), "first")
+        self.assertEqual(str(self.region.read(12288, 6)), "second")
+
+    def test_write_chunks_coalesced(self):
+        """
+        Chunks in adjacent pages are written in a single write.
+        """
+
+        writes = []
+        write = self.region.write
+        def record(offset, data):
+            writes.append(offset)
+            write(offset, data)
+        self.region.write = record
+
+        self.region.write_chunks([(2, "a"), (3, "b" * 5000), (5, "c"),
+            (7, "d")])
+        self.assertEqual(writes, [8192, 28672])
+        self.assertEqual(str(self.region.read(12288, 5000)), "b" * 5000)
+        self.assertEqual(str(self.region.read(20480, 1)), "c")
+        self.assertEqual(str(self.region.read(28672, 1)), "d")
+
+    def test_sync(self):
+        self.region.write(0, "synced")
+        self.region.sync()
+        self.assertEqual(self.fp.getContent()[:6], "synced")
+
+class TestRegionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.fps = []
+        for i in range(3):
+            fp = FilePath(self.d).child("r.%d.0.mcr" % i)
+            fp.setContent("\x00" * 8192)
+            self.fps.append(fp)
+        self.pool = RegionPool(limit=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.d)
+
+    def test_open_cached(self):
+        first = self.pool.open(self.fps[0])
+        second = self.pool.open(self.fps[0])
+        self.assertTrue(first is second)
+        self.assertEqual(self.pool.opened, 1)
+
+    def test_limit(self):
+        for fp in self.fps:
+            self.pool.open(fp)
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.pool.opened, 3)
+
+    def test_lru(self):
+        """
+        The least recently used region is closed first.
+        """
+
+        first = self.pool.open(self.fps[0])
+        self.pool.open(self.fps[1])
+        self.pool.open(self.fps[0])
+        self.pool.open(self.fps[2])
+        self.assertTrue(self.pool.open(self.fps[0]) is first)
+        self.assertEqual(self.pool.opened, 3)
+
+    def test_evicted_closed(self):
+        first = self.pool.open(self.fps[0])
+        self.pool.open(self.fps[1])
+        self.pool.open(self.fps[2])
+        self.assertTrue(first.handle.closed)
+
+    def test_close(self):
+        first = self.pool.open(self.fps[0])
+        self.pool.close(self.fps[0])
+        self.assertEqual(len(self.pool), 0)
+        self.assertTrue(first.handle.closed)
+
+class TestReadAheadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ReadAheadCache(limit=2)
+
+    def test_take(self):
+        self.cache.add("a", "data")
+        self.assertTrue("a" in self.cache)
+        self.assertEqual(self.cache.take("a"), "data")
+        self.assertFalse("a" in self.cache)
+
+    def test_take_missing(self):
+        self.assertEqual(self.cache.take("a"), None)
+
+    def test_limit(self):
+        for key in "abc":
+            self.cache.add(key, key)
+        self.assertEqual(len(self.cache), 2)
+        self.assertFalse("a" in self.cache)
+        self.assertEqual(self.cache.fetched, 3)
+
+    def test_add_twice(self):
+        self.cache.add("a", "first")
+        self.cache.add("a", "second")
+        self.assertEqual(self.cache.take("a"), "first")
+        self.assertEqual(self.cache.fetched, 1)
+
+    def test_discard(self):
+        self.cache.add("a", "data")
+        self.cache.discard("a")
+        self.cache.discard("b")
+        self.assertFalse("a" in self.cache)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_hit_rate(self):
+        self.assertEqual(self.cache.hit_rate(), 0)
+        self.cache.add("a", "data")
+        self.cache.take("a")
+        self.cache.take("a")
+        self.cache.take("b")
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertAlmostEqual(self.cache.hit_rate(), 1 / 3.0)
+
+def chunk_payload(fill, length):
+    return pack(">LB", length + 1, 2) + fill * length
+
+class TestRegionCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.fp = FilePath(self.d).child("r.0.0.mcr")
+
+        # Two chunks, with a hole between them and slack after the first.
+        entries = [0] * 1024
+        entries[0] = 2 << 8 | 2
+        entries[1] = 6 << 8 | 1
+        pages = [
+            pack(">1024L", *entries),
+            "\x01" * 4096,
+            chunk_payload("a", 100).ljust(8192, "\x00"),
+            "\x00" * 8192,
+            chunk_payload("b", 200).ljust(4096, "\x00"),
+        ]
+        self.fp.setContent("".join(pages))
+
+    def tearDown(self):
+        shutil.rmtree(self.d)
+
+    def test_run(self):
+        compactor = RegionCompactor(self.fp)
+        compactor.run()
+
+        self.assertEqual(compactor.old_pages, 7)
+        self.assertEqual(compactor.new_pages, 4)
+        self.assertFalse(compactor.temp.exists())
+
+        data = self.fp.getContent()
+        self.assertEqual(len(data), 4 * 4096)
+        self.assertEqual(read_header(data), {(0, 0): (2, 1), (1, 0): (3, 1)})
+        self.assertEqual(data[4096:8192], "\x01" * 4096)
+        self.assertEqual(data[8192:8192 + 105], chunk_payload("a", 100))
+        self.assertEqual(data[12288:12288 + 205], chunk_payload("b", 200))
+
+    def test_order(self):
+        compactor = RegionCompactor(self.fp, key=lambda x, z: -x)
+        compactor.run()
+
+        positions = read_header(self.fp.getContent())
+        self.assertEqual(positions, {(1, 0): (2, 1), (0, 0): (3, 1)})
+
+    def test_steps(self):
+        compactor = RegionCompactor(self.fp)
+        self.assertEqual(len(list(compactor.copy())), 2)
+
+    def test_abort(self):
+        original = self.fp.getContent()
+        compactor = RegionCompactor(self.fp)
+        for step in compactor.copy():
+            pass
+        compactor.abort()
+
+        self.assertFalse(compactor.temp.exists())
+        self.assertEqual(self.fp.getContent(), original)
@@ -0,0 +1,87 @@
+from twisted.trial import unittest
+
+from gzip import GzipFile
+from StringIO import StringIO
+from zlib import compress, decompress, error
+
+from bravo.utilities.compression import Compressor
+
+class TestCompressorInline(unittest.TestCase):
+    """
+    Compressors which haven't been started work on the calling thread.
+    """
+
+    def setUp(self):
+        self.c = Compressor()
+
+    def test_compress(self):
+        d = self.c.compress("test")
+        d.addCallback(decompress)
+        d.addCallback(self.assertEqual, "test")
+        return d
+
+    def test_level(self):
+        self.c.level = 1
+        data = "".join(chr(i % 7) for i in range(10000))
+        d = self.c.compress(data)
+        d.addCallback(self.assertEqual, compress(data, 1))
+        return d
+
+    def test_decompress_gzip(self):
+        b = StringIO()
+        f = GzipFile(fileobj=b, mode="wb")
+        f.write("test")
+        f.close()
+
+        d = self.c.decompress(b.getvalue(), gzip=True)
+        d.addCallback(self.assertEqual, "test")
+        return d
+
+    def test_compress_all_empty(self):
+        self.assertEqual(self.c.compress_all([]), [])
+
+    def test_compress_all_bytearray(self):
+        compressed = self.c.compress_all([bytearray("test")])
+        self.assertEqual(self.c.decompress_all(compressed), ["test"])
+
+class TestCompressorThreaded(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Compressor(workers=3)
+        self.c.start()
+
+    def tearDown(self):
+        self.c.stop()
+
+    def test_compress(self):
+        d = self.c.compress("test")
+        d.addCallback(decompress)
+        d.addCallback(self.assertEqual, "test")
+        return d
+
+    def test_decompress_failure(self):
+        d = self.c.decompress("not zlib")
+        return self.assertFailure(d, error)
+
+    def test_compress_all_order(self):
+        payloads = [str(i) * 1000 for i in range(10)]
+        compressed = self.c.compress_all(payloads)
+        self.assertEqual([decompress(data) for data in compressed], payloads)
+
+    def test_decompress_all(self):
+        payloads = [str(i) * 1000 for i in range(10)]
+        compressed = [compress(payload) for payload in payloads]
+        self.assertEqual(self.c.decompress_all(compressed), payloads)
+
+    def test_decompress_all_failure(self):
+        self.assertRaises(error, self.c.decompress_all,
+            [compress("test"), "not zlib"])
+
+    def test_stop(self):
+        """
+        Stopped compressors go back to working on the calling thread.
+        """
+
+        self.c.stop()
+        self.assertEqual(self.c.compress_all(["a", "b"]),
+            [compress("a", 6), compress("b", 6)])
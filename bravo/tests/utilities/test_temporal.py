@@ -0,0 +1,72 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from bravo.utilities.temporal import TimerWheel
+
+class TestTimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(clock=self.clock)
+        self.wheel.start()
+        self.calls = []
+
+    def tearDown(self):
+        self.wheel.stop()
+
+    def advance(self, seconds):
+        for i in range(int(seconds / self.wheel.resolution)):
+            self.clock.advance(self.wheel.resolution)
+
+    def test_schedule(self):
+        self.wheel.schedule(1, self.calls.append, "a")
+        self.advance(0.75)
+        self.assertEqual(self.calls, [])
+        self.advance(0.25)
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_schedule_beyond_revolution(self):
+        delay = self.wheel.size * self.wheel.resolution * 2 + 1
+        timer = self.wheel.schedule(delay, self.calls.append, "a")
+        self.advance(delay - 1)
+        self.assertEqual(self.calls, [])
+        self.assertTrue(timer.active())
+        self.advance(1)
+        self.assertEqual(self.calls, ["a"])
+        self.assertFalse(timer.active())
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(1, self.calls.append, "a")
+        timer.cancel()
+        self.advance(2)
+        self.assertEqual(self.calls, [])
+        self.assertFalse(timer.active())
+
+    def test_repeat(self):
+        self.wheel.repeat(1, self.calls.append, "a")
+        self.advance(3)
+        self.assertEqual(self.calls, ["a"] * 3)
+
+    def test_repeat_cancel(self):
+        timer = self.wheel.repeat(1, self.calls.append, "a")
+        self.advance(1)
+        timer.cancel()
+        self.advance(2)
+        self.assertEqual(self.calls, ["a"])
+
+    def test_error(self):
+        """
+        Failing timers don't stop the wheel.
+        """
+
+        def fail():
+            raise Exception("Broken")
+
+        self.wheel.schedule(1, fail)
+        self.wheel.schedule(1, self.calls.append, "a")
+        self.advance(1)
+
+        self.assertEqual(self.calls, ["a"])
+        self.assertTrue(self.wheel.loop.running)
+        self.assertEqual(len(self.flushLoggedErrors(Exception)), 1)
@@ -0,0 +1,139 @@
+"""
+Compression utilities.
+"""
+
+from Queue import Queue
+from zlib import MAX_WBITS, compress, decompress
+
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+def _compress(data, level):
+    # zlib only takes strings and read-only buffers, not bytearrays.
+    return compress(buffer(data), level)
+
+def _decompress(data, wbits):
+    return decompress(buffer(data), wbits)
+
+class Compressor(object):
+    """
+    An executor for zlib compression and decompression.
+
+    zlib releases the GIL while it works, so once the compressor is started,
+    work is handed to a small pool of threads, where it runs in parallel and
+    off of the reactor. Until then, and after it is stopped, all work is done
+    right away on the calling thread.
+    """
+
+    def __init__(self, level=6, workers=4):
+        """
+        :param int level: zlib compression level, from 1 (fastest) to 9
+                          (smallest)
+        :param int workers: the most threads to use
+        """
+
+        self.level = level
+        self.workers = workers
+        self.pool = None
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+
+        if self.pool is None:
+            self.pool = ThreadPool(0, self.workers, "compression")
+            self.pool.start()
+
+    def stop(self):
+        """
+        Stop the worker threads, waiting for any outstanding work to finish.
+        """
+
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def _defer(self, f, *args):
+        if self.pool is None:
+            return maybeDeferred(f, *args)
+        return deferToThreadPool(reactor, self.pool, f, *args)
+
+    def map(self, f, payloads, *args):
+        """
+        Call a function on several payloads at once, blocking until they are
+        all done.
+
+        :param callable f: a function which releases the GIL while it works,
+                           called with each payload and then ``args``
+        :param list payloads: the first argument for each call
+        :returns: a list of results, in the same order
+        """
+
+        if self.pool is None or len(payloads) < 2:
+            return [f(payload, *args) for payload in payloads]
+
+        results = [None] * len(payloads)
+        done = Queue()
+
+        for i, payload in enumerate(payloads):
+            def finished(success, result, i=i):
+                done.put((i, success, result))
+            self.pool.callInThreadWithCallback(finished, f, payload, *args)
+
+        failures = []
+        for payload in payloads:
+            i, success, result = done.get()
+            if success:
+                results[i] = result
+            else:
+                failures.append(result)
+
+        if failures:
+            failures[0].raiseException()
+
+        return results
+
+    def compress(self, data):
+        """
+        Compress some data.
+
+        :returns: a ``Deferred`` which will fire with the compressed data
+        """
+
+        return self._defer(_compress, data, self.level)
+
+    def decompress(self, data, gzip=False):
+        """
+        Decompress some data.
+
+        :param bool gzip: whether the data has a gzip header, rather than a
+                          zlib header
+        :returns: a ``Deferred`` which will fire with the decompressed data
+        """
+
+        wbits = MAX_WBITS | 16 if gzip else MAX_WBITS
+        return self._defer(_decompress, data, wbits)
+
+    def compress_all(self, payloads):
+        """
+        Compress several payloads at once, blocking until they are all done.
+
+        :param list payloads: strings or buffers to compress
+        :returns: a list of compressed payloads, in the same order
+        """
+
+        return self.map(_compress, payloads, self.level)
+
+    def decompress_all(self, payloads):
+        """
+        Decompress several zlib payloads at once, blocking until they are all
+        done.
+
+        :param list payloads: strings to decompress
+        :returns: a list of decompressed payloads, in the same order
+        """
+
+        return self.map(_decompress, payloads, MAX_WBITS)
@@ -1,10 +1,17 @@
-from twisted.internet.defer import Deferred
-from twisted.python.failure import Failure
-
 """
 Time-related utilities.
 """
 
+from __future__ import division
+
+from math import ceil
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+from twisted.python.failure import Failure
+
 class PendingEvent(object):
     """
     An event which will happen at some point.
@@ -58,3 +65,131 @@ def split_time(timestamp):
     minutes = minutes * 6 // 100
 
     return hours, minutes
+
+class Timer(object):
+    """
+    A call scheduled on a ``TimerWheel``.
+
+    :ivar float interval: if not None, the timer is rescheduled with this
+        delay every time it fires
+    """
+
+    def __init__(self, f, args, kwargs, interval=None):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.interval = interval
+
+        self.bucket = None
+        self.rounds = 0
+
+    def active(self):
+        return self.bucket is not None
+
+    def cancel(self):
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+        self.interval = None
+
+class TimerWheel(object):
+    """
+    A hashed timer wheel.
+
+    Timers are kept in a ring of buckets, instead of each having a place in
+    the reactor's heap of delayed calls. The wheel turns one bucket at a time,
+    firing every timer in the bucket which is due; timers which are due on a
+    later revolution stay where they are.
+
+    Scheduling and cancelling timers are constant-time, no matter how many
+    timers are pending, but timers are only as precise as the resolution of
+    the wheel.
+    """
+
+    resolution = 0.25
+    """
+    The number of seconds between turns.
+    """
+
+    size = 256
+    """
+    The number of buckets in the wheel.
+    """
+
+    def __init__(self, clock=reactor):
+        """
+        :param clock: an ``IReactorTime`` provider, for testing
+        """
+
+        self.buckets = [set() for i in range(self.size)]
+        self.position = 0
+
+        self.loop = LoopingCall(self.turn)
+        self.loop.clock = clock
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def start(self):
+        if not self.loop.running:
+            self.loop.start(self.resolution, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def schedule(self, delay, f, *args, **kwargs):
+        """
+        Call a function after a delay.
+
+        :returns: a ``Timer`` which can be cancelled
+        """
+
+        timer = Timer(f, args, kwargs)
+        self.insert(timer, delay)
+        return timer
+
+    def repeat(self, interval, f, *args, **kwargs):
+        """
+        Call a function repeatedly, starting after one interval.
+
+        :returns: a ``Timer`` which can be cancelled
+        """
+
+        timer = Timer(f, args, kwargs, interval)
+        self.insert(timer, interval)
+        return timer
+
+    def insert(self, timer, delay):
+        turns = max(1, int(ceil(delay / self.resolution)))
+        timer.rounds = (turns - 1) // self.size
+        timer.bucket = self.buckets[(self.position + turns) % self.size]
+        timer.bucket.add(timer)
+
+    def turn(self):
+        """
+        Turn the wheel by one bucket, and fire the timers which are due.
+        """
+
+        self.position = (self.position + 1) % self.size
+        bucket = self.buckets[self.position]
+
+        due = []
+        for timer in bucket:
+            if timer.rounds:
+                timer.rounds -= 1
+            else:
+                due.append(timer)
+
+        for timer in due:
+            bucket.discard(timer)
+            timer.bucket = None
+
+        for timer in due:
+            try:
+                timer.f(*timer.args, **timer.kwargs)
+            except Exception:
+                log.err()
+
+            if timer.interval is not None and timer.bucket is None:
+                self.insert(timer, timer.interval)
@@ -18,6 +18,7 @@ from bravo.errors import ChunkNotLoaded, SerializerReadException
 from bravo.ibravo import ISerializer, ISerializerFactory
 from bravo.plugin import (retrieve_named_plugins, verify_plugin,
     PluginException)
+from bravo.utilities.compression import Compressor
 from bravo.utilities.coords import split_coords
 from bravo.utilities.temporal import PendingEvent
 
@@ -127,6 +128,13 @@ class World(object):
 
         self._pending_chunks = dict()
 
+        # Chunks with damage which hasn't been sent to players yet. Chunks
+        # add and remove themselves.
+        self.damaged_chunks = set()
+
+        # Compression for both chunk storage and chunk packets.
+        self.compressor = Compressor()
+
     def start(self):
         """
         Load a world from disk.
@@ -142,6 +150,19 @@ class World(object):
             log.msg(pe)
             raise RuntimeError("Fatal error: Couldn't set up serializer!")
 
+        if hasattr(self.serializer, "fsync"):
+            self.serializer.fsync = configuration.getbooleandefault(
+                self.config_name, "fsync", False)
+        if hasattr(self.serializer, "readahead"):
+            self.serializer.readahead = configuration.getintdefault(
+                self.config_name, "readahead", 0)
+
+        self.compressor.level = configuration.getintdefault(self.config_name,
+            "compression", 6)
+        if hasattr(self.serializer, "compressor"):
+            self.serializer.compressor = self.compressor
+        self.compressor.start()
+
         self.seed = random.randint(0, sys.maxint)
 
         # Check if we should offload chunk requests to ampoule.
@@ -188,8 +209,7 @@ class World(object):
         self.chunk_management_loop.stop()
 
         # Flush all dirty chunks to disk.
-        for chunk in self.dirty_chunk_cache.itervalues():
-            self.save_chunk(chunk)
+        self.save_chunks(self.dirty_chunk_cache.values())
 
         # Evict all chunks.
         self.chunk_cache.clear()
@@ -198,6 +218,8 @@ class World(object):
         # Save the level data.
         self.serializer.save_level(self)
 
+        self.compressor.stop()
+
     def enable_cache(self, size):
         """
         Set the permanent cache size.
@@ -251,6 +273,15 @@ class World(object):
             else:
                 self.chunk_cache[coords] = chunk
 
+    def generation_backlog(self):
+        """
+        Get the number of chunks which are waiting to be generated.
+
+        :rtype: int
+        """
+
+        return len(self._pending_chunks)
+
     def save_off(self):
         """
         Disable saving to disk.
@@ -321,6 +352,7 @@ class World(object):
             returnValue(retval)
 
         chunk = Chunk(x, z)
+        chunk.damaged_chunks = self.damaged_chunks
         yield maybeDeferred(self.serializer.load_chunk, chunk)
 
         if chunk.populated:
@@ -407,6 +439,25 @@ class World(object):
 
         chunk.dirty = False
 
+    def save_chunks(self, chunks):
+        """
+        Save many chunks at once.
+
+        Chunks which aren't dirty are skipped.
+        """
+
+        if not self.saving:
+            return
+
+        chunks = [chunk for chunk in chunks if chunk.dirty]
+        if not chunks:
+            return
+
+        self.serializer.save_chunks(chunks)
+
+        for chunk in chunks:
+            chunk.dirty = False
+
     def load_player(self, username):
         """
         Retrieve player data.
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+import sys
+
+from twisted.python.filepath import FilePath
+
+from bravo.nbt import NBTFile
+from bravo.region import (PageAllocator, RegionCompactor, distance_from,
+    morton, read_header, region_coords)
+
+if len(sys.argv) < 2:
+    print "Usage: %s <world> [<threshold>] [morton|spawn]" % sys.argv[0]
+    sys.exit()
+
+world = FilePath(sys.argv[1])
+threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.25
+order = sys.argv[3] if len(sys.argv) > 3 else "morton"
+
+if order == "spawn":
+    level = NBTFile(fileobj=world.child("level.dat").open("r"))
+    spawn = (level["Data"]["SpawnX"].value // 16,
+        level["Data"]["SpawnZ"].value // 16)
+    print "Ordering chunks by distance from spawn at %d, %d" % spawn
+elif order != "morton":
+    print "Unknown order %s" % order
+    sys.exit()
+
+before = after = 0
+
+for fp in sorted(world.child("region").globChildren("r.*.mcr")):
+    handle = fp.open("r")
+    positions = read_header(handle.read(4096))
+    handle.close()
+
+    fragmentation = PageAllocator.from_positions(positions).fragmentation()
+    if fragmentation < threshold:
+        print "%s: %.1f%% free, skipping" % (fp.basename(),
+            fragmentation * 100)
+        continue
+
+    if order == "spawn":
+        key = distance_from(*(region_coords(fp.basename()) + spawn))
+    else:
+        key = morton
+
+    compactor = RegionCompactor(fp, key)
+    compactor.run()
+
+    print "%s: %.1f%% free, %d pages to %d pages" % (fp.basename(),
+        fragmentation * 100, compactor.old_pages, compactor.new_pages)
+    before += compactor.old_pages
+    after += compactor.new_pages
+
+print "Reclaimed %d of %d pages" % (before - after, before)
@@ -2,10 +2,19 @@
 
 import sys
 
-import nbt.nbt
+from bravo.nbt import NBTFile
 
 if len(sys.argv) < 2:
-    print "Usage: %s <file>" % __name__
+    print "Usage: %s <file> [<path/to/tag>]" % sys.argv[0]
+    sys.exit()
 
-f = nbt.nbt.NBTFile(sys.argv[1])
-print f.pretty_tree()
+# Only the tags along the path are decoded; everything else is skipped.
+tag = NBTFile(sys.argv[1], lazy=True)
+
+if len(sys.argv) > 2:
+    for name in sys.argv[2].strip("/").split("/"):
+        if name.isdigit():
+            name = int(name)
+        tag = tag[name] if hasattr(tag, "keys") else tag.tags[name]
+
+print tag.pretty_tree().encode("utf-8")